@@ -1,55 +1,598 @@
+"""Migrate contentful flows to a dialogflow CX agent.
+
+Commands:
+    fetch     download the contentful entries to the local entry store
+    compile   build entity types, intents and flows from the entry store
+    dependents  show the flows, pages, intents and entity types built from the given entries
+    plan      show what a deploy of the compiled data would write
+    validate  check the compiled data against dialogflow references and limits, without calling dialogflow
+    deploy    create or update the compiled data in dialogflow, --shards N from N worker processes
+    shard-worker  deploy the shards of a deploy --shards, from this or another host
+    dedupe-routes  remove the duplicated routes left in dialogflow by previous runs
+    teardown  delete the compiled flows from dialogflow
+    export    export the entries by content type to excel, csv or parquet
+    watch     apply contentful webhooks to dialogflow incrementally
+    run       fetch, compile and deploy in one step (default), --stream deploys while fetching,
+              --flow, --intent and --entity-type deploy only the selected entries
+
+The contentful sdk, the dialogflow libraries and pandas are imported only inside the commands that use them,
+so the commands that work on local files start fast.
+
+--profile and --trace-memory write the collapsed stacks and the top memory allocators of each phase
+to --profile-dir (.cf-to-df/profiles/<time> by default).
+"""
+import argparse
+import contextlib
+import json
 import os
-from services.contentful_service import ContentfulService
-from clients.contentful_client import ContentfulClient
-from clients.dialogflow_client import DialogFlowCXClientFactory
-from services.dialogflow_service import  DialogflowServiceCX
+import time
+
+
+ENTRIES_PATH = '.cf-to-df/entries.json'
+COMPILED_PATH = '.cf-to-df/compiled.json'
+JOURNAL_PATH = '.cf-to-df/journal.jsonl'
+PROFILES_PATH = '.cf-to-df/profiles'
+SHARDS_PATH = '.cf-to-df/shards'
+DEPENDENCIES_PATH = '.cf-to-df/dependencies.json'
+
+
+def phase(profiler, name):
+    """Profile a phase of the command, a no-op context when profiling is off."""
+    return profiler.phase(name) if profiler is not None else contextlib.nullcontext()
+
+
+def contentful_client_from_env():
+    from clients.contentful_client import ContentfulClient
+
+    return ContentfulClient(space_id=os.getenv('CONTENTFUL_SPACE_ID'),
+                            access_token=os.getenv('CONTENTFUL_DELIVERY_API_KEY'),
+                            locales=env_list('CONTENTFUL_LOCALES'))
+
+
+def env_list(name):
+    """Comma separated values of an environment variable, None when it is not set."""
+    values = [value.strip() for value in os.getenv(name, '').split(',') if value.strip()]
+    return values or None
+
+
+def dialogflow_service_from_env(journal=None):
+    from clients.dialogflow_client import DialogFlowCXClientFactory
+    from clients.resource_id_cache import ResourceIdCache
+    from services.dialogflow_service import DialogflowServiceCX
+
+    df_client = DialogFlowCXClientFactory(project_id=os.getenv('DIALOGFLOW_PROJECT_ID'),
+                                          key_file=os.getenv('DIALOGFLOW_CREDENTIALS_PATH'),
+                                          location=os.getenv('DIALOGFLOW_LOCATION'))
+    df_client.warm_up()
+    return DialogflowServiceCX(df_client, os.getenv('DIALOGFLOW_AGENT_NAME'), journal=journal,
+                               agent_id=os.getenv('DIALOGFLOW_AGENT_ID'),
+                               default_flow_id=os.getenv('DIALOGFLOW_DEFAULT_FLOW_ID'),
+                               id_cache=ResourceIdCache())
+
+
+def compile_data(cf_service, profiler=None, flow_budget=None, share_subtrees=True, max_shared_flows=None):
+    from utils.partition_utils import PartitionUtils
+    from utils.subtree_utils import MAX_SHARED_FLOWS, SubtreeUtils
+
+    with phase(profiler, 'entries'):
+        cf_service.all_entries
+    with phase(profiler, 'dataframes'):
+        cf_service.data_ready_to_use
+    with phase(profiler, 'compile'):
+        compiled = {'entity_types': cf_service.entity_types,
+                    'intents': cf_service.intents,
+                    'flows': cf_service.flows_with_subpages,
+                    'faqs': cf_service.faqs,
+                    'quarantined': cf_service.quarantined_flows}
+        if cf_service.selection:
+            # only the selected entries and their links were fetched, the rest of the agent is left as it is
+            compiled['selection'] = cf_service.selection
+        # the default locale is compiled above, the other locales only translate its texts
+        translations = {locale: cf_service.compile_translations(locale) for locale in cf_service.locales[1:]} \
+            if cf_service.is_multi_locale else {}
+        if share_subtrees:
+            # the sub trees repeated in the flows are deployed once, in shared flows
+            compiled['flows'], translations = SubtreeUtils.share_subtrees(
+                compiled['flows'], translations,
+                max_flows=MAX_SHARED_FLOWS if max_shared_flows is None else max_shared_flows)
+        # the flows over the budget are split in sub flows
+        compiled['flows'] = PartitionUtils.partition_flows(compiled['flows'], flow_budget)
+        if cf_service.is_multi_locale:
+            compiled['locales'] = cf_service.locales
+            compiled['translations'] = {locale: PartitionUtils.partition_translations(translation, compiled['flows'])
+                                        for locale, translation in translations.items()}
+        return compiled
+
+
+def load_compiled(path):
+    with open(path, encoding='utf-8') as compiled_file:
+        return json.load(compiled_file)
+
+
+def validate_compiled(compiled, profiler=None):
+    from services.validation_service import ValidationService, ValidationServiceError
+
+    with phase(profiler, 'validate'):
+        report = ValidationService.from_compiled(compiled).validate()
+    if not report.is_valid:
+        print(report.format())
+        raise ValidationServiceError(f'{len(report.errors)} validation errors, nothing was written to dialogflow '
+                                     f'(--skip-validation deploys anyway)')
+
+
+def print_training_report(report):
+    from services.training_service import TrainingServiceCX
+
+    for display_name, result in report.items():
+        seconds = f" in {result['seconds']}s" if 'seconds' in result else ''
+        print(f"{display_name}: {result['status']}{seconds}")
+    TrainingServiceCX.raise_for_failures(report)
+
+
+def deploy(compiled, resume=False, journal_path=JOURNAL_PATH, validate=True, profiler=None, train=True):
+    from services.journal_service import OperationJournal
+
+    if validate:
+        validate_compiled(compiled, profiler=profiler)
+    journal = OperationJournal(path=journal_path, resume=resume)
+    with phase(profiler, 'connect'):
+        df_service = dialogflow_service_from_env(journal=journal)
+    # 1. create entity types
+    with phase(profiler, 'entity_types'):
+        df_service.create_entity_types(entity_types=compiled['entity_types'])
+    # 2. Create intents, the faq intents are synced with the faqs
+    faqs = compiled.get('faqs')
+    intents = compiled['intents'] if faqs is None else \
+        [intent for intent in compiled['intents'] if not intent['intent'].startswith('faq')]
+    with phase(profiler, 'intents'):
+        df_service.create_intents(intents=intents)
+    # 3. Create flows
+    with phase(profiler, 'flows'):
+        df_service.create_flows(flows_list=compiled['flows'])
+        if not compiled.get('selection'):
+            # the shared flows of the sub trees that changed, or are not repeated anymore
+            df_service.delete_unused_shared_flows(compiled['flows'])
+    # 4. Sync faqs as intent routes of the default flow
+    if faqs:
+        from services.faq_service import FaqServiceCX
+
+        with phase(profiler, 'faqs'):
+            if compiled.get('selection'):
+                # the other faqs of the catalog were not fetched, so their routes are kept
+                FaqServiceCX(df_service).upsert(faqs)
+            else:
+                FaqServiceCX(df_service).sync(faqs)
+    translate_and_train(df_service, compiled, journal, profiler=profiler, train=train)
+
+
+def translate_and_train(df_service, compiled, journal, profiler=None, train=True):
+    # 5. Write the texts of the other languages on the resources created above
+    if compiled.get('translations'):
+        from services.translation_service import TranslationServiceCX
+
+        language_codes = dict(code.split('=', 1) for code in env_list('DIALOGFLOW_LANGUAGE_CODES') or [])
+        with phase(profiler, 'translations'):
+            TranslationServiceCX(df_service, language_codes=language_codes).sync(compiled)
+    journal.close()
+    # 6. Train the flows whose content changed since their last training, concurrently
+    if train:
+        from services.training_service import TrainingServiceCX
+
+        with phase(profiler, 'train'):
+            print_training_report(TrainingServiceCX(df_service).train_changed(compiled))
+
+
+def deploy_sharded(compiled, shards, processes, shard_dir, resume=False, journal_path=JOURNAL_PATH, validate=True,
+                   profiler=None, train=True):
+    """Deploy the flows from worker processes, each one running the shard-worker command.
+
+    The workers of other hosts join with python cf-to-df.py shard-worker --shard-dir <shared directory>.
+    """
+    import subprocess
+    import sys
+
+    from services.journal_service import OperationJournal
+    from services.shard_service import ShardService, ShardServiceError
+
+    if validate:
+        validate_compiled(compiled, profiler=profiler)
+    shard_service = ShardService(shard_dir)
+    shard_service.prepare(compiled, shards, resume=resume)
+    with phase(profiler, 'shards'):
+        workers = [subprocess.Popen([sys.executable, os.path.abspath(__file__), 'shard-worker', '--shard-dir', shard_dir])
+                   for _ in range(processes)]
+        for worker in workers:
+            worker.wait()
+        report = shard_service.wait()
+    for task, result in report['tasks'].items():
+        print(f"{task}: {result['status']} by {result['worker']} in {result['seconds']}s")
+    print(f"{len(report['flows'])} flows deployed, {len(report['failed'])} failed")
+
+    journal = OperationJournal(path=journal_path, resume=resume)
+    df_service = dialogflow_service_from_env(journal=journal)
+    # the workers collect the routes of the default start flow, they are written here in one update
+    df_service.add_default_flow_routes(report['default_flow_routes'])
+    if report['failed'] or report['missing']:
+        journal.close()
+        for failure in report['failed']:
+            print(f"{failure.get('flow') or failure.get('task')}: {failure['error']}")
+        raise ShardServiceError(f"{len(report['failed'])} failures and {len(report['missing'])} tasks without report, "
+                                f"deploy --shards {shards} --resume retries them")
+    if not compiled.get('selection'):
+        df_service.delete_unused_shared_flows(compiled['flows'])
+    translate_and_train(df_service, compiled, journal, profiler=profiler, train=train)
+
+
+def contentful_service_from_env(all_content_types=False, selection=None):
+    from services.contentful_service import ContentfulService
+    from services.fetch_service import ROOT_CONTENT_TYPES
+
+    return ContentfulService(contentful_client_from_env(),
+                             root_content_types=None if all_content_types else ROOT_CONTENT_TYPES,
+                             selection=selection)
+
+
+def command_fetch(args):
+    from clients.entry_store_client import EntryStoreClient
+
+    cf_service = contentful_service_from_env(all_content_types=args.all_content_types)
+    with phase(args.profiler, 'fetch'):
+        cf_service.all_entries
+    with phase(args.profiler, 'save'):
+        EntryStoreClient.save(args.entries, cf_service.content_types, cf_service.all_entries,
+                              locales=cf_service.locales)
+    stats = cf_service.client.transport.report()
+    print(', '.join(f'{key}: {value}' for key, value in stats.items()))
+
+
+def command_compile(args):
+    from clients.entry_store_client import EntryStoreClient
+    from services.contentful_service import ContentfulService
+
+    cf_service = ContentfulService(EntryStoreClient(args.entries))
+    compiled = compile_data(cf_service, profiler=args.profiler, flow_budget=flow_budget_from_args(args),
+                            share_subtrees=not args.no_shared_subtrees, max_shared_flows=args.max_shared_flows)
+    directory = os.path.dirname(args.output)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(args.output, 'w', encoding='utf-8') as compiled_file:
+        json.dump(compiled, compiled_file, ensure_ascii=False, default=str)
+    print(f"Compiled {len(compiled['entity_types'])} entity types, {len(compiled['intents'])} intents, "
+          f"{len(compiled['flows'])} flows and {len(compiled['faqs'])} faqs to {args.output}")
+    for flow in compiled['quarantined']:
+        print(f"Quarantined flow {flow['key'] or flow['id']}: {'; '.join(flow['errors'])}")
+    cf_service.dependency_index.save(args.dependencies)
+    if compiled.get('translations'):
+        print(f"Translated to {', '.join(compiled['translations'])}")
+
+
+def command_dependents(args):
+    from services.dependency_service import DependencyIndex
+
+    affected = DependencyIndex.load(args.dependencies).affected(args.entry_ids)
+    if args.json:
+        print(json.dumps({kind: sorted(names) for kind, names in affected.items()}, indent=2, ensure_ascii=False))
+        return
+    for kind, names in affected.items():
+        print(f"{kind}: {', '.join(sorted(names)) if names else '-'}")
+
+
+def command_plan(args):
+    from utils.route_utils import RouteUtils
+
+    compiled = load_compiled(args.compiled)
+    # sub flows and shared flows have no start page, and a page with target_flow is written in the flow it targets
+    pages = sum((0 if flow.get('entry_page') else 1) +
+                len([page for page in flow['subpages'] if page['parent'] is not None and not page.get('target_flow')])
+                for flow in compiled['flows'])
+    routes = route_groups = 0
+    for flow in compiled['flows']:
+        page_routes, groups, _ = RouteUtils.plan_route_groups(RouteUtils.plan_page_routes(flow['subpages']),
+                                                              flow_name=flow['display_name'])
+        routes += sum(len(flow_routes) for flow_routes in page_routes.values()) + \
+            sum(len(group_routes) for group_routes in groups.values())
+        route_groups += len(groups)
+    print(f"entity types: {len(compiled['entity_types'])}")
+    print(f"intents:      {len(compiled['intents'])}")
+    print(f"flows:        {len(compiled['flows'])}")
+    print(f"faqs:         {len(compiled.get('faqs', []))}")
+    print(f"pages:        {pages}")
+    print(f"routes:       {routes}")
+    print(f"route groups: {route_groups}")
+    if compiled.get('locales'):
+        print(f"locales:      {', '.join(compiled['locales'])}")
+
+
+def command_validate(args):
+    from services.validation_service import ValidationService
+
+    report = ValidationService.from_compiled(load_compiled(args.compiled)).validate()
+    print(json.dumps(report.to_dict(), ensure_ascii=False, indent=2) if args.json else report.format())
+    if not report.is_valid:
+        raise SystemExit(1)
+
+
+def command_deploy(args):
+    if args.shards:
+        return deploy_sharded(load_compiled(args.compiled), args.shards,
+                              args.shards if args.processes is None else args.processes, args.shard_dir,
+                              resume=args.resume, journal_path=args.journal, validate=not args.skip_validation,
+                              profiler=args.profiler, train=not args.skip_training)
+    deploy(load_compiled(args.compiled), resume=args.resume, journal_path=args.journal,
+           validate=not args.skip_validation, profiler=args.profiler, train=not args.skip_training)
+
+
+def command_shard_worker(args):
+    from services.shard_service import ShardService
+
+    done = ShardService(args.shard_dir, df_service_factory=dialogflow_service_from_env).run_worker()
+    for task, status in done.items():
+        print(f'{task}: {status}')
+
+
+def command_dedupe_routes(args):
+    stats = dialogflow_service_from_env().dedupe_routes()
+    print(', '.join(f'{key}: {value}' for key, value in stats.items()))
+
+
+def command_teardown(args):
+    compiled = load_compiled(args.compiled)
+    df_service = dialogflow_service_from_env()
+    for flow in compiled['flows']:
+        df_service.delete_flow(flow['display_name'])
+
+
+def command_export(args):
+    from clients.entry_store_client import EntryStoreClient
+    from services.contentful_service import ContentfulService
+    from services.export_service import ExportService
+
+    cf_service = ContentfulService(EntryStoreClient(args.entries))
+    output = args.output or ('output.xlsx' if args.format == 'xlsx' else 'output')
+    with phase(args.profiler, 'export'):
+        paths = ExportService(cf_service, row_group_size=args.row_group_size).export(output, file_format=args.format)
+    for path in paths:
+        print(f'Exported {path}')
+
+
+def command_watch(args):
+    from services.watch_service import WatchService
+
+    cf_service = contentful_service_from_env()
+    df_service = dialogflow_service_from_env()
+    # warm the entry store before the first webhook arrives
+    cf_service.data_ready_to_use
+    cf_service.dependency_index.save(DEPENDENCIES_PATH)
+    watch_service = WatchService(cf_service, df_service, host=args.host, port=args.port,
+                                 debounce_seconds=args.debounce,
+                                 secret=os.getenv('CONTENTFUL_WEBHOOK_SECRET'),
+                                 dependencies_path=DEPENDENCIES_PATH)
+    watch_service.serve_forever()
+
+
+def command_run(args):
+    selection = selection_from_args(args)
+    cf_service = contentful_service_from_env(selection=selection)
+    if args.stream:
+        if cf_service.is_multi_locale:
+            print('--stream deploys the default locale only, running the batch deploy for the translations')
+        elif selection:
+            print('--stream deploys the whole space, running the batch deploy for the selected entries')
+        else:
+            return stream(cf_service, args)
+    compiled = compile_data(cf_service, profiler=args.profiler, flow_budget=flow_budget_from_args(args),
+                            share_subtrees=not args.no_shared_subtrees, max_shared_flows=args.max_shared_flows)
+    if selection:
+        print(f"Selected {len(compiled['flows'])} flows, {len(compiled['faqs'])} faqs and "
+              f"{len(compiled['entity_types'])} entity types")
+    else:
+        # the index of a selective run would only have the selected entries
+        cf_service.dependency_index.save(DEPENDENCIES_PATH)
+    cf_service.client.transport.report()
+    deploy(compiled, resume=args.resume, journal_path=args.journal, validate=not args.skip_validation,
+           profiler=args.profiler, train=not args.skip_training)
+
+
+def stream(cf_service, args):
+    from services.journal_service import OperationJournal
+    from services.pipeline_service import PipelineService
+
+    journal = OperationJournal(path=args.journal, resume=args.resume)
+    df_service = dialogflow_service_from_env(journal=journal)
+    try:
+        stats = PipelineService(cf_service, df_service, queue_size=args.queue_size,
+                                train=not args.skip_training, flow_budget=flow_budget_from_args(args)).run()
+    finally:
+        journal.close()
+    training = stats.pop('training', {})
+    for name, counter in stats.items():
+        print(f"{name}: {counter['items']} items in {counter['seconds']}s, {counter['items_per_second']}/s busy, "
+              f"blocked {counter['blocked_seconds']}s, idle {counter['idle_seconds']}s")
+    print_training_report(training)
+
+
+def add_deploy_arguments(parser):
+    parser.add_argument('--resume', action='store_true',
+                        help='skip the operations already recorded in the journal by a previous run')
+    parser.add_argument('--journal', default=JOURNAL_PATH, help='path of the append-only operation journal')
+    parser.add_argument('--skip-validation', action='store_true', help='deploy even if the compiled data has errors')
+    parser.add_argument('--skip-training', action='store_true', help="don't train the flows changed by the deploy")
+
+
+def suppress_top_level_defaults(command_parser, parser):
+    """Leave the options of a command that are also top-level options out of the namespace when not given.
+
+    A command parser sets the defaults of all its options, after the top-level parser: without this,
+    python cf-to-df.py --resume run would not resume, because run sets resume back to False.
+    """
+    top_level = {action.dest for action in parser._actions if action.dest != 'help'}
+    for action in command_parser._actions:
+        if action.dest in top_level:
+            action.default = argparse.SUPPRESS
+
+
+def add_stream_arguments(parser):
+    parser.add_argument('--stream', action='store_true',
+                        help='deploy each flow as soon as its entries are fetched, without validating the whole data')
+    parser.add_argument('--queue-size', type=int, default=1000, help='items waiting between two --stream stages')
+
+
+def add_selection_arguments(parser):
+    parser.add_argument('--flow', action='append', dest='flows', metavar='KEY',
+                        help='fetch, compile and deploy only this flow and the entries it links to (repeatable)')
+    parser.add_argument('--intent', action='append', dest='intents', metavar='INTENT',
+                        help='fetch, compile and deploy only the flows or faqs of this intent (repeatable)')
+    parser.add_argument('--entity-type', action='append', dest='entity_types', metavar='NAME',
+                        help='fetch, compile and deploy only this entity type (repeatable)')
+
+
+def selection_from_args(args):
+    """The --flow, --intent and --entity-type names given by selector, None to deploy the whole space."""
+    selection = {selector: getattr(args, selector) for selector in ('flows', 'intents', 'entity_types')
+                 if getattr(args, selector, None)}
+    return selection or None
+
+
+def add_partition_arguments(parser):
+    parser.add_argument('--max-flow-pages', type=int, help='pages of a flow above which it is split in sub flows')
+    parser.add_argument('--max-flow-routes', type=int, help='routes of a flow above which it is split in sub flows')
+    parser.add_argument('--max-flow-bytes', type=int, help='json bytes of a flow above which it is split in sub flows')
+    parser.add_argument('--no-shared-subtrees', action='store_true',
+                        help='write the sub trees repeated in the flows in each flow, instead of once in a shared flow')
+    parser.add_argument('--max-shared-flows', type=int,
+                        help='shared flows written at most (20), the smaller repeated sub trees stay in each flow')
+
+
+def flow_budget_from_args(args):
+    """The --max-flow-* options given, they replace the limits of utils.partition_utils.FLOW_BUDGET."""
+    budget = {'pages': args.max_flow_pages, 'routes': args.max_flow_routes, 'bytes': args.max_flow_bytes}
+    return {key: value for key, value in budget.items() if value is not None}
+
+
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', action='store_true',
+                        help='write the collapsed stacks of each phase, for flamegraph.pl or speedscope')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='write the top memory allocators of each phase')
+    parser.add_argument('--profile-dir', help=f'directory of the profiles, defaults to {PROFILES_PATH}/<time>')
+
+
+def profiler_from_args(args):
+    if not (args.profile or args.trace_memory):
+        return None
+    from services.profiling_service import PhaseProfiler
+
+    run_directory = args.profile_dir or os.path.join(PROFILES_PATH, time.strftime('%Y%m%d-%H%M%S'))
+    return PhaseProfiler(run_directory, profile=args.profile, trace_memory=args.trace_memory)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Migrate contentful flows to dialogflow CX')
+    parser.set_defaults(command=command_run)
+    # options of the default run command, kept for python cf-to-df.py --resume
+    add_deploy_arguments(parser)
+    add_stream_arguments(parser)
+    add_selection_arguments(parser)
+    add_partition_arguments(parser)
+    add_profile_arguments(parser)
+    subparsers = parser.add_subparsers(title='commands')
+
+    fetch_parser = subparsers.add_parser('fetch', help='download the contentful entries to the entry store')
+    fetch_parser.add_argument('--entries', default=ENTRIES_PATH, help='path of the entry store')
+    fetch_parser.add_argument('--all-content-types', action='store_true',
+                              help='fetch every content type with all fields, not only the ones used by the migration')
+    add_profile_arguments(fetch_parser)
+    fetch_parser.set_defaults(command=command_fetch)
+
+    compile_parser = subparsers.add_parser('compile', help='build the dialogflow data from the entry store')
+    compile_parser.add_argument('--entries', default=ENTRIES_PATH, help='path of the entry store')
+    compile_parser.add_argument('--output', default=COMPILED_PATH, help='path of the compiled data')
+    compile_parser.add_argument('--dependencies', default=DEPENDENCIES_PATH,
+                                help='path of the index from each entry to the resources built from it')
+    add_partition_arguments(compile_parser)
+    add_profile_arguments(compile_parser)
+    compile_parser.set_defaults(command=command_compile)
+
+    dependents_parser = subparsers.add_parser('dependents',
+                                              help='show the resources to rebuild when the given entries change')
+    dependents_parser.add_argument('entry_ids', nargs='+', help='ids of the changed contentful entries')
+    dependents_parser.add_argument('--dependencies', default=DEPENDENCIES_PATH,
+                                   help='path of the index saved by compile, run or watch')
+    dependents_parser.add_argument('--json', action='store_true', help='print the resources as json')
+    dependents_parser.set_defaults(command=command_dependents)
+
+    plan_parser = subparsers.add_parser('plan', help='show what a deploy of the compiled data would write')
+    plan_parser.add_argument('--compiled', default=COMPILED_PATH, help='path of the compiled data')
+    plan_parser.set_defaults(command=command_plan)
+
+    validate_parser = subparsers.add_parser('validate', help='check the compiled data without calling dialogflow')
+    validate_parser.add_argument('--compiled', default=COMPILED_PATH, help='path of the compiled data')
+    validate_parser.add_argument('--json', action='store_true', help='print the report as json')
+    validate_parser.set_defaults(command=command_validate)
+
+    for name, command, help_text in (('deploy', command_deploy, 'create or update the compiled data in dialogflow'),
+                                     ('run', command_run, 'fetch, compile and deploy in one step')):
+        deploy_parser = subparsers.add_parser(name, help=help_text)
+        if name == 'deploy':
+            deploy_parser.add_argument('--compiled', default=COMPILED_PATH, help='path of the compiled data')
+        add_deploy_arguments(deploy_parser)
+        if name == 'deploy':
+            deploy_parser.add_argument('--shards', type=int,
+                                       help='split the flows in this many shards, deployed by worker processes')
+            deploy_parser.add_argument('--processes', type=int,
+                                       help='local worker processes of --shards, defaults to one by shard '
+                                            '(0 leaves the shards to shard-worker commands on other hosts)')
+            deploy_parser.add_argument('--shard-dir', default=SHARDS_PATH,
+                                       help='work directory of --shards, shared with the workers of other hosts')
+        if name == 'run':
+            add_stream_arguments(deploy_parser)
+            add_selection_arguments(deploy_parser)
+            add_partition_arguments(deploy_parser)
+        add_profile_arguments(deploy_parser)
+        deploy_parser.set_defaults(command=command)
+
+    shard_worker_parser = subparsers.add_parser('shard-worker', help='deploy the shards of a deploy --shards')
+    shard_worker_parser.add_argument('--shard-dir', default=SHARDS_PATH, help='work directory of the sharded deploy')
+    shard_worker_parser.set_defaults(command=command_shard_worker)
+
+    dedupe_parser = subparsers.add_parser('dedupe-routes',
+                                          help='remove the duplicated routes of the flows, pages and route groups')
+    dedupe_parser.set_defaults(command=command_dedupe_routes)
+
+    teardown_parser = subparsers.add_parser('teardown', help='delete the compiled flows from dialogflow')
+    teardown_parser.add_argument('--compiled', default=COMPILED_PATH, help='path of the compiled data')
+    teardown_parser.set_defaults(command=command_teardown)
+
+    export_parser = subparsers.add_parser('export', help='export the entries by content type to excel, csv or parquet')
+    export_parser.add_argument('--entries', default=ENTRIES_PATH, help='path of the entry store')
+    export_parser.add_argument('--format', default='xlsx', choices=['xlsx', 'csv', 'parquet'])
+    export_parser.add_argument('--output', help='excel file, or directory for csv and parquet files')
+    export_parser.add_argument('--row-group-size', type=int, default=1000, help='rows by parquet row group')
+    add_profile_arguments(export_parser)
+    export_parser.set_defaults(command=command_export)
+
+    watch_parser = subparsers.add_parser('watch', help='apply contentful webhooks to dialogflow incrementally')
+    watch_parser.add_argument('--host', default='127.0.0.1', help='webhook endpoint host')
+    watch_parser.add_argument('--port', type=int, default=8080, help='webhook endpoint port')
+    watch_parser.add_argument('--debounce', type=float, default=2.0,
+                              help='seconds without new webhooks before the changes are applied')
+    watch_parser.set_defaults(command=command_watch)
+
+    for command_parser in subparsers.choices.values():
+        suppress_top_level_defaults(command_parser, parser)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.profiler = profiler_from_args(args)
+    try:
+        args.command(args)
+    finally:
+        if args.profiler is not None:
+            args.profiler.close()
+            print(f'Profiles written to {args.profiler.run_directory}')
 
 
 if __name__ == '__main__':
-    CONTENTFUL_DELIVERY_API_KEY = os.getenv('CONTENTFUL_DELIVERY_API_KEY')
-    CONTENTFUL_SPACE_ID = os.getenv('CONTENTFUL_SPACE_ID')
-    
-    DIALOGFLOW_AGENT_NAME = os.getenv('DIALOGFLOW_AGENT_NAME')
-    DIALOGFLOW_AGENT_ID = os.getenv('DIALOGFLOW_AGENT_ID')
-    DIALOGFLOW_CREDENTIALS_PATH = os.getenv('DIALOGFLOW_CREDENTIALS_PATH')
-    DIALOGFLOW_PROJECT_ID = os.getenv('DIALOGFLOW_PROJECT_ID')
-    DIALOGFLOW_LOCATION = os.getenv('DIALOGFLOW_LOCATION')
-
-    # 1. contentful connection
-    contentful_client = ContentfulClient(space_id=CONTENTFUL_SPACE_ID,
-                                         access_token=CONTENTFUL_DELIVERY_API_KEY)
-    cf_service = ContentfulService(contentful_client)
-    
-    # 2. dialogflow connection
-    df_client = DialogFlowCXClientFactory(project_id=DIALOGFLOW_PROJECT_ID,
-                                          key_file=DIALOGFLOW_CREDENTIALS_PATH,
-                                          location=DIALOGFLOW_LOCATION)
-    df_service = DialogflowServiceCX(df_client, DIALOGFLOW_AGENT_NAME)
-
-    # 3. Get contentful data
-    # 3.1 entity_types: 
-    entity_types = cf_service.entity_types
-    # 3.2 intents:
-    intents = cf_service.intents
-    # 3.3 flows: 
-    flows = cf_service.flows_with_subpages
-    
-    # 4. Create or update dialog flow data
-    # 4.1 create entity types
-    df_service.create_entity_types(entity_types=entity_types)
-    # 4.2 Create intents
-    df_service.create_intents(intents=intents)
-    # 4.3 Create flows
-    df_service.create_flows(flows_list=flows)
-    # 4.4 Create faq. pages 
-    # TODO
-    # flows_with_faq = [flow for flow in flows if flow['intent'].startswith('faq') if 'intent' in flow]
-
-
-    
-
-
-    
-    
-    
-    
+    main()
@@ -0,0 +1,68 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, it only makes parsing faster
+    orjson = None
+
+
+def parse_json(content):
+    """Parse a json document from bytes or str, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+class CompactEntry:
+    """Compact record of a contentful entry, built from the raw CDA json.
+
+    It only keeps the sys fields used by the migration and the entry fields, so the contentful.Entry
+    objects built by the sdk (and their sys, metadata and link caches) don't have to be kept in memory.
+    """
+
+    __slots__ = ('id', 'type', 'content_type_id', 'locale', 'revision', 'fields')
+
+    def __init__(self, id, type, content_type_id, locale, revision, fields):
+        self.id = id
+        self.type = type
+        self.content_type_id = content_type_id
+        self.locale = locale
+        self.revision = revision
+        self.fields = fields
+
+    @classmethod
+    def from_raw(cls, raw: dict):
+        """Project the raw CDA json of an entry, or the raw attribute of a contentful.Entry."""
+        sys = raw['sys']
+        return cls(id=sys['id'],
+                   type=sys.get('type', 'Entry'),
+                   content_type_id=sys['contentType']['sys']['id'],
+                   locale=sys.get('locale'),
+                   revision=sys.get('revision'),
+                   fields=raw.get('fields', {}))
+
+    def to_raw(self) -> dict:
+        """Raw CDA json with only the projected fields, as saved in the entry store."""
+        return {'sys': {'id': self.id,
+                        'type': self.type,
+                        'contentType': {'sys': {'type': 'Link', 'linkType': 'ContentType', 'id': self.content_type_id}},
+                        'locale': self.locale,
+                        'revision': self.revision},
+                'fields': self.fields}
+
+    def localize(self, locale: str, fallback_locale: str = None):
+        """Entry with the field values of one locale, from an entry fetched with all its locales (locale='*').
+
+        A field without a value in the locale takes the value of fallback_locale, the default locale,
+        like the delivery api does when it is asked for a single locale.
+        """
+        fields = {}
+        for name, values in self.fields.items():
+            if not isinstance(values, dict):
+                fields[name] = values
+            elif locale in values:
+                fields[name] = values[locale]
+            elif fallback_locale in values:
+                fields[name] = values[fallback_locale]
+        return CompactEntry(id=self.id, type=self.type, content_type_id=self.content_type_id, locale=locale,
+                            revision=self.revision, fields=fields)
@@ -1,37 +1,121 @@
 import logging
 import sys
 from abc import ABC, abstractmethod
-from contentful import Client
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from urllib.parse import quote
+
+from clients.compact_entry import CompactEntry, parse_json
+from clients.contentful_transport import ContentfulTransport
 
 logging.basicConfig(level=logging.ERROR)
 
+# characters of the ids of one sys.id[in] query once url encoded, contentful rejects urls over 7600 characters
+MAX_IDS_QUERY_LENGTH = 6000
+# sys.id[in] queries sent at the same time
+MAX_CONCURRENT_ID_QUERIES = 4
+
 
 class ContentfulClient:
     
-    def __init__(self, space_id, access_token, environment='master'):
+    def __init__(self, space_id, access_token, environment='master', api_url='cdn.contentful.com',
+                 max_include_depth=2, transport=None, https=True, locales=None):
+        """
+        Args:
+            locales (list, optional): locales of the entries, the first one is the default locale. With more than
+                one locale, the entries are fetched with all their locales in one pass (locale='*'). Defaults to
+                None, the default locale of the space.
+        """
         self._client = None
         self.space_id = space_id
         self.access_token = access_token
         self.environment = environment
+        self.api_url = api_url
+        self.max_include_depth = max_include_depth
+        self.https = https
+        self.locales = list(locales) if locales else None
+        # all clients share one connection pool and http cache, unless a transport is given
+        self.transport = transport if transport is not None else ContentfulTransport.shared()
         
     @property
     def client(self):
         if self._client == None:
+            from contentful import Client  # only needed by entries(), the other methods use the transport
+
             try:
                 self._client = Client(space_id=self.space_id,
                                       access_token=self.access_token,
                                       environment=self.environment,
-                                      max_include_resolution_depth=20)
+                                      max_include_resolution_depth=self.max_include_depth)
             except Exception as e:
                 logging.error("Cannot connect to contentful client: %s", str(e))
                 sys.exit(1)
-            return self._client
+        return self._client
     
     def content_types(self):
-        return self.client.content_types()
+        response = self._get('content_types', {'limit': 1000})
+        return SimpleNamespace(items=[SimpleNamespace(id=content_type['sys']['id'], raw=content_type)
+                                      for content_type in response['items']])
 
     def entries(self, limit=1000):
         return self.client.entries({'limit': limit})
-    
-    
 
+    def compact_entries(self, limit=1000, query=None):
+        """Fetch all pages of entries as raw json and project them to CompactEntry records.
+
+        The sdk is not used here, so no contentful.Entry objects are built. Links are not included
+        (include=0) because all the entries are fetched anyway. With several locales, the fields of
+        the entries map each locale to its value.
+        """
+        return list(self.iter_compact_entries(limit=limit, query=query))
+
+    def iter_compact_entries(self, limit=1000, query=None):
+        """Yield the entries of compact_entries page by page, so they can be used before the last page arrives."""
+        skip = 0
+        while True:
+            page = self._get('entries', {'include': 0, **self._locale_query(), **(query or {}),
+                                         'limit': limit, 'skip': skip})
+            yield from (CompactEntry.from_raw(raw) for raw in page['items'])
+            skip += len(page['items'])
+            if not page['items'] or skip >= page['total']:
+                return
+
+    def entries_by_ids(self, ids, limit=1000):
+        """Fetch entries by id, with as many ids by sys.id[in] query as the url allows, the queries concurrently."""
+        batches = self.id_batches(ids, max_ids=limit)
+        if len(batches) <= 1:
+            return [entry for batch in batches for entry in self.compact_entries(limit=limit, query={'sys.id[in]': ','.join(batch)})]
+        with ThreadPoolExecutor(max_workers=min(len(batches), MAX_CONCURRENT_ID_QUERIES)) as executor:
+            pages = executor.map(lambda batch: self.compact_entries(limit=limit, query={'sys.id[in]': ','.join(batch)}),
+                                 batches)
+            return [entry for page in pages for entry in page]
+
+    @staticmethod
+    def id_batches(ids, max_length=MAX_IDS_QUERY_LENGTH, max_ids=1000) -> list[list]:
+        """Split the ids in the fewest batches whose url encoded list fits in max_length, max_ids ids each."""
+        batches = []
+        length = 0
+        for entry_id in dict.fromkeys(ids):
+            # the comma separating the ids is encoded as %2C
+            id_length = len(quote(entry_id, safe='')) + 3
+            if not batches or length + id_length > max_length or len(batches[-1]) >= max_ids:
+                batches.append([])
+                length = 0
+            batches[-1].append(entry_id)
+            length += id_length
+        return batches
+
+    def _locale_query(self):
+        if not self.locales:
+            return {}
+        return {'locale': '*' if len(self.locales) > 1 else self.locales[0]}
+
+    def _get(self, path, params):
+        scheme = 'https' if self.https else 'http'
+        url = f'{scheme}://{self.api_url}/spaces/{self.space_id}/environments/{self.environment}/{path}'
+        try:
+            content = self.transport.get(url, params=params, headers={'Authorization': f'Bearer {self.access_token}'})
+        except Exception as e:
+            logging.error("Cannot get %s from contentful: %s", path, str(e))
+            raise
+        return parse_json(content)
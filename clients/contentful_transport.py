@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import threading
+from urllib.parse import urlencode
+
+from loggers.logger import get_logger
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+class ContentfulTransportError(Exception):
+    """Custom exception for ContentfulTransport class."""
+    pass
+
+
+class ContentfulTransport:
+    """HTTP transport for the contentful delivery api.
+
+    - One keep-alive connection pool shared by every ContentfulClient (see ContentfulTransport.shared).
+    - Compressed responses: gzip and deflate, and brotli when the brotli package is installed.
+    - HTTP/2 when httpx and h2 are installed, HTTP/1.1 with requests otherwise.
+    - Conditional requests: the ETag of each response is saved with its body in cache_directory, and the
+      next request sends If-None-Match, so unchanged pages come back as an empty 304 between runs.
+    """
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, cache_directory='.cf-to-df/http_cache', pool_size=10, timeout=30, http2=True):
+        self.cache_directory = cache_directory
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'not_modified': 0, 'bytes_transferred': 0, 'bytes_decoded': 0,
+                       'http2_responses': 0}
+        self._adapter = None
+        self._client = self._build_httpx_client() if http2 else None
+        self._session = None if self._client is not None else self._build_requests_session()
+
+    @classmethod
+    def shared(cls):
+        """Transport shared by all the clients of the process."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    @property
+    def backend(self):
+        return 'httpx' if self._client is not None else 'requests'
+
+    def get(self, url: str, params: dict = None, headers: dict = None) -> bytes:
+        """GET an url and return the decoded body, from the cache when the server answers 304."""
+        headers = dict(headers or {})
+        cache_path = self._cache_path(url, params, headers)
+        cached = self._read_cache(cache_path)
+        if cached is not None:
+            headers['If-None-Match'] = cached['etag']
+
+        try:
+            status, response_headers, body, wire_bytes, http_version = self._request(url, params, headers)
+        except Exception as e:
+            error_logger.error(f'error trying to get {url}: {e}')
+            raise ContentfulTransportError(f'Failed to get {url}: {e}')
+
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['bytes_transferred'] += wire_bytes
+            self._stats['bytes_decoded'] += len(body)
+            if http_version == 'HTTP/2':
+                self._stats['http2_responses'] += 1
+            if status == 304:
+                self._stats['not_modified'] += 1
+
+        if status == 304 and cached is not None:
+            debug_logger.debug(f'Not modified: {url}')
+            return cached['body'].encode('utf-8')
+        if status >= 400:
+            raise ContentfulTransportError(f'Failed to get {url}: HTTP {status} {body[:200]!r}')
+        etag = response_headers.get('ETag') or response_headers.get('etag')
+        if etag:
+            self._write_cache(cache_path, etag, body)
+        return body
+
+    def stats(self) -> dict:
+        """Requests, 304 responses, bytes on the wire and decoded, and connections opened and reused."""
+        with self._lock:
+            stats = dict(self._stats)
+        if self._session is not None:
+            pools = self._adapter.poolmanager.pools
+            pools = [pools[key] for key in pools.keys()]
+            stats['connections'] = sum(pool.num_connections for pool in pools)
+            stats['reused_connections'] = max(stats['requests'] - stats['connections'], 0)
+        return stats
+
+    def report(self):
+        stats = self.stats()
+        info_logger.info('Contentful transport (' + self.backend + '): ' +
+                         ', '.join(f'{key}={value}' for key, value in stats.items()))
+        return stats
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+        if self._session is not None:
+            self._session.close()
+
+    def _request(self, url, params, headers):
+        if self._client is not None:
+            response = self._client.get(url, params=params, headers=headers)
+            return (response.status_code, response.headers, response.content,
+                    response.num_bytes_downloaded, response.http_version)
+
+        response = self._session.get(url, params=params, headers=headers, timeout=self.timeout)
+        body = response.content
+        # tell() is the number of bytes read from the socket, before decompression
+        wire_bytes = response.raw.tell() if response.raw is not None else len(body)
+        return response.status_code, response.headers, body, wire_bytes, 'HTTP/1.1'
+
+    def _build_httpx_client(self):
+        try:
+            import h2  # noqa: F401  httpx needs h2 for HTTP/2
+            import httpx
+        except ImportError:
+            return None
+        return httpx.Client(http2=True, timeout=self.timeout,
+                            headers={'Accept-Encoding': self._accept_encoding()},
+                            limits=httpx.Limits(max_connections=self.pool_size,
+                                                max_keepalive_connections=self.pool_size))
+
+    def _build_requests_session(self):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        self._adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount('https://', self._adapter)
+        session.mount('http://', self._adapter)
+        session.headers['Accept-Encoding'] = self._accept_encoding()
+        return session
+
+    @staticmethod
+    def _accept_encoding():
+        # urllib3 only announces br when a brotli decoder is installed
+        from urllib3.util.request import ACCEPT_ENCODING
+
+        return ACCEPT_ENCODING
+
+    def _cache_path(self, url, params, headers):
+        if not self.cache_directory:
+            return None
+        # the access token is part of the key, so spaces or tokens never share cached pages
+        key = url + '?' + urlencode(sorted((params or {}).items())) + headers.get('Authorization', '')
+        return os.path.join(self.cache_directory, hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _read_cache(self, cache_path):
+        if cache_path is None or not os.path.exists(cache_path):
+            return None
+        try:
+            with open(cache_path, encoding='utf-8') as cache_file:
+                return json.load(cache_file)
+        except (OSError, ValueError) as e:
+            error_logger.warning(f'Ignoring unreadable http cache file {cache_path}: {e}')
+            return None
+
+    def _write_cache(self, cache_path, etag, body):
+        if cache_path is None:
+            return
+        os.makedirs(self.cache_directory, exist_ok=True)
+        # write and rename, so concurrent or interrupted runs never read half a file
+        temporary_path = f'{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as cache_file:
+            json.dump({'etag': etag, 'body': body.decode('utf-8')}, cache_file, ensure_ascii=False)
+        os.replace(temporary_path, cache_path)
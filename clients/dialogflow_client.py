@@ -1,4 +1,5 @@
 
+import re
 import time        
 from abc import ABC, abstractmethod
 
@@ -7,7 +8,9 @@ from google.oauth2 import service_account
 from google.cloud import  dialogflowcx_v3beta1 as dialogflowcx
 from google.protobuf import field_mask_pb2 as field_mask
 
+from clients.grpc_channel_pool import CHANNEL_OPTIONS, GrpcChannelPool
 from loggers.logger import get_logger
+from utils.entity_utils import EntityUtils, MAX_ENTITIES_PER_TYPE, MAX_ENTITY_TYPE_BYTES
 from utils.utils_dialogflow import DialogFlowUtils
 
 
@@ -18,13 +21,16 @@ debug_logger = get_logger("debug")
     
 class DialogFlowCXClientFactory:
 
-    def __init__(self, project_id, key_file, location):
+    def __init__(self, project_id, key_file, location, channel_pool_size=4):
         self.project_id = project_id
         self.key_file = key_file
         self.location = location
         self.credentials = service_account.Credentials.from_service_account_file(self.key_file)
-        self.client_options = {"api_endpoint": f"{self.location}-dialogflow.googleapis.com"}
+        self.api_endpoint = f"{self.location}-dialogflow.googleapis.com"
+        self.client_options = {"api_endpoint": self.api_endpoint}
         self.base_parent = f'projects/{self.project_id}/locations/{self.location}'
+        # channels to the endpoint of the location, shared by all the service clients
+        self.channel_pool = GrpcChannelPool(self._create_channel, size=channel_pool_size)
     
     @property
     def _credentials(self):
@@ -36,28 +42,44 @@ class DialogFlowCXClientFactory:
                 return None
         return self._credentials
 
+    def _create_channel(self):
+        # all the dialogflow services use the same endpoint and auth scopes, any transport can create the channel
+        transport_class = dialogflowcx.AgentsClient.get_transport_class('grpc')
+        return transport_class.create_channel(f'{self.api_endpoint}:443',
+                                              credentials=self.credentials,
+                                              options=CHANNEL_OPTIONS)
+
+    def _build_client(self, client_class):
+        """Create a service client on the next channel of the pool, without opening a new connection."""
+        transport_class = client_class.get_transport_class('grpc')
+        transport = transport_class(host=self.api_endpoint, channel=self.channel_pool.next_channel())
+        return client_class(transport=transport)
+
+    def warm_up(self, timeout=10):
+        """Open the connections of all the channels in parallel, before the first request."""
+        return self.channel_pool.warm_up(timeout=timeout)
+
     def agents_client(self):
         try:
-            agent_client = dialogflowcx.AgentsClient(credentials=self.credentials, client_options=self.client_options)
+            agent_client = self._build_client(dialogflowcx.AgentsClient)
         except Exception as e:
             error_logger.error("error trying to get agents client")
         return agent_client
     
     def flows_client(self):
-       return dialogflowcx.FlowsClient(credentials=self.credentials, client_options=self.client_options)
+       return self._build_client(dialogflowcx.FlowsClient)
 
     def entity_types_client(self):
-        return dialogflowcx.EntityTypesClient(credentials=self.credentials, client_options=self.client_options)
+        return self._build_client(dialogflowcx.EntityTypesClient)
     
     def intents_client(self):
-        return dialogflowcx.IntentsClient(credentials=self.credentials, client_options=self.client_options)
+        return self._build_client(dialogflowcx.IntentsClient)
     
     def pages_client(self):
-        return dialogflowcx.PagesClient(credentials=self.credentials, client_options=self.client_options)
+        return self._build_client(dialogflowcx.PagesClient)
     
     def transition_route_client(self):
-        return dialogflowcx.TransitionRouteGroupsClient(
-            credentials=self.credentials, client_options=self.client_options)
+        return self._build_client(dialogflowcx.TransitionRouteGroupsClient)
         
     def get_agent_parent(self, agent_id):
         return self.base_parent + f'/agents/{agent_id}'
@@ -71,11 +93,28 @@ class DialogFlowCXClientFactory:
     
 class AgentManager:
     
-    def __init__(self, dialogflow_factory, agent_name):
+    def __init__(self, dialogflow_factory, agent_name, agent_id=None):
         self.dialogflow_factory = dialogflow_factory
         self.client = dialogflow_factory.agents_client()
-        self.agent_id = self._get_agentId_by_name(agent_name)
-        self.parent = dialogflow_factory.get_agent_parent(self.agent_id)
+        self.agent_name = agent_name
+        # the agents are only listed by resolve_agent_id, when the id is not known
+        self.agent_id = agent_id
+        self.parent = dialogflow_factory.get_agent_parent(agent_id) if agent_id else None
+
+    def resolve_agent_id(self):
+        """Find the id of the agent by its display name, with one list call."""
+        self.agent_id = self._get_agentId_by_name(self.agent_name)
+        if self.agent_id is None:
+            raise Exception(f'Agent {self.agent_name} not found')
+        self.parent = self.dialogflow_factory.get_agent_parent(self.agent_id)
+        return self.agent_id
+
+    def get_agent(self):
+        try:
+            return self.client.get_agent(name=self.parent)
+        except Exception as e:
+            error_logger.error(f'Error getting agent {self.parent}: {e}')
+            raise Exception(f'Error getting agent: {e}')
 
     def _get_agentId_by_name(self, agent_name):
         request = dialogflowcx.ListAgentsRequest(parent=self.dialogflow_factory.base_parent)
@@ -97,56 +136,117 @@ class EntityTypeManager:
     def __init__(self, dialogflow_factory, agent_id):
         self.client = dialogflow_factory.entity_types_client()
         self.parent = dialogflow_factory.get_agent_parent(agent_id)
+        # display name -> entity type, listed once and kept up to date with the writes of this manager
+        self._entity_types = None
+
+    def get_entity_types_by_display_name(self, refresh=False) -> dict:
+        if self._entity_types is None or refresh:
+            request = dialogflowcx.ListEntityTypesRequest(parent=self.parent)
+            self._entity_types = {entity_type.display_name: entity_type
+                                  for entity_type in self.client.list_entity_types(request=request)}
+        return self._entity_types
+
+    def refresh(self):
+        """Forget the listed entity types, the next lookup lists them again."""
+        self._entity_types = None
         
     def get_entity_type_by_display_name(self, display_name):
-        
-        request = dialogflowcx.ListEntityTypesRequest(parent=self.parent)
-        entity_types = self.client.list_entity_types(request=request)
-        for entity_type in entity_types:
-            if entity_type.display_name == display_name:
-                return entity_type
-        return None
+        return self.get_entity_types_by_display_name().get(display_name)
+
+    def create_or_update_entity_type(self, display_name, entities_with_synonyms,
+                                     max_entities=MAX_ENTITIES_PER_TYPE, max_bytes=MAX_ENTITY_TYPE_BYTES):
+        """Create or update an entity type with its values normalized and deduplicated.
 
-    def create_or_update_entity_type(self, display_name, entities_with_synonyms):
-        entities = []
+        When the values don't fit in one entity type (max_entities or max_bytes), they are split in
+        sub types named <display_name>-part<n>, and the entity type becomes a list that references them,
+        so the page parameters of the entity type match the values of all the parts. Each entity type
+        is compared with the remote one, and only the changed ones are written.
+
+        Returns:
+            dialogflowcx.EntityType: the entity type with the display name used by the pages.
+        """
         display_name = DialogFlowUtils.clean_display_name(display_name.replace(' ', '-'))
-        for entity in entities_with_synonyms:
-            value = entity['entityValue']
-            synonyms = entity.get('synonyms', [value])
-            entities.append(dialogflowcx.EntityType.Entity(value=value, synonyms=synonyms))
+        entities = EntityUtils.normalize_entities(entities_with_synonyms)
+        chunks = EntityUtils.split_entities(entities, max_entities=max_entities, max_bytes=max_bytes)
+        existing_entity_type = self.get_entity_type_by_display_name(display_name)
+        # the parts of an entity type split by a previous run, the remote entity type is their list
+        was_split = existing_entity_type is not None and existing_entity_type.kind == dialogflowcx.EntityType.Kind.KIND_LIST
+        part_names = []
+        if len(chunks) == 1:
+            entity_type = self._write_entity_type(display_name, chunks[0], dialogflowcx.EntityType.Kind.KIND_MAP)
+        else:
+            part_names = [f'{display_name}-part{index + 1}' for index in range(len(chunks))]
+            info_logger.info(f"Splitting entity type {display_name} with {len(entities)} values in {len(chunks)} parts")
+            for part_name, chunk in zip(part_names, chunks):
+                self._write_entity_type(part_name, chunk, dialogflowcx.EntityType.Kind.KIND_MAP)
+            entity_type = self._write_entity_type(display_name,
+                                                  [{'value': f'@{part_name}', 'synonyms': [f'@{part_name}']}
+                                                   for part_name in part_names],
+                                                  dialogflowcx.EntityType.Kind.KIND_LIST)
+        if was_split or part_names:
+            self._delete_stale_parts(display_name, part_names)
+        return entity_type
+
+    @staticmethod
+    def is_part(name, display_name):
+        """Whether an entity type is one of the parts <display_name>-part<n> written for a split entity type."""
+        return re.fullmatch(rf'{re.escape(display_name)}-part\d+', name) is not None
 
+    def _write_entity_type(self, display_name, entities, kind):
         existing_entity_type = self.get_entity_type_by_display_name(display_name)
+        if existing_entity_type is not None and existing_entity_type.kind == kind and EntityUtils.same_entities(
+                entities, [{'value': entity.value, 'synonyms': list(entity.synonyms)}
+                           for entity in existing_entity_type.entities]):
+            debug_logger.debug(f"Entity type {display_name} unchanged")
+            return existing_entity_type
+
+        dialogflow_entities = [dialogflowcx.EntityType.Entity(value=entity['value'], synonyms=entity['synonyms'])
+                               for entity in entities]
         if existing_entity_type:
             info_logger.info(f"Updating existing entity type: {display_name}")
-            entity_type = self.update_entity_type(existing_entity_type, entities)
+            entity_type = self.update_entity_type(existing_entity_type, dialogflow_entities, kind=kind)
         else:
             info_logger.info(f"Creating entity type {display_name}")
             entity_type = dialogflowcx.EntityType(
                 display_name=display_name,
-                entities=entities,
-                kind=dialogflowcx.EntityType.Kind.KIND_MAP,
+                entities=dialogflow_entities,
+                kind=kind,
                 enable_fuzzy_extraction=True,
             )
             entity_type = self.client.create_entity_type(parent=self.parent, entity_type=entity_type)
+        self.get_entity_types_by_display_name()[display_name] = entity_type
         return entity_type
+
+    def _delete_stale_parts(self, display_name, part_names):
+        entity_types = self.get_entity_types_by_display_name()
+        for name in [name for name in entity_types
+                     if EntityTypeManager.is_part(name, display_name) and name not in part_names]:
+            info_logger.info(f"Deleting entity type {name}, it is not a part of {display_name} anymore")
+            self.client.delete_entity_type(name=entity_types.pop(name).name, force=True)
     
-    def update_entity_type(self, existing_entity_type, entities):
+    def update_entity_type(self, existing_entity_type, entities, kind=None, language_code=None):
         existing_entity_type.entities = entities
-        update_mask = field_mask.FieldMask(paths=["entities"])
+        paths = ["entities"]
+        if kind is not None and existing_entity_type.kind != kind:
+            existing_entity_type.kind = kind
+            paths.append("kind")
+        update_mask = field_mask.FieldMask(paths=paths)
         request = dialogflowcx.UpdateEntityTypeRequest(
             entity_type=existing_entity_type,
-            update_mask=update_mask
+            update_mask=update_mask,
+            language_code=language_code
         )
         return self.client.update_entity_type(request=request)
     
     
 class FlowManager:
     
-    def __init__(self, dialogflow_factory, agent_manager):
+    def __init__(self, dialogflow_factory, agent_manager, default_flow_id=None):
         self.dialogflow_factory = dialogflow_factory
+        self.agent_manager = agent_manager
         self.agent_parent = agent_manager.parent
         self.client = dialogflow_factory.flows_client()
-        self.default_flow_id = self.get_default_flow_id()
+        self.default_flow_id = default_flow_id if default_flow_id else self.get_default_flow_id()
         self.parent = dialogflow_factory.get_flow_parent(agent_manager.agent_id, self.default_flow_id)
 
     def get_flow_by_display_name(self, display_name):
@@ -162,7 +262,31 @@ class FlowManager:
             raise Exception(f'Error getting flow by name: {e}')
         return None
     
+    def get_flows_by_display_name(self) -> dict:
+        """All the flows of the agent in one list call: display name -> flow."""
+        request = dialogflowcx.ListFlowsRequest(parent=self.agent_parent)
+        return {flow.display_name: flow for flow in self.client.list_flows(request=request)}
+
+    def get_flow(self, name):
+        try:
+            return self.client.get_flow(name=name)
+        except Exception as e:
+            error_logger.error(f'Error getting flow {name}: {e}')
+            raise Exception(f'Error getting flow: {e}')
+
+    def update_flow_routes(self, flow):
+        """Update only the transition routes of a flow."""
+        update_mask = field_mask.FieldMask(paths=["transition_routes"])
+        return self.client.update_flow(request=dialogflowcx.UpdateFlowRequest(flow=flow, update_mask=update_mask))
+
     def get_default_flow_id(self):
+        # the agent knows its start flow, so only the agent is read
+        start_flow = self.agent_manager.get_agent().start_flow
+        if start_flow:
+            return start_flow.split('/')[-1]
+        return self._find_default_flow_id()
+
+    def _find_default_flow_id(self):
         try:
             # Listar todos los flujos en el agente
             request = dialogflowcx.ListFlowsRequest(parent=self.agent_parent) 
@@ -209,6 +333,50 @@ class FlowManager:
                 error_logger.error(f"An unexpected error occurred while creating intent {display_name}: {e}")
                 return flow
         
+    @staticmethod
+    def is_part(name, display_name):
+        """Whether a flow is one of the sub flows '<display_name> #<n>' written for a split flow."""
+        return re.fullmatch(rf'{re.escape(display_name)} #\d+', name) is not None
+
+    def delete_stale_parts(self, part_names: dict):
+        """Delete the sub flows of the given flows that are not parts of them anymore.
+
+        Args:
+            part_names (dict): display name of a flow -> display names of the sub flows it was split in now.
+        """
+        flows = self.get_flows_by_display_name()
+        for display_name, names in part_names.items():
+            for name in [name for name in flows if FlowManager.is_part(name, display_name) and name not in names]:
+                info_logger.info(f"Deleting flow {name}, it is not a part of {display_name} anymore")
+                # force=True also removes the transition routes that point to the flow
+                self.client.delete_flow(request=dialogflowcx.DeleteFlowRequest(name=flows.pop(name).name, force=True))
+
+    def delete_unused_flows(self, prefix, used_names) -> list:
+        """Delete the flows whose display name starts with prefix and is not in used_names, returns their names."""
+        flows = self.get_flows_by_display_name()
+        unused_names = sorted(name for name in flows if name.startswith(prefix) and name not in used_names)
+        for name in unused_names:
+            info_logger.info(f"Deleting flow {name}, no flow routes to it anymore")
+            self.client.delete_flow(request=dialogflowcx.DeleteFlowRequest(name=flows[name].name, force=True))
+        return unused_names
+
+    def delete_flow(self, display_name):
+        flow = self.get_flow_by_display_name(display_name)
+        if flow is None:
+            return None
+        try:
+            # force=True also removes the transition routes that point to the flow
+            self.client.delete_flow(request=dialogflowcx.DeleteFlowRequest(name=flow.name, force=True))
+            info_logger.info(f"Deleted flow: {display_name}")
+            return flow
+        except Exception as e:
+            error_logger.error(f'Error deleting flow {display_name}: {e}')
+            raise Exception(f'Error deleting flow: {e}')
+
+    def train_flow(self, name):
+        """Start the training of the NLU model of a flow, returns the long-running operation."""
+        return self.client.train_flow(request=dialogflowcx.TrainFlowRequest(name=name))
+
     def update_flow(self, flow):
         request = dialogflowcx.UpdateFlowRequest(
             flow=flow,
@@ -241,6 +409,10 @@ class IntentManager:
             return self.update_intent(existing_intent, training_phrase)
 
         # If intent does not exist, then create it
+        return self.create_intent(display_name, training_phrase)
+
+    def create_intent(self, display_name: str, training_phrase: str) -> dialogflowcx.Intent:
+        """Create an intent with one training phrase, without looking for an existing one."""
         intent = dialogflowcx.Intent()
         part = dialogflowcx.Intent.TrainingPhrase.Part(text=training_phrase)
         training_phrase_obj = dialogflowcx.Intent.TrainingPhrase(parts=[part], repeat_count=1)
@@ -275,6 +447,11 @@ class IntentManager:
                 return intent
         return None
     
+    def get_intents_by_display_name(self) -> dict:
+        """All the intents of the agent in one list call: display name -> intent."""
+        intents = self.client.list_intents(request={"parent": self.parent})
+        return {intent.display_name: intent for intent in intents}
+
     def get_intents_all(self):
         """
         get all intents for the current agent
@@ -308,6 +485,27 @@ class IntentManager:
         
         return self.client.update_intent(request=request)
 
+    def update_intent_language(self, intent_name, training_phrase, language_code):
+        """Add a training phrase to the phrases of an intent in another language.
+
+        Args:
+            intent_name (str): resource name of the intent.
+            training_phrase (str): training phrase in the language.
+            language_code (str): dialogflow language code, such as en.
+
+        Returns:
+            dialogflowcx.Intent: the intent in the language.
+        """
+        intent = self.client.get_intent(request=dialogflowcx.GetIntentRequest(name=intent_name,
+                                                                              language_code=language_code))
+        if training_phrase in [''.join(part.text for part in phrase.parts) for phrase in intent.training_phrases]:
+            return intent
+        part = dialogflowcx.Intent.TrainingPhrase.Part(text=training_phrase)
+        intent.training_phrases.append(dialogflowcx.Intent.TrainingPhrase(parts=[part], repeat_count=1))
+        request = dialogflowcx.UpdateIntentRequest(intent=intent, language_code=language_code,
+                                                   update_mask=field_mask.FieldMask(paths=["training_phrases"]))
+        return self.client.update_intent(request=request)
+
 
 class PageManager:
     """Manager for handling operations related to Dialogflow Pages."""
@@ -323,6 +521,7 @@ class PageManager:
         """
         self.client = dialogflow_factory.pages_client()
         self.parent_flow = f"{dialogflow_factory.get_agent_parent(agent_id)}/flows/{flow_id}"
+        # the clients share the channels of the factory, so this does not open a new connection
         self.flow_client = dialogflow_factory.flows_client()
 
     def get_page_by_display_name(self, display_name, parent_flow=None):
@@ -343,6 +542,11 @@ class PageManager:
                 return page
         return None
 
+    def get_pages_by_display_name(self, parent_flow) -> dict:
+        """All the pages of a flow in one list call: display name -> page."""
+        request = dialogflowcx.ListPagesRequest(parent=parent_flow)
+        return {page.display_name: page for page in self.client.list_pages(request=request)}
+
     def create_or_update_page(self, page, parent_flow):
         """Create a new page or update an existing one in a flow.
         Args:
@@ -386,6 +590,21 @@ class PageManager:
         except Exception as e:
             error_logger.error(f"Error updating  page {page}: {e} ")
             # raise Exception("Error updating page")
+
+    def update_page_routes(self, page):
+        """Update only the transition routes and route groups of a page."""
+        update_mask = field_mask.FieldMask(paths=["transition_routes", "transition_route_groups"])
+        request = dialogflowcx.UpdatePageRequest(page=page, update_mask=update_mask)
+        try:
+            return self.client.update_page(request=request)
+        except Exception as e:
+            error_logger.error(f"Error updating the routes of page {page.display_name}: {e}")
+    
+    def update_page_language(self, page, paths, language_code):
+        """Update the given fields of a page in another language, the structure of the page is shared."""
+        request = dialogflowcx.UpdatePageRequest(page=page, update_mask=field_mask.FieldMask(paths=paths),
+                                                 language_code=language_code)
+        return self.client.update_page(request=request)
     
     # -------------- functions for development only ---------------------------
     def remove_references_to_page(self, target_page_name):
@@ -446,31 +665,112 @@ class PageManager:
 class TransitionRouteManager:
     
     def __init__(self, dialogflow_factory, flow_client, parent_flow, pages_manager):
-        self.client = dialogflow_factory.transition_route_client()
+        self.dialogflow_factory = dialogflow_factory
+        self._client = None
         self.flow_client = flow_client
         self.pages_manager = pages_manager
         self.parent_flow = parent_flow
     
+    @property
+    def client(self):
+        # created on first use, most runs never use transition route groups
+        if self._client is None:
+            self._client = self.dialogflow_factory.transition_route_client()
+        return self._client
+
     def add_transition_route_to_new_flow(self, intent_name, target_flow_name):
         flow = self.flow_client.get_flow(name=self.parent_flow)
         transition_route = dialogflowcx.TransitionRoute(intent=intent_name, target_flow=target_flow_name)
         return self._add_transition_route(flow, transition_route, target_flow_name)
 
+    def add_transition_routes_to_default_flow(self, routes: list[dict]):
+        """Add the intent -> flow routes to the default start flow, in a single update.
+
+        Args:
+            routes (list[dict]): routes with intent and target_flow resource names.
+
+        Returns:
+            dialogflowcx.Flow: the updated flow, or None when it already had the same routes.
+        """
+        flow = self.flow_client.get_flow(name=self.parent_flow)
+        transition_routes = [dialogflowcx.TransitionRoute(intent=route['intent'], target_flow=route['target_flow'])
+                             for route in routes]
+        info_logger.info(f"Adding {len(transition_routes)} transition routes to the default start flow")
+        return self._reconcile_flow_routes(flow, transition_routes, 'the default start flow')
+
     def set_transition_from_default_start_page(self, intent_name, target_page_name, new_flow):
         transition_route = dialogflowcx.TransitionRoute(intent=intent_name, target_page=target_page_name)
         return self._add_transition_route(new_flow, transition_route, target_page_name)
 
-    def _add_transition_route(self, flow, transition_route, target_name):
-        if not any(route.intent == transition_route.intent for route in flow.transition_routes):
-            flow.transition_routes.append(transition_route)
+    def get_route_groups_by_display_name(self, parent_flow) -> dict:
+        """All the transition route groups of a flow in one list call: display name -> group."""
+        return {route_group.display_name: route_group
+                for route_group in self.client.list_transition_route_groups(parent=parent_flow)}
+
+    def create_or_update_route_group(self, parent_flow, display_name, transition_routes, existing_groups=None):
+        """Create a flow level transition route group, or replace the routes of the existing one.
+
+        Args:
+            parent_flow (str): resource name of the flow.
+            display_name (str): display name of the group, unique in the flow.
+            transition_routes (list): routes of the group.
+            existing_groups (dict, optional): output of get_route_groups_by_display_name, listed when not given.
+
+        Returns:
+            dialogflowcx.TransitionRouteGroup: the created or updated group.
+        """
+        route_group = dialogflowcx.TransitionRouteGroup(display_name=display_name, transition_routes=transition_routes)
+        if existing_groups is None:
+            existing_groups = self.get_route_groups_by_display_name(parent_flow)
+        existing_group = existing_groups.get(display_name)
+        if existing_group is not None:
+            route_group.name = existing_group.name
             update_mask = field_mask.FieldMask(paths=["transition_routes"])
-            request = dialogflowcx.UpdateFlowRequest(flow=flow, update_mask=update_mask)
-            try:
-                return self.flow_client.update_flow(request=request)
-            except Exception as e:
-                error_logger.error(f"Error trying to add transition route for {target_name}: {e}")
-                raise
-        return None
+            request = dialogflowcx.UpdateTransitionRouteGroupRequest(transition_route_group=route_group,
+                                                                     update_mask=update_mask)
+            return self.client.update_transition_route_group(request=request)
+        info_logger.info(f"Creating transition route group {display_name}")
+        return self.client.create_transition_route_group(parent=parent_flow, transition_route_group=route_group)
+
+    def update_route_group_language(self, route_group, language_code):
+        """Update the routes of an existing group in another language, with the same routes and their texts translated."""
+        update_mask = field_mask.FieldMask(paths=["transition_routes"])
+        request = dialogflowcx.UpdateTransitionRouteGroupRequest(transition_route_group=route_group,
+                                                                 update_mask=update_mask,
+                                                                 language_code=language_code)
+        return self.client.update_transition_route_group(request=request)
+
+    def set_flow_route_groups(self, flow_name, route_group_names):
+        """Replace the transition route groups referenced by a flow."""
+        flow = dialogflowcx.Flow(name=flow_name, transition_route_groups=route_group_names)
+        update_mask = field_mask.FieldMask(paths=["transition_route_groups"])
+        return self.flow_client.update_flow(request=dialogflowcx.UpdateFlowRequest(flow=flow, update_mask=update_mask))
+
+    def delete_route_group(self, name):
+        self.client.delete_transition_route_group(name=name, force=True)
+
+    def _add_transition_route(self, flow, transition_route, target_name):
+        return self._reconcile_flow_routes(flow, [transition_route], target_name)
+
+    def _reconcile_flow_routes(self, flow, transition_routes, target_name):
+        """Set the routes of their intents on a flow, in place of the existing ones, and drop the duplicates.
+
+        A flow has one route by intent, so a route whose target changed replaces the old one instead of
+        being added next to it. The routes of other intents are kept, the flow is shared with them.
+        """
+        routes = DialogFlowUtils.reconcile_transition_routes(
+            flow.transition_routes, transition_routes, keep_existing=True,
+            key=lambda route: route.intent or DialogFlowUtils.route_key(route))
+        if DialogFlowUtils.same_routes(flow.transition_routes, routes):
+            return None
+        flow.transition_routes = routes
+        update_mask = field_mask.FieldMask(paths=["transition_routes"])
+        request = dialogflowcx.UpdateFlowRequest(flow=flow, update_mask=update_mask)
+        try:
+            return self.flow_client.update_flow(request=request)
+        except Exception as e:
+            error_logger.error(f"Error trying to add transition route for {target_name}: {e}")
+            raise
 
 
 
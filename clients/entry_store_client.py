@@ -0,0 +1,70 @@
+import json
+import os
+from types import SimpleNamespace
+
+from clients.compact_entry import CompactEntry, parse_json
+from loggers.logger import get_logger
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+
+
+class EntryStoreClient:
+    """Client that reads the entries saved by the fetch command instead of calling the contentful api.
+
+    It has the same interface as ContentfulClient, so it can be used by ContentfulService to compile
+    flows without importing the contentful sdk or connecting to contentful.
+    """
+
+    def __init__(self, path='.cf-to-df/entries.json'):
+        self.path = path
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            try:
+                with open(self.path, 'rb') as store_file:
+                    self._data = parse_json(store_file.read())
+            except FileNotFoundError:
+                error_logger.error(f'Entry store {self.path} not found, execute the fetch command first')
+                raise
+            info_logger.info(f"Loaded {len(self._data['entries'])} entries from {self.path}")
+        return self._data
+
+    @property
+    def locales(self):
+        """Locales the entries were fetched with, None for the default locale only."""
+        return self.data.get('locales')
+
+    def content_types(self):
+        return SimpleNamespace(items=[SimpleNamespace(id=content_type['sys']['id'], raw=content_type)
+                                      for content_type in self.data['content_types']])
+
+    def compact_entries(self, limit=1000, query=None):
+        return list(self.iter_compact_entries(limit=limit, query=query))
+
+    def iter_compact_entries(self, limit=1000, query=None):
+        content_type = (query or {}).get('content_type')
+        return (CompactEntry.from_raw(raw) for raw in self.data['entries']
+                if content_type is None or raw['sys']['contentType']['sys']['id'] == content_type)
+
+    def entries_by_ids(self, ids, limit=1000):
+        ids = set(ids)
+        return [CompactEntry.from_raw(raw) for raw in self.data['entries'] if raw['sys']['id'] in ids]
+
+    @staticmethod
+    def save(path, content_types, entries, locales=None):
+        """Save the raw json of the contentful content types and the compact entries in the entry store."""
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        data = {'content_types': [content_type.raw for content_type in content_types.items],
+                'entries': [entry.to_raw() for entry in entries]}
+        if locales:
+            data['locales'] = list(locales)
+        with open(path, 'w', encoding='utf-8') as store_file:
+            json.dump(data, store_file, ensure_ascii=False)
+        info_logger.info(f"Saved {len(data['entries'])} entries in {path}")
+        return path
@@ -0,0 +1,79 @@
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+
+from loggers.logger import get_logger
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+# keepalive pings keep idle connections open between phases of a migration,
+# and big pages or entity types are above the default 4MB message size
+CHANNEL_OPTIONS = [
+    ('grpc.keepalive_time_ms', 30000),
+    ('grpc.keepalive_timeout_ms', 10000),
+    ('grpc.keepalive_permit_without_calls', 1),
+    ('grpc.http2.max_pings_without_data', 0),
+    ('grpc.max_send_message_length', 32 * 1024 * 1024),
+    ('grpc.max_receive_message_length', 32 * 1024 * 1024),
+]
+
+
+class GrpcChannelPool:
+    """Small pool of gRPC channels to one endpoint, assigned round robin to the service clients.
+
+    All the dialogflow service clients share the channels of the pool, so creating a client does not
+    open a new connection, and clients used by concurrent workers are spread across the channels.
+    """
+
+    def __init__(self, create_channel, size=4):
+        """
+        Args:
+            create_channel (callable): function without arguments that returns a new grpc.Channel.
+            size (int, optional): number of channels. Defaults to 4.
+        """
+        self._create_channel = create_channel
+        self.size = size
+        self._channels = None
+        self._cycle = None
+        self._lock = threading.Lock()
+
+    @property
+    def channels(self):
+        with self._lock:
+            if self._channels is None:
+                self._channels = [self._create_channel() for _ in range(self.size)]
+                self._cycle = itertools.cycle(self._channels)
+            return self._channels
+
+    def next_channel(self):
+        self.channels
+        with self._lock:
+            return next(self._cycle)
+
+    def warm_up(self, timeout=10) -> int:
+        """Connect all the channels in parallel and return how many are ready."""
+        def connect(channel):
+            try:
+                grpc.channel_ready_future(channel).result(timeout=timeout)
+                return True
+            except grpc.FutureTimeoutError:
+                error_logger.warning(f'gRPC channel not ready after {timeout} seconds')
+                return False
+
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            ready = sum(executor.map(connect, self.channels))
+        info_logger.info(f'{ready} of {self.size} gRPC channels ready')
+        return ready
+
+    def close(self):
+        with self._lock:
+            for channel in self._channels or []:
+                channel.close()
+            self._channels = None
+            self._cycle = None
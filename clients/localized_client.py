@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+
+
+class LocalizedEntryClient:
+    """Client over entries fetched with all their locales, that returns them projected to one locale.
+
+    It has the same interface as ContentfulClient, so a ContentfulService can compile the flows of each
+    locale from the entries fetched in a single pass, without calling contentful again.
+    """
+
+    def __init__(self, entries: list, content_types, locale: str, fallback_locale: str = None):
+        """
+        Args:
+            entries (list): CompactEntry records fetched with locale='*'.
+            content_types: content types of the space, as returned by ContentfulClient.content_types.
+            locale (str): locale of the entries returned by this client.
+            fallback_locale (str, optional): locale of the fields without a value in locale, the default locale.
+        """
+        self.locale = locale
+        self.locales = [locale]
+        self._content_types = content_types
+        self._entries = {entry.id: entry.localize(locale, fallback_locale) for entry in entries}
+
+    def content_types(self):
+        return self._content_types if self._content_types is not None else SimpleNamespace(items=[])
+
+    def compact_entries(self, limit=1000, query=None):
+        content_type = (query or {}).get('content_type')
+        return [entry for entry in self._entries.values()
+                if content_type is None or entry.content_type_id == content_type]
+
+    def entries_by_ids(self, ids, limit=1000):
+        return [self._entries[entry_id] for entry_id in ids if entry_id in self._entries]
@@ -0,0 +1,60 @@
+import json
+import os
+import threading
+
+from loggers.logger import get_logger
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+
+
+class ResourceIdCache:
+    """Local cache of the dialogflow ids resolved by name, such as the agent id and the default flow id.
+
+    It lets the next runs start without listing the agents or the flows of the project.
+    """
+
+    def __init__(self, path='.cf-to-df/resource_ids.json'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._ids = None
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            try:
+                with open(self.path, encoding='utf-8') as cache_file:
+                    self._ids = json.load(cache_file)
+            except FileNotFoundError:
+                self._ids = {}
+            except ValueError as e:
+                error_logger.warning(f'Ignoring unreadable resource id cache {self.path}: {e}')
+                self._ids = {}
+        return self._ids
+
+    def get(self, key: str) -> dict:
+        with self._lock:
+            return dict(self.ids.get(key, {}))
+
+    def set(self, key: str, **ids):
+        with self._lock:
+            if self.ids.get(key) == ids:
+                return
+            self.ids[key] = ids
+            self._save()
+
+    def invalidate(self, key: str):
+        with self._lock:
+            if self.ids.pop(key, None) is not None:
+                info_logger.info(f'Invalidated cached ids of {key}')
+                self._save()
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(self._ids, cache_file, indent=2)
+        os.replace(temporary_path, self.path)
@@ -2,6 +2,20 @@ import logging
 import colorlog
 import os
 
+
+class LazyFileHandler(logging.FileHandler):
+    """FileHandler that creates the log directory and file only when the first record is written."""
+
+    def __init__(self, filename, mode='a', encoding=None):
+        super().__init__(filename, mode=mode, encoding=encoding, delay=True)
+
+    def _open(self):
+        log_directory = os.path.dirname(self.baseFilename)
+        if not os.path.exists(log_directory):
+            os.makedirs(log_directory)
+        return super()._open()
+
+
 def get_logger(log_type="info"):
     # Obtener el nombre del módulo actual (sin el .py)
     module_name = __name__.split(".")[-1]
@@ -14,10 +28,8 @@ def get_logger(log_type="info"):
         '%(asctime)s - %(name)s - %(module)s - line (%(lineno)d) - %(levelname)s - %(message)s')
 
     # Agregar un manejador de logs para guardar los mensajes en un archivo
+    # el directorio y el archivo se crean al escribir el primer mensaje
     log_directory = "logs"
-    if not os.path.exists(log_directory):
-        os.makedirs(log_directory)
-
     log_file = f"{log_directory}/{log_type}.log"
     
     # Comprobar si el logger ya tiene un FileHandler para este tipo de log y, en caso afirmativo, eliminarlo
@@ -25,7 +37,7 @@ def get_logger(log_type="info"):
         if isinstance(handler, logging.FileHandler) and handler.baseFilename == os.path.abspath(log_file):
             logger.removeHandler(handler)
 
-    file_handler = logging.FileHandler(log_file)
+    file_handler = LazyFileHandler(log_file)
     file_handler.setLevel(getattr(logging, log_type.upper()))
     file_handler.setFormatter(formatter)
     logger.addHandler(file_handler)
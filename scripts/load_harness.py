@@ -0,0 +1,113 @@
+"""Load harness for the contentful ingest path.
+
+Generates a synthetic space as raw CDA json pages and measures the time and the peak memory (tracemalloc)
+of ingesting it with the contentful sdk (contentful.Entry objects) and with the compact records used by
+ContentfulService, and then of building the data ready to use from the compact records.
+
+Usage:
+    python scripts/load_harness.py --flows 2000 --chips 5
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clients.compact_entry import CompactEntry, parse_json  # noqa: E402
+
+
+def link(entry_id):
+    return {'sys': {'type': 'Link', 'linkType': 'Entry', 'id': entry_id}}
+
+
+def raw_entry(entry_id, content_type, fields):
+    return {'metadata': {'tags': []},
+            'sys': {'space': link('space'), 'id': entry_id, 'type': 'Entry',
+                    'createdAt': '2023-08-01T00:00:00.000Z', 'updatedAt': '2023-08-01T00:00:00.000Z',
+                    'environment': link('master'), 'revision': 1,
+                    'contentType': {'sys': {'type': 'Link', 'linkType': 'ContentType', 'id': content_type}},
+                    'locale': 'es'},
+            'fields': fields}
+
+
+def build_space(flows, chips):
+    entries = []
+    for flow_index in range(flows):
+        chip_links = []
+        for chip_index in range(chips):
+            chip_id = f'chip-{flow_index}-{chip_index}'
+            entries.append(raw_entry(chip_id, 'chip', {'text': f'Opción {chip_index}',
+                                                       'location': {'text': 'Respuesta ' * 10}}))
+            chip_links.append(link(chip_id))
+        entries.append(raw_entry(f'flow-{flow_index}', 'flow', {
+            'key': f'flujo {flow_index}', 'intent': f'flow.test{flow_index}.info', 'question': '¿Cómo hago algo?',
+            'flowEntityTypes': [], 'startNode': {'text': '¿Qué quieres hacer?', 'chips': chip_links,
+                                                 'fallbacks': [{'text': 'No entendí eso.'}]}}))
+    return entries
+
+
+def build_pages(entries, limit=1000):
+    return [json.dumps({'sys': {'type': 'Array'}, 'total': len(entries), 'skip': skip, 'limit': limit,
+                        'items': entries[skip:skip + limit]}).encode('utf-8')
+            for skip in range(0, len(entries), limit)]
+
+
+def ingest_sdk(pages):
+    from contentful.resource_builder import ResourceBuilder
+
+    entries = []
+    for page in pages:
+        entries.extend(ResourceBuilder('es', False, json.loads(page), max_depth=20).build())
+    return entries
+
+
+def ingest_compact(pages):
+    entries = []
+    for page in pages:
+        entries.extend(CompactEntry.from_raw(raw) for raw in parse_json(page)['items'])
+    return entries
+
+
+def measure(name, function, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:<28} {elapsed:8.2f} s {peak / 2 ** 20:10.1f} MiB peak')
+    return result, peak
+
+
+class HarnessClient:
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def compact_entries(self, limit=1000, query=None):
+        return ingest_compact(self.pages)
+
+
+def compile_compact(pages):
+    from services.contentful_service import ContentfulService
+
+    cf_service = ContentfulService(HarnessClient(pages))
+    cf_service.data_ready_to_use
+    return cf_service
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure the memory of the contentful ingest paths')
+    parser.add_argument('--flows', type=int, default=2000)
+    parser.add_argument('--chips', type=int, default=5)
+    args = parser.parse_args()
+
+    pages = build_pages(build_space(args.flows, args.chips))
+    print(f'{args.flows * (args.chips + 1)} entries in {len(pages)} pages, {sum(map(len, pages)) / 2 ** 20:.1f} MiB of json')
+    _, sdk_peak = measure('sdk entries', ingest_sdk, pages)
+    _, compact_peak = measure('compact records', ingest_compact, pages)
+    measure('compact records + compile', compile_compact, pages)
+    print(f'ingest peak memory reduced {sdk_peak / compact_peak:.1f}x')
@@ -0,0 +1,49 @@
+"""Replay contentful webhooks against a local cf-to-df watch endpoint.
+
+The events file is a json list of webhooks with the topic and the body sent by contentful:
+
+    [{"topic": "ContentManagement.Entry.publish", "body": {"sys": {"id": "5KsDBWseXY6QegucYAoacS"}}}]
+
+Usage:
+    python scripts/replay_webhooks.py events.json --url http://127.0.0.1:8080 --delay 0.1
+    python scripts/replay_webhooks.py --entry 5KsDBWseXY6QegucYAoacS --action publish
+"""
+import argparse
+import json
+import os
+import time
+import urllib.request
+
+
+def send_webhook(url, topic, body, secret=None):
+    request = urllib.request.Request(url, data=json.dumps(body).encode('utf-8'), method='POST')
+    request.add_header('Content-Type', 'application/vnd.contentful.management.v1+json')
+    request.add_header('X-Contentful-Topic', topic)
+    if secret:
+        request.add_header('X-Webhook-Secret', secret)
+    with urllib.request.urlopen(request) as response:
+        return response.status, json.loads(response.read() or b'{}')
+
+
+def load_events(args):
+    if args.events:
+        with open(args.events, encoding='utf-8') as events_file:
+            return json.load(events_file)
+    return [{'topic': f'ContentManagement.Entry.{args.action}', 'body': {'sys': {'id': entry_id}}}
+            for entry_id in args.entry]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay contentful webhooks against cf-to-df --watch')
+    parser.add_argument('events', nargs='?', help='json file with the recorded webhooks')
+    parser.add_argument('--entry', action='append', default=[], help='entry id to send, can be repeated')
+    parser.add_argument('--action', default='publish', choices=['publish', 'unpublish', 'delete'])
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds between webhooks')
+    args = parser.parse_args()
+
+    secret = os.getenv('CONTENTFUL_WEBHOOK_SECRET')
+    for event in load_events(args):
+        status, response = send_webhook(args.url, event['topic'], event['body'], secret=secret)
+        print(status, event['topic'], event['body'].get('sys', {}).get('id'), response)
+        time.sleep(args.delay)
@@ -1,13 +1,28 @@
+import hashlib
+import json
+from typing import TYPE_CHECKING
+
+from clients.localized_client import LocalizedEntryClient
 from loggers.logger import get_logger
-from clients.contentful_client import ContentfulClient
-from utils.utils_dialogflow import DialogFlowUtils
+from utils.entity_utils import EntityUtils
+from utils.text_utils import TextUtils
 from utils.contentful_utils import ContentfulUtils
+from utils.schema_utils import SchemaUtils
+from services.dependency_service import DependencyIndex
+from services.fetch_service import FetchPlanner, SELECTORS
+
+if TYPE_CHECKING:
+    from clients.contentful_client import ContentfulClient
 
 info_logger = get_logger("info")
 error_logger = get_logger("error")
 debug_logger = get_logger("debug")
 
 
+# fields of a compiled page or flow that change with the locale, the rest is the structure of the default locale
+LOCALIZED_PAGE_FIELDS = ('entry_fulfillment', 'payload_responses', 'buttons', 'fallback_message')
+
+
 class ContentfulServiceError(Exception):
     """Custom exception for ContentfulService class."""
     pass
@@ -15,15 +30,40 @@ class ContentfulServiceError(Exception):
 
 class ContentfulService:
 
-    def __init__(self, client: ContentfulClient):
+    def __init__(self, client: 'ContentfulClient', root_content_types=None, locales=None, selection=None):
+        """
+        Args:
+            client (ContentfulClient): contentful client, or any client with the same interface.
+            root_content_types (optional): content types read by the migration, such as ('flow', 'entityType').
+                When given, only them and the entries they link to are fetched. Defaults to None, fetch all entries.
+            locales (list, optional): locales of the entries, the first one is the default locale. Defaults to
+                None, the locales of the client.
+            selection (dict, optional): root entries to fetch by name, such as {'flows': ['Reclamos'],
+                'intents': [...], 'entity_types': [...]} (see fetch_service.SELECTORS). When given, only them and
+                the entries they link to are fetched. Defaults to None, fetch the root content types.
+        """
         info_logger.info(f"Initializing ContentfulService...")
         self.client = client
+        self.root_content_types = root_content_types
+        self.selection = selection
+        self._locales = locales
+        # locale -> ContentfulService over the entries projected to the locale
+        self._localized_services = {}
         self._content_types = None
         self._all_entries = None
         self._all_entries_dict = None
         self._data_ready_to_use = None
         self._entity_types = None
         self._flows = None
+        self._quarantined_flows = None
+        # entry id -> ids of the root entries (flows, entity types...) whose links resolve to it
+        self._entry_dependents = {}
+        # root id -> (entry id, path of the link in the root record) of each entry resolved into it
+        self._entry_paths = {}
+        self._dependency_index = None
+        # structural hash of a chip location -> its compiled pages, with names relative to the location
+        self._subtree_cache = {}
+        self._subtree_hits = 0
 
     @property
     def all_entries(self):
@@ -31,6 +71,18 @@ class ContentfulService:
             self._all_entries = self._fetch_all_entries()
         return self._all_entries
 
+    @property
+    def locales(self):
+        if self._locales is None:
+            locales = getattr(self.client, 'locales', None)
+            self._locales = list(locales) if isinstance(locales, (list, tuple)) else []
+        return self._locales
+
+    @property
+    def is_multi_locale(self):
+        """True when the entries have the fields of several locales, fetched with locale='*'."""
+        return len(self.locales) > 1
+
     @property
     def content_types(self):
         if self._content_types is None:
@@ -40,7 +92,13 @@ class ContentfulService:
     @property
     def data_ready_to_use(self):
         if self._data_ready_to_use is None:
-            self._data_ready_to_use = self.extract_values_from_all_entries(self.all_entries)
+            if self.is_multi_locale:
+                # the resources are built from the default locale, the other locales only translate them
+                default_service = self.localized(self.locales[0])
+                self._data_ready_to_use = default_service.data_ready_to_use
+                self._entry_dependents = default_service._entry_dependents
+            else:
+                self._data_ready_to_use = self.extract_values_from_all_entries(self.all_entries)
         return self._data_ready_to_use
     
     @property
@@ -57,19 +115,76 @@ class ContentfulService:
     def flows(self):
         if self._flows is None:
             data = self.data_ready_to_use
-            if data and 'flow' in data:
-                self._flows = data['flow'].to_dict('records') 
-            else:
-                self._flows = []       
+            records = data['flow'].to_dict('records') if data and 'flow' in data else []
+            self._flows, self._quarantined_flows = self.validate_flows(records)
         return self._flows
+
+    @property
+    def dependency_index(self) -> DependencyIndex:
+        """Reverse index from each entry to the flows, pages, intents and entity types built from it."""
+        if self._dependency_index is None:
+            if self.is_multi_locale:
+                # the resources are built from the default locale
+                self._dependency_index = self.localized(self.locales[0]).dependency_index
+            else:
+                data = self.data_ready_to_use or {}
+                records = [record for content_type in ('entityType', 'flow') if content_type in data
+                           for record in data[content_type].to_dict('records')]
+                self._dependency_index = DependencyIndex.build(records, self._entry_paths)
+        return self._dependency_index
+
+    @property
+    def quarantined_flows(self):
+        """Flow records left out of self.flows because they don't match the flow schema, with their errors."""
+        self.flows
+        return self._quarantined_flows
+
+    @staticmethod
+    def validate_flows(flows: list[dict]) -> tuple[list[dict], list[dict]]:
+        """Check the flow records against the flow schema in one pass, before they are compiled.
+
+        A flow with a bad shape would stop the compile of every flow with a KeyError, so it is
+        quarantined instead, and the valid flows are compiled as usual.
+
+        Args:
+            flows (list[dict]): flow records with their links resolved.
+
+        Returns:
+            tuple: the valid flows, and a dict with the id, key and path level errors of each invalid flow.
+        """
+        valid, quarantined = [], []
+        for flow in flows:
+            errors = SchemaUtils.flow_errors(flow)
+            if not errors:
+                valid.append(flow)
+                continue
+            key = flow.get('key') if isinstance(flow.get('key'), str) else None
+            error_logger.error(f"Flow {key or flow.get('id')} is quarantined, it doesn't match the flow schema: "
+                               f"{'; '.join(errors)}")
+            quarantined.append({'id': flow.get('id'), 'key': key, 'errors': errors})
+        if quarantined:
+            info_logger.info(f"{len(quarantined)} of {len(flows)} flows quarantined")
+        return valid, quarantined
    
     @property
     def flows_with_subpages(self):
+        return self.compile_flows(self.flows)
+
+    def compile_flows(self, flows: list[dict]) -> list[dict]:
+        """Build the flow dicts with all its sub pages ready to be created in dialogflow.
+
+        Args:
+            flows (list[dict]): flow records, like the ones in self.flows
+
+        Returns:
+            list[dict]: one dict for each flow that is not a faq flow
+        """
         flows_with_subpages = []
-        if not self.flows:
+        if not flows:
             return flows_with_subpages
         
-        flows_no_faq = [flow for flow in self.flows if 'intent' in flow and not flow['intent'].startswith('faq')]
+        flows_no_faq = [flow for flow in flows if 'intent' in flow and not flow['intent'].startswith('faq')]
+        subtree_hits = self._subtree_hits
         for i, flow in enumerate(flows_no_faq):
             try:
                 sub_pages = self._map_subpages_from_flow(flow['startNode'], 
@@ -98,8 +213,120 @@ class ContentfulService:
                 error_logger.error(f"Unexpected error in flows_with_subpages: {e}")
                 raise ContentfulServiceError("Failed to process flow due to an unexpected error")
 
+        if self._subtree_hits > subtree_hits:
+            info_logger.info(f"Reused the compiled pages of {self._subtree_hits - subtree_hits} identical sub trees")
         return flows_with_subpages
   
+    @property
+    def faqs(self):
+        return self.compile_faqs(self.flows)
+
+    def compile_faqs(self, flows: list[dict]) -> list[dict]:
+        """Build the faq flows as single answers: the text of the start node and its chips as payload.
+
+        Args:
+            flows (list[dict]): flow records, like the ones in self.flows
+
+        Returns:
+            list[dict]: one dict for each faq flow, with display_name, intent, question, locale,
+                entry_fulfillment and payload_responses
+        """
+        faqs = []
+        for flow in flows:
+            if not isinstance(flow.get('intent'), str) or not flow['intent'].startswith('faq'):
+                continue
+            try:
+                start_node = flow['startNode']
+                chips = start_node.get('chips') if isinstance(start_node.get('chips'), list) else []
+                faqs.append({'display_name': flow['key'],
+                             'intent': flow['intent'],
+                             'locale': flow['locale'],
+                             'question': flow['question'],
+                             'entry_fulfillment': start_node['text'],
+                             'payload_responses': ContentfulUtils.build_payload_response(chips, type_of_option='chips')
+                             if chips else []})
+            except (KeyError, TypeError) as e:
+                error_logger.error(f"Key error in faqs: {e}")
+                raise ContentfulServiceError(f"Failed to process faq {flow.get('key')} due to missing key: {e}")
+        return faqs
+
+    def localized(self, locale: str) -> 'ContentfulService':
+        """ContentfulService over the entries of this one projected to a locale, without fetching them again."""
+        if locale not in self._localized_services:
+            self._localized_services[locale] = ContentfulService(
+                LocalizedEntryClient(self.all_entries, self._content_types, locale,
+                                     fallback_locale=self.locales[0] if self.locales else None))
+        return self._localized_services[locale]
+
+    def compile_translations(self, locale: str) -> dict:
+        """Texts of the compiled resources in another locale, keyed by their names in the default locale.
+
+        The structure (pages, routes, entity values) is the one of the default locale, so the flows and
+        entity types of both locales are matched by entry id, and their pages and values by position.
+
+        Args:
+            locale (str): one of self.locales other than the default one.
+
+        Returns:
+            dict: entity_types (name -> entities with the default values and the localized synonyms),
+                intents (name -> training phrase), flows (display name -> localized start page fields and
+                pages, display name -> localized fields) and faqs (intent -> question, answer and chips).
+        """
+        default_service, locale_service = self.localized(self.locales[0]), self.localized(locale)
+        translations = {'entity_types': {}, 'intents': {}, 'flows': {}, 'faqs': {}}
+
+        localized_entity_types = {entity_type['id']: entity_type for entity_type in locale_service.entity_types}
+        for entity_type in default_service.entity_types:
+            localized = localized_entity_types.get(entity_type['id'])
+            values = entity_type.get('entityValue') if isinstance(entity_type.get('entityValue'), list) else []
+            localized_values = localized.get('entityValue') if localized and isinstance(localized.get('entityValue'), list) else []
+            if len(values) != len(localized_values):
+                error_logger.warning(f"Entity type {entity_type.get('entityType')} has other values in {locale}, "
+                                     f"it is not translated")
+                continue
+            translations['entity_types'][entity_type['entityType']] = EntityUtils.normalize_entities(
+                [{'entityValue': value['entityValue'], 'synonyms': self._localized_synonyms(localized_value)}
+                 for value, localized_value in zip(values, localized_values)])
+
+        localized_flows = {flow['id']: flow for flow in locale_service.flows}
+        for flow in default_service.flows:
+            localized = localized_flows.get(flow['id'])
+            if localized is None or not isinstance(flow.get('intent'), str):
+                continue
+            translations['intents'][flow['intent']] = localized['question']
+            try:
+                if flow['intent'].startswith('faq'):
+                    faq, = locale_service.compile_faqs([localized])
+                    translations['faqs'][flow['intent']] = {key: faq[key] for key in
+                                                            ('question', 'entry_fulfillment', 'payload_responses')}
+                    continue
+                compiled_flow, = default_service.compile_flows([flow])
+                localized_flow, = locale_service.compile_flows([localized])
+            except (ContentfulServiceError, ValueError) as e:
+                error_logger.warning(f"Flow {flow.get('key')} could not be compiled in {locale}: {e}")
+                continue
+            translation = self._localized_fields(localized_flow)
+            if len(compiled_flow['subpages']) == len(localized_flow['subpages']):
+                translation['pages'] = {page['display_name']: self._localized_fields(localized_page)
+                                        for page, localized_page in zip(compiled_flow['subpages'], localized_flow['subpages'])}
+            else:
+                error_logger.warning(f"Flow {compiled_flow['display_name']} has other pages in {locale}, "
+                                     f"only its start page is translated")
+            translations['flows'][compiled_flow['display_name']] = translation
+        return translations
+
+    @staticmethod
+    def _localized_synonyms(entity_value: dict) -> list:
+        """Synonyms of a localized entity value, or its value when it has none."""
+        synonyms = entity_value.get('synonyms')
+        if isinstance(synonyms, list) and synonyms:
+            return synonyms
+        return [entity_value['entityValue']] if entity_value.get('entityValue') else []
+
+    @staticmethod
+    def _localized_fields(page: dict) -> dict:
+        return {key: page[key] for key in LOCALIZED_PAGE_FIELDS if key in page}
+
     @property
     def intents(self):
         intents = []
@@ -113,7 +340,7 @@ class ContentfulService:
         Also it is possible to export all entries by content type in excel format.
 
         Args:
-            data (list[dict]): Are all entries from contentful api. Each entry is a contentful.Entry object.
+            data (list[dict]): Are all entries from contentful api. Each entry is a CompactEntry record.
             export_to_excel (bool, optional): Export all entries by content type, each conten type by sheets. Defaults to False.
 
         Returns:
@@ -179,7 +406,7 @@ class ContentfulService:
             
             if 'entityType' in data:
                 if 'entityType' in data['entityType']:  # Check if the key exists
-                    current_entity_type = DialogFlowUtils.clean_display_name(data['entityType']['entityType'])
+                    current_entity_type = TextUtils.clean_display_name(data['entityType']['entityType'])
                     page_info["entityType"] = current_entity_type
                     page_info["entityValues"] = [ev['entityValue'] for ev in data['entityType']['entityValue']]
             elif current_entity_value:
@@ -206,13 +433,12 @@ class ContentfulService:
                         if 'buttons' in chip['location']:
                             page_info['buttons'] = ContentfulUtils.build_payload_response(chip['location']['buttons'], 'button')
                             
-                        self._map_subpages_from_flow(chip['location'],
-                                                     result, chip['text'],
-                                                     combined_page_name,
-                                                     depth+1,
-                                                     parent_entity_type= page_info['entityType'],
-                                                     current_entity_value=chip.get('entityValue'),
-                                                     current_entity_type=current_entity_type)
+                        self._map_subtree(chip['location'],
+                                          result, chip['text'],
+                                          combined_page_name,
+                                          depth+1,
+                                          current_entity_value=chip.get('entityValue'),
+                                          current_entity_type=current_entity_type)
                     # if chip has not "location" but  has "url" key, then is added to the payload dict"
                     elif 'url' in chip:
                         payload = {
@@ -240,13 +466,138 @@ class ContentfulService:
             error_logger.error(str(e))
         return result
     
+    def _map_subtree(self, data, result, chip_text, parent_name, depth, current_entity_value=None,
+                     current_entity_type=None):
+        """_map_subpages_from_flow of a chip location, compiled once for all the identical sub trees.
+
+        The pages of a location only depend on its node, the chip text and the entity type and value it
+        inherits, the rest is its place in the flow. They are compiled the first time with names relative
+        to the parent page, cached by a hash of those inputs, and copied under the parent page of every
+        location with the same hash, in this flow or in others.
+        """
+        key = hashlib.sha1(json.dumps([data, chip_text, current_entity_value, current_entity_type],
+                                      sort_keys=True, default=str).encode('utf-8')).hexdigest()
+        template = self._subtree_cache.get(key)
+        if template is None:
+            pages = self._map_subpages_from_flow(data, [], chip_text, parent_name, depth,
+                                                 current_entity_value=current_entity_value,
+                                                 current_entity_type=current_entity_type)
+            template = self._subtree_cache[key] = [
+                {**page, 'display_name': page['display_name'][len(parent_name):],
+                 'parent': None if page['parent'] == parent_name else page['parent'][len(parent_name):],
+                 'depth': page['depth'] - depth} for page in pages]
+        else:
+            self._subtree_hits += 1
+        for relative_page in template:
+            display_name = parent_name + relative_page['display_name']
+            group = display_name.split(">")
+            page = {**relative_page,
+                    'display_name': display_name,
+                    'parent': parent_name if relative_page['parent'] is None else parent_name + relative_page['parent'],
+                    'depth': depth + relative_page['depth'],
+                    'entityValues': list(relative_page['entityValues']),
+                    'page_group': group[1].strip() if len(group) >= 2 else None}
+            # like _map_subpages_from_flow, a page with chips is added once by name
+            if not page['is_end_flow'] and not page['payload_responses'] and self.page_already_added(result, page):
+                continue
+            result.append(page)
+        return result
+
+    def apply_entry_changes(self, published_ids: list, removed_ids: list) -> set:
+        """Update the entry store in place with published, unpublished or deleted entries.
+
+        Published entries are fetched again from contentful, removed entries are dropped from the store,
+        and the data derived from the entries is rebuilt.
+
+        Args:
+            published_ids (list): ids of the published entries.
+            removed_ids (list): ids of the unpublished or deleted entries.
+
+        Returns:
+            set: ids of the root entries affected by the changes, before and after the update.
+        """
+        # build the data first, so the dependents of the removed entries are known
+        self.data_ready_to_use
+        affected_ids = self.get_dependent_entry_ids(list(published_ids) + list(removed_ids))
+        try:
+            published_entries = self.client.entries_by_ids(list(published_ids)) if published_ids else []
+        except Exception as e:
+            error_logger.error(f'error trying to fetch published entries: {e}')
+            raise ContentfulServiceError(f'Failed to fetch published entries from contentful {e}')
+
+        for entry in published_entries:
+            self._all_entries_dict[entry.id] = entry
+        for entry_id in removed_ids:
+            self._all_entries_dict.pop(entry_id, None)
+        try:
+            # a published entry can link to entries that were not in the store
+            self._fetch_missing_linked_entries(self._all_entries_dict, pending=published_entries)
+        except Exception as e:
+            error_logger.error(f'error trying to fetch the entries linked by the published entries: {e}')
+            raise ContentfulServiceError(f'Failed to fetch linked entries from contentful {e}')
+        info_logger.info(f"Applied {len(published_entries)} published and {len(removed_ids)} removed entries")
+
+        self._all_entries = list(self._all_entries_dict.values())
+        self._localized_services = {}
+        self._data_ready_to_use = None
+        self._entity_types = None
+        self._flows = None
+        self._quarantined_flows = None
+        self._entry_dependents = {}
+        self._entry_paths = {}
+        self._dependency_index = None
+        self._subtree_cache = {}
+        self.data_ready_to_use
+
+        return affected_ids | self.get_dependent_entry_ids(published_ids)
+
+    def get_entry_ids_by_content_type(self) -> dict:
+        """Return the entry ids grouped by content type, without resolving any link."""
+        entry_ids_by_content_type = {}
+        for entry in self.all_entries:
+            entry_ids_by_content_type.setdefault(entry.content_type_id, []).append(entry.id)
+        return entry_ids_by_content_type
+
+    def get_columns(self, entry_ids: list) -> list:
+        """Columns of the records of the given entries: all their fields in order of appearance and the sys columns."""
+        columns = {}
+        for entry_id in entry_ids:
+            columns.update(dict.fromkeys(self.get_entry_by_id(entry_id).fields))
+        columns.update(dict.fromkeys(['locale', 'id', 'type', 'fields_keys']))
+        return list(columns)
+
+    def iter_records(self, entry_ids: list):
+        """Yield the record of each entry with its links resolved, one at a time.
+
+        Unlike data_ready_to_use, the records are not kept in memory, so they can be streamed
+        to a file whatever the size of the space is.
+        """
+        for entry_id in entry_ids:
+            item_dict = self._build_item_dict(self.get_entry_by_id(entry_id))
+            self._extract_sys_ids(item_dict)
+            yield item_dict
+
+    def get_dependent_entry_ids(self, entry_ids: list) -> set:
+        """Return the given ids plus the ids of the root entries that link to any of them."""
+        dependent_ids = set(entry_ids)
+        for entry_id in entry_ids:
+            dependent_ids |= self._entry_dependents.get(entry_id, set())
+        return dependent_ids
+
     def page_already_added(self, result, page_info):
         return any(page["display_name"] == page_info["display_name"] for page in result)
 
     def _fetch_all_entries(self):
         try:
-            info_logger.info("Fetching all entries")
-            all_entries = self.client.entries()
+            if self.selection:
+                all_entries = self._fetch_selected_entries()
+            elif self.root_content_types:
+                all_entries = self._fetch_planned_entries()
+            else:
+                info_logger.info("Fetching all entries")
+                # links to entries of a partial fetch, or not published with the others, are fetched by id
+                all_entries = list(self._fetch_missing_linked_entries(
+                    {entry.id: entry for entry in self.client.compact_entries()}).values())
             self._all_entries_dict = {entry.id: entry for entry in all_entries}
             info_logger.info(f"Fetched {len(all_entries)} entries successfully")
             return all_entries
@@ -254,7 +605,81 @@ class ContentfulService:
             error_logger.error(f'error trying to fetch all entries: {e}')
             raise ContentfulServiceError(f'Failed to fetch entries from contentful {e}')  
     
-    def _extract_sys_ids(self, element):
+    def _fetch_planned_entries(self):
+        """Fetch only the content types and fields planned by FetchPlanner, plus the linked entries they miss."""
+        queries = FetchPlanner(self.content_types, self.root_content_types).plan()
+        entries = {}
+        for content_type, query in queries.items():
+            info_logger.info(f"Fetching entries of content type {content_type}")
+            for entry in self.client.compact_entries(query=query):
+                entries[entry.id] = entry
+        self._fetch_missing_linked_entries(entries)
+        return list(entries.values())
+
+    def _fetch_selected_entries(self):
+        """Fetch only the root entries picked by self.selection, plus the entries they link to."""
+        entries = {}
+        for query in FetchPlanner(self.content_types).plan_selection(self.selection):
+            for entry in self.client.compact_entries(query=query):
+                entries[entry.id] = entry
+        for selector, names in self.selection.items():
+            content_type, field = SELECTORS[selector]
+            found = {value for entry in entries.values() if entry.content_type_id == content_type
+                     for value in self._field_values(entry.fields.get(field))}
+            for name in names:
+                if name not in found:
+                    error_logger.warning(f"No {content_type} entry has {field} {name}")
+        info_logger.info(f"Selected {len(entries)} root entries")
+        self._fetch_missing_linked_entries(entries)
+        return list(entries.values())
+
+    @staticmethod
+    def _field_values(value):
+        """Values of a field, of each locale when the entries were fetched with locale='*'."""
+        return list(value.values()) if isinstance(value, dict) else [value]
+
+    def _fetch_missing_linked_entries(self, entries: dict, pending: list = None):
+        """Fetch by id the linked entries that are not in entries, until all links are found.
+
+        Each pass collects the links of the entries added by the previous one and fetches all the missing
+        ones together, in batched sys.id[in] queries (see ContentfulClient.entries_by_ids), so the requests
+        grow with the depth of the links, not with their number.
+
+        Args:
+            entries (dict): entry id -> entry, updated in place.
+            pending (list, optional): entries whose links are checked first. Defaults to all the entries.
+        """
+        pending = list(entries.values()) if pending is None else pending
+        not_found = set()
+        while pending:
+            missing_ids = {link_id for entry in pending for link_id in self._find_link_ids(entry.fields)
+                           if link_id not in entries and link_id not in not_found}
+            if not missing_ids:
+                break
+            info_logger.info(f"Fetching {len(missing_ids)} linked entries missing from the fetched entries")
+            pending = [entry for entry in self.client.entries_by_ids(sorted(missing_ids)) if entry.id not in entries]
+            for entry in pending:
+                entries[entry.id] = entry
+            not_found |= missing_ids - set(entries)
+        if not_found:
+            # unpublished or deleted entries, their links are left out of the compiled data
+            error_logger.warning(f"Linked entries not found: {sorted(not_found)}")
+        return entries
+
+    @staticmethod
+    def _find_link_ids(value):
+        """Yield the ids of all the links ({'sys': {'id': ...}}) inside a field value."""
+        if isinstance(value, dict):
+            if 'sys' in value and 'id' in value['sys']:
+                yield value['sys']['id']
+                return
+            for subvalue in value.values():
+                yield from ContentfulService._find_link_ids(subvalue)
+        elif isinstance(value, list):
+            for subvalue in value:
+                yield from ContentfulService._find_link_ids(subvalue)
+
+    def _extract_sys_ids(self, element, root_id=None, path=()):
         for key, value in element.items():
             if isinstance(value, dict):
                 if 'sys' in value and 'id' in value['sys']:
@@ -262,21 +687,30 @@ class ContentfulService:
                     entry = self.get_entry_by_id(
                         entry_id)  # Get the entry by id
                     if entry is not None:
+                        self._add_dependent(entry_id, root_id, path + (key,))
                         # Replace the value with the entry fields
-                        element[key] = {**entry.raw['fields']}
+                        element[key] = {**entry.fields}
                         # Recursive call for the new fields
-                        self._extract_sys_ids(element[key])
+                        self._extract_sys_ids(element[key], root_id, path + (key,))
                         
             elif isinstance(value, list):
+                # copy the list, so the raw fields of the entries are not modified
+                value = element[key] = list(value)
                 for i, subvalue in enumerate(value):
                     if isinstance(subvalue, dict) and 'sys' in subvalue and 'id' in subvalue['sys']:
                         entry_id = subvalue['sys']['id']
                         entry = self.get_entry_by_id(
                             entry_id)  # Get the entry by id
                         if entry is not None:
+                            self._add_dependent(entry_id, root_id, path + (key, i))
                             # Replace the value with the entry fields
-                            value[i] = {**entry.raw['fields']}
-                            self._extract_sys_ids(value[i])
+                            value[i] = {**entry.fields}
+                            self._extract_sys_ids(value[i], root_id, path + (key, i))
+
+    def _add_dependent(self, entry_id, root_id, path=()):
+        if root_id is not None:
+            self._entry_dependents.setdefault(entry_id, set()).add(root_id)
+            self._entry_paths.setdefault(root_id, []).append((entry_id, path))
 
     def _build_data_by_content_type(self, data: list[dict]) -> dict:
         data_by_content_type = {}
@@ -284,19 +718,13 @@ class ContentfulService:
         info_logger.info(f"Extracting values from entries for content type")
         try:
             for item in data:
-                item_dict = {
-                    **item.raw['fields'],
-                    'locale': item.raw['sys']['locale'],
-                    'id': item.id,
-                    'type': item.content_type.id,
-                    'fields_keys': [key for key, val in item.raw['fields'].items() if isinstance(val, dict) or isinstance(val, list)],
-                }
-
-                if item.content_type.id in data_by_content_type:
+                item_dict = self._build_item_dict(item)
+
+                if item.content_type_id in data_by_content_type:
                     # id is the contenttype name like  flow, entityType,
-                    data_by_content_type[item.content_type.id].append(item_dict)
+                    data_by_content_type[item.content_type_id].append(item_dict)
                 else:
-                    data_by_content_type[item.content_type.id] = [item_dict]
+                    data_by_content_type[item.content_type_id] = [item_dict]
         except Exception as e:
             error_logger.error(f'error trying to _build_data_by_content_type: {e}')
             raise ContentfulServiceError(f'Failed to get entry by id: {e}')  
@@ -304,8 +732,18 @@ class ContentfulService:
         self._build_data_by_content_type_with_related_entry_values(data_by_content_type)
         return data_by_content_type
 
+    @staticmethod
+    def _build_item_dict(item) -> dict:
+        return {
+            **item.fields,
+            'locale': item.locale,
+            'id': item.id,
+            'type': item.content_type_id,
+            'fields_keys': [key for key, val in item.fields.items() if isinstance(val, dict) or isinstance(val, list)],
+        }
+
     def _build_data_by_content_type_with_related_entry_values(self, data: list[dict]):
         info_logger.info(f"Extracting values from all entries")
         for content_type_name, items in data.items():
             for item in items:
-                self._extract_sys_ids(item)
+                self._extract_sys_ids(item, root_id=item['id'])
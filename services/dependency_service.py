@@ -0,0 +1,155 @@
+import json
+import os
+
+from loggers.logger import get_logger
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+DEPENDENCIES_PATH = '.cf-to-df/dependencies.json'
+# faqs are the flows compiled as intent routes of the default start flow, named by their intent
+RESOURCE_KINDS = ('flows', 'pages', 'intents', 'entity_types', 'faqs')
+
+
+class DependencyIndexError(Exception):
+    """Custom exception for DependencyIndex class."""
+    pass
+
+
+class DependencyIndex:
+    """Reverse index from each contentful entry to the dialogflow resources built from it.
+
+    It is built from the root records (flows and entity types) and the path of each entry that
+    ContentfulService resolved into them, so an entry shared by many flows, such as a fallback
+    message, points to the flows and pages it feeds, and only to them:
+
+    - the root entry of a flow feeds the flow, all its pages and its intent (key, intent and question).
+    - a node feeds its page and the pages under it, whose names and routes come from its chips.
+    - a chip feeds the page that shows it and the pages under its location, a fallback only its page.
+    - an entry linked in flowEntityTypes feeds every page of the flow.
+    - the entries of an entity type feed the entity type.
+
+    Pages are named like ContentfulService._map_subpages_from_flow names them: the key of the flow,
+    then the text of each chip down to the page, joined by ' > '.
+    """
+
+    def __init__(self, entries: dict = None, path=DEPENDENCIES_PATH):
+        """
+        Args:
+            entries (dict, optional): entry id -> resource kind -> names. Defaults to an empty index.
+            path (str, optional): json file of the index. Defaults to DEPENDENCIES_PATH.
+        """
+        self.entries = {entry_id: {kind: set(names) for kind, names in resources.items()}
+                        for entry_id, resources in (entries or {}).items()}
+        self.path = path
+
+    @classmethod
+    def build(cls, records: list[dict], entry_paths: dict, path=DEPENDENCIES_PATH) -> 'DependencyIndex':
+        """Build the index of the resolved root records.
+
+        Args:
+            records (list[dict]): flow and entity type records, with their links resolved.
+            entry_paths (dict): root id -> list of (entry id, path of the link in the root record), as
+                recorded by ContentfulService._extract_sys_ids.
+        """
+        index = cls(path=path)
+        for record in records:
+            links = [(record['id'], ())] + list(entry_paths.get(record['id'], []))
+            if record.get('type') == 'entityType':
+                if isinstance(record.get('entityType'), str):
+                    for entry_id, _ in links:
+                        index.add(entry_id, 'entity_types', [record['entityType']])
+            elif record.get('type') == 'flow' and isinstance(record.get('key'), str):
+                index._add_flow(record, links)
+        return index
+
+    @classmethod
+    def load(cls, path=DEPENDENCIES_PATH) -> 'DependencyIndex':
+        """Index saved by a previous run, empty when there is none."""
+        try:
+            with open(path, encoding='utf-8') as index_file:
+                return cls(json.load(index_file)['entries'], path=path)
+        except FileNotFoundError:
+            return cls(path=path)
+        except (ValueError, KeyError) as e:
+            error_logger.warning(f'Ignoring unreadable dependency index {path}: {e}')
+            return cls(path=path)
+
+    def save(self, path=None):
+        """Write the index to path, by default the path it was loaded from or built with."""
+        self.path = path or self.path
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        entries = {entry_id: {kind: sorted(names) for kind, names in resources.items()}
+                   for entry_id, resources in sorted(self.entries.items())}
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as index_file:
+            json.dump({'entries': entries}, index_file, ensure_ascii=False)
+        os.replace(temporary_path, self.path)
+        info_logger.info(f'Saved the dependencies of {len(entries)} entries to {self.path}')
+
+    def add(self, entry_id: str, kind: str, names):
+        if kind not in RESOURCE_KINDS:
+            raise DependencyIndexError(f'Unknown resource kind {kind}')
+        self.entries.setdefault(entry_id, {}).setdefault(kind, set()).update(names)
+
+    def affected(self, entry_ids) -> dict:
+        """Resources to rebuild when the given entries change.
+
+        Returns:
+            dict: resource kind -> set of names, for every kind in RESOURCE_KINDS.
+        """
+        affected = {kind: set() for kind in RESOURCE_KINDS}
+        for entry_id in entry_ids:
+            for kind, names in self.entries.get(entry_id, {}).items():
+                affected[kind] |= names
+        return affected
+
+    def _add_flow(self, record, links):
+        is_faq = isinstance(record.get('intent'), str) and record['intent'].startswith('faq')
+        # path of each node of the flow -> name of its page
+        pages = dict(self._node_pages(record.get('startNode'), ('startNode',), record['key']))
+        for entry_id, link_path in links:
+            if is_faq:
+                self.add(entry_id, 'faqs', [record['intent']])
+            else:
+                self.add(entry_id, 'flows', [record['key']])
+                self.add(entry_id, 'pages', self._pages_fed(pages, link_path))
+            if not link_path and isinstance(record.get('intent'), str):
+                self.add(entry_id, 'intents', [record['intent']])
+
+    @staticmethod
+    def _pages_fed(pages, link_path):
+        node_paths = [node_path for node_path in pages if link_path[:len(node_path)] == node_path]
+        if not node_paths:
+            # the root entry or flowEntityTypes, used by every page
+            return set(pages.values())
+        node_path = max(node_paths, key=len)
+        page = pages[node_path]
+        rest = link_path[len(node_path):]
+        if rest[:1] == ('fallbacks',):
+            return {page}
+        if rest[:1] == ('chips',) and len(rest) > 1:
+            # a chip, or a value of a chip, is shown by the page and routes to the pages under its location
+            location = pages.get(node_path + ('chips', rest[1], 'location'))
+            return {page} | (DependencyIndex._subtree(pages, location) if location else set())
+        return DependencyIndex._subtree(pages, page)
+
+    @staticmethod
+    def _subtree(pages, page):
+        return {page} | {name for name in pages.values() if name.startswith(f'{page} > ')}
+
+    @staticmethod
+    def _node_pages(node, path, name):
+        if not isinstance(node, dict):
+            return
+        yield path, name
+        chips = node.get('chips') if isinstance(node.get('chips'), list) else []
+        for i, chip in enumerate(chips):
+            if isinstance(chip, dict) and isinstance(chip.get('location'), dict) and isinstance(chip.get('text'), str):
+                yield from DependencyIndex._node_pages(chip['location'], path + ('chips', i, 'location'),
+                                                       f"{name} > {chip['text']}")
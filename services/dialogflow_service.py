@@ -1,9 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 
 from google.cloud import dialogflowcx_v3beta1 as dialogflowcx
 
 from loggers.logger import get_logger
 from clients.dialogflow_client import DialogFlowCXClientFactory, AgentManager, EntityTypeManager, \
     PageManager, IntentManager, FlowManager, TransitionRouteManager
+from clients.resource_id_cache import ResourceIdCache
+from services.journal_service import OperationJournal
+from utils.route_utils import RouteUtils, SHARED_ROUTES_PREFIX
+from utils.subtree_utils import SHARED_FLOW_PREFIX
 from utils.utils_dialogflow import DialogFlowUtils
 
 
@@ -14,38 +19,104 @@ debug_logger = get_logger("debug")
 
 class DialogflowServiceCX:
 
-    def __init__(self, client: DialogFlowCXClientFactory, agent_name: str):
+    def __init__(self, client: DialogFlowCXClientFactory, agent_name: str, journal: OperationJournal = None,
+                 agent_id: str = None, default_flow_id: str = None, id_cache: ResourceIdCache = None):
+        """
+        Args:
+            client (DialogFlowCXClientFactory): factory of the dialogflow clients.
+            agent_name (str): display name of the agent.
+            journal (OperationJournal, optional): journal of the completed writes, used to resume a migration.
+            agent_id (str, optional): id of the agent, when given the agents are not listed.
+            default_flow_id (str, optional): id of the default start flow, when given the agent is not read.
+            id_cache (ResourceIdCache, optional): cache of the ids resolved by previous runs. Cached ids are used
+                right away and checked in background with a single get_agent call, the first write waits for it.
+        """
         info_logger.info("initializing DialogflowService")
-        self.agent_manager = AgentManager(client, agent_name)
-        self.flow_manager = FlowManager(client, self.agent_manager)
+        self.client = client
+        self.journal = journal
+        self.id_cache = id_cache
+        self.id_verification = None
+        self._ids_verified = True
+        self._cache_key = f'{client.base_parent}|{agent_name}'
+        cached_ids = id_cache.get(self._cache_key) if id_cache else {}
+        use_cache = not agent_id and bool(cached_ids)
+        if use_cache:
+            agent_id = cached_ids['agent_id']
+            default_flow_id = default_flow_id or cached_ids.get('default_flow_id')
+        elif cached_ids and cached_ids['agent_id'] == agent_id:
+            default_flow_id = default_flow_id or cached_ids.get('default_flow_id')
+
+        self.agent_manager = AgentManager(client, agent_name, agent_id=agent_id)
+        if self.agent_manager.agent_id is None:
+            self.agent_manager.resolve_agent_id()
+        self._create_managers(default_flow_id)
+        if id_cache:
+            id_cache.set(self._cache_key, agent_id=self.agent_manager.agent_id,
+                         default_flow_id=self.flow_manager.default_flow_id)
+        if use_cache:
+            # the writes wait for the check in verify_ids, the reads before them use the cached ids
+            self._ids_verified = False
+            executor = ThreadPoolExecutor(max_workers=1)
+            self.id_verification = executor.submit(self._verify_cached_ids, self._cache_key)
+            executor.shutdown(wait=False)
+
+    def _create_managers(self, default_flow_id=None):
+        self.flow_manager = FlowManager(self.client, self.agent_manager, default_flow_id=default_flow_id)
         self.intent_manager = IntentManager(
-            client, self.agent_manager.agent_id)
+            self.client, self.agent_manager.agent_id)
         self.entity_type_manager = EntityTypeManager(
-            client, self.agent_manager.agent_id)
-        self.pages_manager = PageManager(client,
+            self.client, self.agent_manager.agent_id)
+        self.pages_manager = PageManager(self.client,
                                          self.agent_manager.agent_id,
                                          self.flow_manager.default_flow_id,
                                          )
-        self.transition_route_manager = TransitionRouteManager(client,
+        self.transition_route_manager = TransitionRouteManager(self.client,
                                                                self.flow_manager.client,
                                                                self.flow_manager.parent,
                                                                self.pages_manager
                                                                )
 
-    def create_entity_types(self, entity_types):
+    def verify_ids(self):
+        """Wait for the check of the cached ids, called before the first write of the run.
+
+        When the cached ids are not valid anymore, the agent and its default flow are resolved again
+        and the managers are created with the new ids, so no write goes to a stale agent or flow.
+        """
+        if self._ids_verified:
+            return
+        self._ids_verified = True
+        if self.id_verification.result():
+            return
+        info_logger.info(f"Resolving the ids of {self._cache_key} again")
+        self.agent_manager = AgentManager(self.client, self.agent_manager.agent_name)
+        self.agent_manager.resolve_agent_id()
+        self._create_managers()
+        self.id_cache.set(self._cache_key, agent_id=self.agent_manager.agent_id,
+                          default_flow_id=self.flow_manager.default_flow_id)
 
-        entity_types = [self.entity_type_manager.create_or_update_entity_type(display_name=entity_type.get('entityType'),
-                                                                              entities_with_synonyms=entity_type['entityValue'])
+    def create_entity_types(self, entity_types, refresh=True):
+        self.verify_ids()
+        # the entity types are listed again on the first write, they could change since the last deploy
+        if refresh:
+            self.entity_type_manager.refresh()
+        entity_types = [self._run_journaled('entity_type', entity_type.get('entityType'), entity_type['entityValue'],
+                                            lambda entity_type=entity_type: self.entity_type_manager.create_or_update_entity_type(
+                                                display_name=entity_type.get('entityType'),
+                                                entities_with_synonyms=entity_type['entityValue']),
+                                            resource_type=dialogflowcx.EntityType)
                         for entity_type in entity_types]
         return entity_types
 
     def create_intents(self, intents: list):
+        self.verify_ids()
         for intent in intents:
-            self._add_parent_to_intent(intent)
             display_name = intent['intent']
             default_training_phrase = intent['default_training_phrase'].strip()
-            self.intent_manager.create_intent_if_not_exists(display_name=display_name,
-                                                            training_phrase=default_training_phrase)
+            self._run_journaled('intent', display_name, default_training_phrase,
+                                lambda display_name=display_name, default_training_phrase=default_training_phrase:
+                                    self.intent_manager.create_intent_if_not_exists(display_name=display_name,
+                                                                                    training_phrase=default_training_phrase),
+                                resource_type=dialogflowcx.Intent)
 
     
     def create_page(self, page_dict: dict, dialogflow_flow_parent: str, is_start_page=False):
@@ -57,63 +128,245 @@ class DialogflowServiceCX:
         page = self.pages_manager.create_or_update_page(page=page, parent_flow=dialogflow_flow_parent)
         return page
     
-    def create_flows(self, flows_list):
+    def create_flows(self, flows_list, default_flow_routes: list = None):
+        """Create the flows with their pages and routes.
+
+        Args:
+            flows_list (list[dict]): compiled flows. A flow split by PartitionUtils comes with its sub flows,
+                its sub flows of a previous deploy that are not in the list anymore are deleted.
+            default_flow_routes (list, optional): when given, the routes from the default start flow to the
+                new flows are appended to it instead of written, to be added later in one update with
+                add_default_flow_routes. Defaults to None, each route is written with its flow.
+        """
+        self.verify_ids()
         for flow in flows_list:
-            new_flow_object = self.flow_manager.create_flow(flow['display_name']) # Create new flow in dialogflow
+            # Create new flow in dialogflow
+            new_flow_object = self._run_journaled('flow', flow['display_name'], flow['display_name'],
+                                                  lambda flow=flow: self.flow_manager.create_flow(flow['display_name']),
+                                                  resource_type=dialogflowcx.Flow)
             sub_pages = sorted(flow['subpages'], key=lambda x: x['depth']) # Order pages by depth level
 
-            if new_flow_object.name != '':
+            if new_flow_object.name != '' and flow.get('entry_page'):
+                # a sub flow of a flow split by PartitionUtils, or a flow of shared sub trees, without a start page
+                self.create_subpages_in_flow(new_flow_object=new_flow_object, sub_pages=sub_pages,
+                                             entry_page_name=flow['entry_page'])
+            elif new_flow_object.name != '':
                 # If new flow is created, then create pages and sub pages in the new flow
-                start_page = self.create_page(page_dict=flow, dialogflow_flow_parent=new_flow_object.name, is_start_page=True)
-                self.transition_route_manager.add_transition_route_to_new_flow(intent_name=flow['parent_intent'], target_flow_name=new_flow_object.name)
-                
-                self.transition_route_manager.set_transition_from_default_start_page(intent_name=flow['parent_intent'],
-                                                                                     new_flow=new_flow_object, target_page_name=start_page.name)                                    
+                start_page = self._run_journaled('page', f"{new_flow_object.name}|{flow['display_name']}",
+                                                 self._page_payload(flow),
+                                                 lambda flow=flow: self.create_page(page_dict=flow,
+                                                                                    dialogflow_flow_parent=new_flow_object.name,
+                                                                                    is_start_page=True),
+                                                 resource_type=dialogflowcx.Page)
+                if 'parent_intent' not in flow:
+                    self._add_parent_to_intent(flow)
+
+                if default_flow_routes is None:
+                    self._run_journaled('route', f"{self.flow_manager.parent}|{flow['parent_intent']}", new_flow_object.name,
+                                        lambda: self.transition_route_manager.add_transition_route_to_new_flow(
+                                            intent_name=flow['parent_intent'], target_flow_name=new_flow_object.name))
+                else:
+                    default_flow_routes.append({'intent': flow['parent_intent'], 'target_flow': new_flow_object.name})
+
+                self._run_journaled('route', f"{new_flow_object.name}|{flow['parent_intent']}", start_page.name,
+                                    lambda: self.transition_route_manager.set_transition_from_default_start_page(
+                                        intent_name=flow['parent_intent'],
+                                        # a flow skipped by the journal only has its name, so it is fetched again
+                                        new_flow=new_flow_object if new_flow_object.display_name else self.flow_manager.get_flow(new_flow_object.name),
+                                        target_page_name=start_page.name))
                 
                 self.create_subpages_in_flow(new_flow_object=new_flow_object, sub_pages=sub_pages)
-                
-    def create_subpages_in_flow(self, new_flow_object, sub_pages: list[dict]):
-        # Iterate through flow sub pages
-                for sub_page in sub_pages:
-                    # When parent page is none, should be the start page
-                    if sub_page['parent'] != None:
-                        father_page_name = sub_page['parent']
-                        sub_page_object = self.create_page(page_dict=sub_page, dialogflow_flow_parent=new_flow_object.name)         
-                        father_page = self.pages_manager.get_page_by_display_name(display_name=father_page_name, parent_flow=new_flow_object.name)
-                        
-                        # Ensure father (parent) page exists                                 
-                        if father_page is None:
-                            father_page_dict =DialogFlowUtils.find_subpage_in_subpages_by_display_name(subpages=sub_pages, display_name=father_page_name)                                                              
-                            father_page = self.create_page(page_dict=father_page_dict, dialogflow_flow_parent=new_flow_object.name)
-                        
-                        if len(sub_page['entityValues']) >= 0:
-                            for entity_type_value in sub_page['entityValues']:
-                                condition = f'{sub_page["route_params_entity_types"]} = "{entity_type_value}"'
-                                
-                                # check if subpage is endflow, 
-                                if sub_page['is_end_flow']:
-                                    # if sub_page is end flow, add entry fulfillment message to the father page route with condition
-                                    DialogFlowUtils.add_fulfillment_to_route(father_page=father_page,
-                                                                            condition=condition,
-                                                                            entry_fulfillment=sub_page['entry_fulfillment'],
-                                                                            pages_manager=self.pages_manager)
-                                else:
-                                    # create a new page with transition route from father page
-                                    DialogFlowUtils.add_condition_route_to_page(father_page=father_page,
-                                                                                children_page_parent=sub_page_object.name,
-                                                                                condition=condition,
-                                                                                pages_manager=self.pages_manager)
-                                    
-    def create_pages_faq(self, flows):
-        pages_created = []
-        for flow in flows:
-            response = self.pages_manager.create_or_update_page_faq(flow,
-                                                                    flow['startNode']['text'],
-                                                                    parent_flow=self.flow_manager.parent)
-            pages_created.append(response)
-        return pages_created
+
+        # the sub flows of a previous partition of the flows, when they were bigger
+        part_names = {flow['display_name']: set() for flow in flows_list if 'parent_flow' not in flow}
+        for flow in flows_list:
+            if 'parent_flow' in flow:
+                part_names.setdefault(flow['parent_flow'], set()).add(flow['display_name'])
+        self.flow_manager.delete_stale_parts(part_names)
+
+    def delete_unused_shared_flows(self, flows_list) -> list:
+        """Delete the shared flows of sub trees that no flow routes to anymore, after a sub tree changed.
+
+        Args:
+            flows_list (list[dict]): compiled flows of the whole agent, once they are deployed. The shared
+                flows used by a flow left out of the list would be deleted with its routes to them.
+
+        Returns:
+            list: display names of the deleted flows.
+        """
+        self.verify_ids()
+        used_names = {page['target_flow'] for flow in flows_list for page in flow['subpages']
+                      if page.get('target_flow')}
+        return self.flow_manager.delete_unused_flows(SHARED_FLOW_PREFIX, used_names)
+
+    def add_default_flow_routes(self, routes: list[dict]):
+        """Add the routes collected by create_flows to the default start flow, in one update.
+
+        The routes are journaled like the ones written by create_flows, so a resumed run skips them.
+        """
+        self.verify_ids()
+        keyed = {f"{self.flow_manager.parent}|{route['intent']}": route for route in routes}
+        pending = {key: route for key, route in keyed.items()
+                   if self.journal is None or self.journal.lookup('route', key, route['target_flow']) is None}
+        if not pending:
+            return None
+        flow = self.transition_route_manager.add_transition_routes_to_default_flow(list(pending.values()))
+        if self.journal is not None:
+            for key, route in pending.items():
+                self.journal.record('route', key, route['target_flow'], route['target_flow'])
+        return flow
+
+    def create_subpages_in_flow(self, new_flow_object, sub_pages: list[dict], entry_page_name: str = None):
+        """Create the sub pages of a flow and the conditional routes between them.
+
+        The entity values that lead to the same page are merged in one OR condition, the routes repeated
+        on several pages are written once in a flow level transition route group, and each parent page
+        gets all its routes and groups in a single update.
+
+        Args:
+            new_flow_object (dialogflowcx.Flow): flow of the pages.
+            sub_pages (list[dict]): compiled pages of the flow.
+            entry_page_name (str, optional): in a flow without start page, the parent of its first pages: the
+                routes from it are written on the start of the flow. Defaults to None.
+        """
+        page_names = {}
+        for sub_page in sub_pages:
+            # When parent page is none, should be the start page. A page with target_flow is in a sub flow
+            if sub_page['parent'] != None and not sub_page.get('target_flow'):
+                sub_page_object = self._run_journaled('page', f"{new_flow_object.name}|{sub_page['display_name']}",
+                                                      self._page_payload(sub_page),
+                                                      lambda sub_page=sub_page: self.create_page(page_dict=sub_page,
+                                                                                                 dialogflow_flow_parent=new_flow_object.name),
+                                                      resource_type=dialogflowcx.Page)
+                page_names[sub_page['display_name']] = sub_page_object.name
+
+        planned_routes = RouteUtils.plan_page_routes(sub_pages)
+        flow_names = self._target_flow_names(planned_routes)
+        entry_routes = planned_routes.pop(entry_page_name, []) if entry_page_name else []
+        if entry_routes:
+            self._run_journaled('route', f'{new_flow_object.name}|entry', entry_routes,
+                                lambda: self._set_flow_entry_routes(new_flow_object.name,
+                                                                    [DialogFlowUtils.build_transition_route(route, page_names, flow_names)
+                                                                     for route in entry_routes]))
+
+        page_routes, route_groups, page_groups = RouteUtils.plan_route_groups(planned_routes, flow_name=new_flow_object.name)
+        # the start page is written even without routes, the routes of a previous run to pages that are gone are removed
+        start_page_names = [] if entry_page_name else [sub_page['display_name'] for sub_page in sub_pages
+                                                       if sub_page['parent'] is None]
+        # the shared route groups of previous runs, replaced on the pages by the ones of this run
+        existing_groups = self.transition_route_manager.get_route_groups_by_display_name(new_flow_object.name)
+        managed_groups = {display_name: route_group.name for display_name, route_group in existing_groups.items()
+                          if display_name.startswith(SHARED_ROUTES_PREFIX)}
+        route_group_names = {}
+        for display_name, routes in route_groups.items():
+            route_group = self._run_journaled('route_group', f'{new_flow_object.name}|{display_name}', routes,
+                                              lambda display_name=display_name, routes=routes:
+                                                  self.transition_route_manager.create_or_update_route_group(
+                                                      parent_flow=new_flow_object.name, display_name=display_name,
+                                                      transition_routes=[DialogFlowUtils.build_transition_route(route, page_names, flow_names)
+                                                                         for route in routes],
+                                                      existing_groups=existing_groups),
+                                              resource_type=dialogflowcx.TransitionRouteGroup)
+            route_group_names[display_name] = route_group.name
+
+        for father_page_name in dict.fromkeys([*start_page_names, *page_routes, *page_groups]):
+            routes = page_routes.get(father_page_name, [])
+            groups = page_groups.get(father_page_name, [])
+            self._run_journaled('route', f'{new_flow_object.name}|{father_page_name}', {'routes': routes, 'groups': groups},
+                                lambda father_page_name=father_page_name, routes=routes, groups=groups:
+                                    DialogFlowUtils.set_routes_on_page(father_page=self._get_or_create_father_page(father_page_name,
+                                                                                                                   new_flow_object,
+                                                                                                                   sub_pages),
+                                                                       transition_routes=[DialogFlowUtils.build_transition_route(route, page_names, flow_names)
+                                                                                          for route in routes],
+                                                                       route_group_names=[route_group_names[group] for group in groups],
+                                                                       pages_manager=self.pages_manager,
+                                                                       managed_group_names=set(managed_groups.values())))
+
+        # no page references the shared groups that this run doesn't write anymore
+        for display_name, name in managed_groups.items():
+            if display_name not in route_groups:
+                info_logger.info(f"Deleting unused transition route group {display_name}")
+                self.transition_route_manager.delete_route_group(name)
+
+    def dedupe_routes(self) -> dict:
+        """Remove the duplicated routes (same condition, intent and target) of every flow, page and route group.
+
+        Agents deployed before the routes were reconciled have a copy of the routes of each page for
+        every run. This pass lists each flow once and only updates the resources with duplicates.
+
+        Returns:
+            dict: counters of the flows, pages and route groups updated and of the routes removed.
+        """
+        self.verify_ids()
+        stats = {'flows': 0, 'pages': 0, 'route_groups': 0, 'routes_removed': 0}
+
+        def deduped(resource, kind):
+            routes = DialogFlowUtils.reconcile_transition_routes(resource.transition_routes, [], keep_existing=True)
+            removed = len(resource.transition_routes) - len(routes)
+            if removed:
+                info_logger.info(f"Removing {removed} duplicated routes of {kind} {resource.display_name}")
+                stats[kind] += 1
+                stats['routes_removed'] += removed
+            return routes if removed else None
+
+        flow_names = [self.flow_manager.parent] + [flow.name for flow in self.flow_manager.get_flows_by_display_name().values()
+                                                   if flow.name != self.flow_manager.parent]
+        for flow_name in flow_names:
+            flow = self.flow_manager.get_flow(flow_name)
+            routes = deduped(flow, 'flows')
+            if routes is not None:
+                flow.transition_routes = routes
+                self.flow_manager.update_flow_routes(flow)
+            for page in self.pages_manager.get_pages_by_display_name(flow_name).values():
+                routes = deduped(page, 'pages')
+                if routes is not None:
+                    page.transition_routes = routes
+                    self.pages_manager.update_page_routes(page)
+            route_groups = self.transition_route_manager.get_route_groups_by_display_name(flow_name)
+            for display_name, route_group in route_groups.items():
+                routes = deduped(route_group, 'route_groups')
+                if routes is not None:
+                    self.transition_route_manager.create_or_update_route_group(flow_name, display_name, routes,
+                                                                               existing_groups=route_groups)
+        return stats
+
+    def _target_flow_names(self, page_routes: dict) -> dict:
+        """Resource names of the sub flows the routes lead to, created empty if they are not deployed yet."""
+        target_flows = sorted({route['target_flow'] for routes in page_routes.values() for route in routes
+                               if route.get('target_flow')})
+        return {display_name: self._run_journaled('flow', display_name, display_name,
+                                                  lambda display_name=display_name: self.flow_manager.create_flow(display_name),
+                                                  resource_type=dialogflowcx.Flow).name
+                for display_name in target_flows}
+
+    def _set_flow_entry_routes(self, flow_name, transition_routes):
+        """Replace the routes of the start of a sub flow, unless they are already the same."""
+        flow = self.flow_manager.get_flow(flow_name)
+        routes = DialogFlowUtils.reconcile_transition_routes(flow.transition_routes, transition_routes)
+        if DialogFlowUtils.same_routes(routes, flow.transition_routes):
+            return flow
+        flow.transition_routes = routes
+        return self.flow_manager.update_flow_routes(flow)
+
+    def _get_or_create_father_page(self, father_page_name, new_flow_object, sub_pages):
+        father_page = self.pages_manager.get_page_by_display_name(display_name=father_page_name,
+                                                                  parent_flow=new_flow_object.name)
+        # Ensure father (parent) page exists
+        if father_page is None:
+            father_page_dict = DialogFlowUtils.find_subpage_in_subpages_by_display_name(subpages=sub_pages,
+                                                                                       display_name=father_page_name)
+            father_page = self.create_page(page_dict=father_page_dict, dialogflow_flow_parent=new_flow_object.name)
+        return father_page
+
+    def delete_flow(self, display_name):
+        """Delete a flow and the sub flows it was split in."""
+        self.verify_ids()
+        self.flow_manager.delete_stale_parts({display_name: set()})
+        return self.flow_manager.delete_flow(display_name)
 
     def delete_pages(self):
+        self.verify_ids()
         return self.pages_manager.delete_all_pages()
 
     def _add_parent_to_intent(self, flow):
@@ -132,3 +385,49 @@ class DialogflowServiceCX:
             if flow['intent'] == intent['display_name']:
                 flow['parent_intent'] = intent['parent']
                 return flow
+
+    def _verify_cached_ids(self, cache_key):
+        """Check the cached ids with one get_agent call, and invalidate them if the agent changed."""
+        try:
+            agent = self.agent_manager.get_agent()
+            valid = agent.display_name == self.agent_manager.agent_name and \
+                agent.start_flow.split('/')[-1] == self.flow_manager.default_flow_id
+        except Exception as e:
+            error_logger.error(f'error trying to verify the cached ids of {cache_key}: {e}')
+            valid = False
+        if not valid:
+            error_logger.error(f'Cached ids of {cache_key} are not valid anymore, they are resolved again before the first write')
+            self.id_cache.invalidate(cache_key)
+        return valid
+
+    def _run_journaled(self, kind, key, payload, operation, resource_type=None):
+        """Execute a dialogflow mutation unless it is already recorded in the journal.
+
+        Args:
+            kind (str): Operation kind such as entity_type, intent, flow, page or route.
+            key (str): Unique key of the operation inside its kind.
+            payload: Content written by the operation, its hash decides if the operation changed.
+            operation (callable): Function that executes the mutation.
+            resource_type (optional): Dialogflow type used to rebuild a skipped result from its resource name.
+
+        Returns:
+            The result of the operation, or a resource_type instance with only the name set if it was skipped.
+        """
+        if self.journal is None:
+            return operation()
+
+        resource_name = self.journal.lookup(kind, key, payload)
+        if resource_name is not None:
+            return resource_type(name=resource_name) if resource_type else resource_name
+
+        result = operation()
+        # failed operations return None, False or a page without name, those are not journaled
+        resource_name = getattr(result, 'name', '')
+        if resource_name:
+            self.journal.record(kind, key, payload, resource_name)
+        return result
+
+    @staticmethod
+    def _page_payload(page_dict: dict) -> dict:
+        """Fields of a page dict that are written to dialogflow, used as journal content."""
+        return {key: value for key, value in page_dict.items() if key not in ('subpages', 'parent_intent')}
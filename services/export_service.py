@@ -0,0 +1,122 @@
+import csv
+import json
+import os
+
+from loggers.logger import get_logger
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+class ExportServiceError(Exception):
+    """Custom exception for ExportService class."""
+    pass
+
+
+class ExportService:
+    """Stream the contentful entries, with their links resolved, to excel, csv or parquet files.
+
+    Records are built one at a time by content type and written straight to the output, so memory
+    does not grow with the number of entries: only the current record, or the current parquet row
+    group, is kept besides the entry store.
+    """
+
+    FORMATS = ('xlsx', 'csv', 'parquet')
+
+    def __init__(self, cf_service, row_group_size=1000):
+        self.cf_service = cf_service
+        self.row_group_size = row_group_size
+
+    def export(self, output: str, file_format: str = 'xlsx') -> list:
+        """Export all entries by content type.
+
+        Args:
+            output (str): excel file for xlsx, directory for csv and parquet (one file by content type).
+            file_format (str, optional): xlsx, csv or parquet. Defaults to xlsx.
+
+        Returns:
+            list: paths of the written files.
+        """
+        if file_format not in self.FORMATS:
+            raise ExportServiceError(f'Unknown export format {file_format}, use one of {self.FORMATS}')
+
+        info_logger.info(f"Exporting entries to {file_format} in {output}")
+        content_types = self.cf_service.get_entry_ids_by_content_type()
+        try:
+            if file_format == 'xlsx':
+                paths = self._export_xlsx(output, content_types)
+            else:
+                if not os.path.exists(output):
+                    os.makedirs(output)
+                write = self._write_csv if file_format == 'csv' else self._write_parquet
+                paths = [write(os.path.join(output, f'{content_type}.{file_format}'), entry_ids)
+                         for content_type, entry_ids in content_types.items()]
+        except ExportServiceError:
+            raise
+        except Exception as e:
+            error_logger.error(f'error trying to export entries to {file_format}: {e}')
+            raise ExportServiceError(f'Failed to export entries to {file_format}: {e}')
+        info_logger.info(f"Exported {len(content_types)} content types to {file_format} successfully")
+        return paths
+
+    def _export_xlsx(self, path, content_types):
+        try:
+            import xlsxwriter
+        except ImportError:
+            raise ExportServiceError('xlsx export requires XlsxWriter: pip install XlsxWriter')
+
+        # constant_memory flushes each row to disk once the next one is written
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        try:
+            for content_type, entry_ids in content_types.items():
+                # excel sheet names are limited to 31 chars
+                worksheet = workbook.add_worksheet(content_type[:31])
+                columns = self.cf_service.get_columns(entry_ids)
+                worksheet.write_row(0, 0, columns)
+                for row, record in enumerate(self.cf_service.iter_records(entry_ids), start=1):
+                    worksheet.write_row(row, 0, self._row(record, columns))
+        finally:
+            workbook.close()
+        return [path]
+
+    def _write_csv(self, path, entry_ids):
+        columns = self.cf_service.get_columns(entry_ids)
+        with open(path, 'w', newline='', encoding='utf-8') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(columns)
+            for record in self.cf_service.iter_records(entry_ids):
+                writer.writerow(self._row(record, columns))
+        return path
+
+    def _write_parquet(self, path, entry_ids):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ExportServiceError('parquet export requires pyarrow: pip install pyarrow')
+
+        columns = self.cf_service.get_columns(entry_ids)
+        # values are written as strings, nested values as json, so all row groups share the schema
+        schema = pa.schema([(column, pa.string()) for column in columns])
+        rows = []
+        with pq.ParquetWriter(path, schema) as writer:
+            for record in self.cf_service.iter_records(entry_ids):
+                rows.append([None if value is None else str(value) for value in self._row(record, columns)])
+                if len(rows) == self.row_group_size:
+                    writer.write_table(self._table(pa, schema, columns, rows))
+                    rows = []
+            if rows:
+                writer.write_table(self._table(pa, schema, columns, rows))
+        return path
+
+    @staticmethod
+    def _table(pa, schema, columns, rows):
+        return pa.Table.from_arrays([pa.array([row[i] for row in rows], type=pa.string()) for i in range(len(columns))],
+                                    schema=schema)
+
+    @staticmethod
+    def _row(record: dict, columns: list) -> list:
+        return [json.dumps(value, ensure_ascii=False, default=str) if isinstance(value, (dict, list)) else value
+                for value in (record.get(column) for column in columns)]
@@ -0,0 +1,276 @@
+import hashlib
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from loggers.logger import get_logger
+from services.journal_service import OperationJournal
+from services.state_service import StateStore
+from utils.utils_dialogflow import DialogFlowUtils
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+FAQ_GROUP_PREFIX = 'faq-routes-'
+# intent routes by transition route group at most, the number of groups grows in powers of two
+ROUTES_PER_GROUP = 100
+
+
+class FaqServiceCXError(Exception):
+    """Custom exception for FaqServiceCX class."""
+    pass
+
+
+class FaqServiceCX:
+    """Sync the faq flows to the default start flow as intent routes, without pages.
+
+    Each faq is a route with its intent and a trigger fulfillment with the answer and the chips
+    payload, so the answer is given without leaving the start page. The routes are spread by a hash
+    of the intent over transition route groups of the default flow, so adding or changing a faq only
+    rewrites its group. Intents and groups are written concurrently, and the groups whose content
+    didn't change since the last sync (saved in state) are skipped. A failed write is counted and
+    the other ones go on, the sync raises once all of them are done.
+    """
+
+    def __init__(self, df_service, state: StateStore = None, max_workers=4, routes_per_group=ROUTES_PER_GROUP):
+        """
+        Args:
+            df_service (DialogflowServiceCX): service with the intent, flow and transition route managers.
+            state (StateStore, optional): names and content hashes of the groups written by previous syncs.
+                Defaults to .cf-to-df/faq_groups.json.
+            max_workers (int, optional): concurrent writes, like the gRPC channels of the factory. Defaults to 4.
+            routes_per_group (int, optional): faq routes by group. Defaults to ROUTES_PER_GROUP.
+        """
+        self.df_service = df_service
+        self.state = state if state is not None else StateStore('.cf-to-df/faq_groups.json')
+        self.max_workers = max_workers
+        self.routes_per_group = routes_per_group
+        self.stats = {}
+
+    def sync(self, faqs: list[dict]) -> dict:
+        """Create or update the intents and route groups of the faqs, and attach the groups to the default flow.
+
+        Args:
+            faqs (list[dict]): ContentfulService.faqs
+
+        Returns:
+            dict: counters of the intents and groups created, updated, unchanged, deleted and failed.
+
+        Raises:
+            FaqServiceCXError: when some groups could not be written, after the other ones are written.
+        """
+        self.stats = self._new_stats()
+        # the last faq of an intent wins, like the intents created by create_intents
+        faqs = list({faq['intent']: faq for faq in faqs}.values())
+        intent_names = self._sync_intents(faqs)
+        flow_name = self.df_service.flow_manager.parent
+        existing_groups = self.df_service.transition_route_manager.get_route_groups_by_display_name(flow_name)
+        group_counts = [count for count in map(self.group_count, existing_groups) if count is not None]
+        groups = self.plan_groups([faq for faq in faqs if faq['intent'] in intent_names], self.routes_per_group,
+                                  group_count=max(group_counts) if group_counts else None)
+        self._sync_groups(groups, intent_names, existing_groups)
+        info_logger.info('FAQ sync: ' + ', '.join(f'{key}={value}' for key, value in self.stats.items()))
+        self._raise_for_failed_groups()
+        return self.stats
+
+    @staticmethod
+    def plan_groups(faqs: list[dict], routes_per_group: int = ROUTES_PER_GROUP, group_count: int = None) -> dict:
+        """Group display name -> faqs of the group, sorted by intent.
+
+        The group of a faq depends only on its intent and the number of groups, a power of two. The
+        number of groups of the previous sync (group_count) is kept until one of its groups would have
+        more than routes_per_group routes, then it doubles, so a growing catalog only rewrites the
+        groups of the new faqs. It goes back down when the faqs fit in a quarter of the groups.
+        """
+        if not faqs:
+            return {}
+        needed = FaqServiceCX._fitting_group_count(
+            faqs, routes_per_group, 2 ** math.ceil(math.log2(max(1, math.ceil(len(faqs) / routes_per_group)))))
+        if group_count is not None and needed * 4 > group_count:
+            needed = FaqServiceCX._fitting_group_count(faqs, routes_per_group, group_count)
+        return FaqServiceCX._groups_of(faqs, needed)
+
+    @staticmethod
+    def _fitting_group_count(faqs, routes_per_group, group_count):
+        """The first number of groups from group_count, doubling it, where no group overflows."""
+        while group_count < len(faqs) and \
+                max(map(len, FaqServiceCX._groups_of(faqs, group_count).values())) > routes_per_group:
+            group_count *= 2
+        return group_count
+
+    @staticmethod
+    def group_count(display_name: str):
+        """Number of groups in the name of a faq group, faq-routes-<count>-<index>, None for other groups."""
+        match = re.fullmatch(rf'{re.escape(FAQ_GROUP_PREFIX)}(\d+)-\d+', display_name)
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def _groups_of(faqs, group_count):
+        groups = {}
+        for faq in sorted(faqs, key=lambda faq: faq['intent']):
+            index = int(hashlib.sha1(faq['intent'].encode('utf-8')).hexdigest(), 16) % group_count
+            groups.setdefault(f'{FAQ_GROUP_PREFIX}{group_count}-{index}', []).append(faq)
+        return dict(sorted(groups.items()))
+
+    def upsert(self, faqs: list[dict]) -> dict:
+        """Create or update only the given faqs, keeping the other routes of their groups.
+
+        A selective deploy doesn't have the whole catalog, so sync would drop the faqs it doesn't know.
+        Here the routes of the given intents are replaced in the groups they hash to, with the number of
+        groups already in the default flow, and no group is deleted. The written groups are forgotten
+        from the state, so the next sync rewrites them from the whole catalog.
+
+        Args:
+            faqs (list[dict]): compiled faqs of the selected flows.
+
+        Returns:
+            dict: counters of the intents and groups, like sync.
+        """
+        self.stats = self._new_stats()
+        faqs = list({faq['intent']: faq for faq in faqs}.values())
+        intent_names = self._sync_intents(faqs)
+        faqs = [faq for faq in faqs if faq['intent'] in intent_names]
+        flow_name = self.df_service.flow_manager.parent
+        route_manager = self.df_service.transition_route_manager
+        existing_groups = {display_name: group for display_name, group in
+                           route_manager.get_route_groups_by_display_name(flow_name).items()
+                           if self.group_count(display_name) is not None}
+        group_counts = [self.group_count(display_name) for display_name in existing_groups]
+        groups = self._groups_of(faqs, max(group_counts)) if group_counts else self.plan_groups(faqs)
+
+        tasks = []
+        for display_name, group_faqs in groups.items():
+            routes = [DialogFlowUtils.build_faq_route(intent_names[faq['intent']], faq) for faq in group_faqs]
+            existing_group = existing_groups.get(display_name)
+            if existing_group is not None:
+                replaced = {route.intent for route in routes}
+                routes = [route for route in existing_group.transition_routes if route.intent not in replaced] + routes
+            tasks.append(('groups_written', display_name,
+                          lambda display_name=display_name, routes=routes: route_manager.create_or_update_route_group(
+                              parent_flow=flow_name, display_name=display_name, transition_routes=routes,
+                              existing_groups=existing_groups)))
+
+        group_names = {display_name: group.name for display_name, group in existing_groups.items()}
+        for counter, display_name, route_group in self._run_concurrently(tasks):
+            if route_group is None:
+                self.stats['groups_failed'] += 1
+                continue
+            self.stats[counter] += 1
+            group_names[display_name] = route_group.name
+            self.state.forget(f'{flow_name}|{display_name}')
+        self._attach_groups(flow_name, [group_names[display_name] for display_name in sorted(group_names)], [])
+        info_logger.info('FAQ upsert: ' + ', '.join(f'{key}={value}' for key, value in self.stats.items()))
+        self._raise_for_failed_groups()
+        return self.stats
+
+    @staticmethod
+    def _new_stats():
+        return {'intents_created': 0, 'intents_updated': 0, 'intents_unchanged': 0, 'intents_failed': 0,
+                'groups_written': 0, 'groups_unchanged': 0, 'groups_deleted': 0, 'groups_failed': 0}
+
+    def _raise_for_failed_groups(self):
+        if self.stats['groups_failed']:
+            raise FaqServiceCXError(f"{self.stats['groups_failed']} faq groups could not be written, "
+                                    f"the next sync writes them again")
+
+    def _sync_intents(self, faqs):
+        """Create the missing faq intents and add the new training phrases, return intent display name -> name."""
+        intent_manager = self.df_service.intent_manager
+        existing_intents = intent_manager.get_intents_by_display_name()
+        intent_names = {}
+        tasks = []
+        for faq in faqs:
+            phrase = faq['question'].strip()
+            intent = existing_intents.get(faq['intent'])
+            if intent is None:
+                tasks.append(('intents_created', faq['intent'],
+                              lambda faq=faq, phrase=phrase: intent_manager.create_intent(faq['intent'], phrase)))
+            elif phrase not in [''.join(part.text for part in training_phrase.parts)
+                                for training_phrase in intent.training_phrases]:
+                tasks.append(('intents_updated', faq['intent'],
+                              lambda intent=intent, phrase=phrase: intent_manager.update_intent(intent, phrase)))
+            else:
+                self.stats['intents_unchanged'] += 1
+                intent_names[faq['intent']] = intent.name
+
+        for counter, display_name, result in self._run_concurrently(tasks):
+            if result:
+                self.stats[counter] += 1
+                intent_names[display_name] = result.name
+            else:
+                self.stats['intents_failed'] += 1
+                error_logger.error(f'FAQ intent {display_name} could not be written, its answer is skipped')
+        return intent_names
+
+    def _sync_groups(self, groups, intent_names, existing_groups):
+        flow_name = self.df_service.flow_manager.parent
+        route_manager = self.df_service.transition_route_manager
+
+        group_names = {}
+        tasks = []
+        for display_name, group_faqs in groups.items():
+            routes = [(intent_names[faq['intent']], faq) for faq in group_faqs]
+            content_hash = OperationJournal.content_hash(routes)
+            state_key = f'{flow_name}|{display_name}'
+            existing_group = existing_groups.get(display_name)
+            if existing_group is not None and self.state.content_hash(state_key) == content_hash:
+                self.stats['groups_unchanged'] += 1
+                group_names[display_name] = existing_group.name
+                continue
+            tasks.append(('groups_written', (display_name, state_key, content_hash),
+                          lambda display_name=display_name, routes=routes: route_manager.create_or_update_route_group(
+                              parent_flow=flow_name, display_name=display_name,
+                              transition_routes=[DialogFlowUtils.build_faq_route(intent_name, faq) for intent_name, faq in routes],
+                              existing_groups=existing_groups)))
+
+        for counter, (display_name, state_key, content_hash), route_group in self._run_concurrently(tasks):
+            if route_group is None:
+                # the group keeps its previous routes, if it has any, until the next sync
+                self.stats['groups_failed'] += 1
+                if display_name in existing_groups:
+                    group_names[display_name] = existing_groups[display_name].name
+                continue
+            self.stats[counter] += 1
+            group_names[display_name] = route_group.name
+            self.state.record(state_key, content_hash, name=route_group.name)
+
+        # the stale groups still answer the faqs of the groups that failed, they are deleted by the next sync
+        stale_groups = [] if self.stats['groups_failed'] else \
+            [group for display_name, group in existing_groups.items()
+             if self.group_count(display_name) is not None and display_name not in groups]
+        self._attach_groups(flow_name, [group_names[display_name] for display_name in groups
+                                        if display_name in group_names],
+                            [group.name for group in stale_groups])
+        for group in stale_groups:
+            route_manager.delete_route_group(group.name)
+            self.state.forget(f'{flow_name}|{group.display_name}')
+            self.stats['groups_deleted'] += 1
+
+    def _attach_groups(self, flow_name, faq_group_names, stale_group_names):
+        """Reference the faq groups from the default flow, after its other groups, and drop the stale ones."""
+        flow = self.df_service.flow_manager.get_flow(flow_name)
+        current = list(flow.transition_route_groups)
+        desired = [name for name in current if name not in stale_group_names and name not in faq_group_names] + \
+            faq_group_names
+        if desired != current:
+            self.df_service.transition_route_manager.set_flow_route_groups(flow_name, desired)
+
+    def _run_concurrently(self, tasks):
+        """Run (counter, key, operation) tasks in a thread pool, yield (counter, key, result) in order.
+
+        The result of a task that raised is None, the error is logged and the other tasks go on.
+        """
+        if not tasks:
+            return
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [(counter, key, executor.submit(operation)) for counter, key, operation in tasks]
+            for counter, key, future in futures:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error_logger.error(f'error trying to write faq {key}: {e}')
+                    result = None
+                yield counter, key, result
@@ -0,0 +1,117 @@
+from loggers.logger import get_logger
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+# content types read by the migration
+ROOT_CONTENT_TYPES = ('flow', 'entityType')
+
+# fields read from each root content type by ContentfulService (flows, intents, entity_types and compile_flows)
+FIELDS_BY_CONTENT_TYPE = {
+    'flow': ['key', 'intent', 'question', 'startNode', 'flowEntityTypes'],
+    'entityType': ['entityType', 'entityValue'],
+}
+
+# fields read by _map_subpages_from_flow and build_payload_response from the linked entries
+LINKED_ENTRY_FIELDS = ['text', 'entityType', 'entityValue', 'entityValues', 'synonyms', 'chips',
+                       'location', 'url', 'buttons', 'list', 'fallbacks']
+
+# sys is needed to build the CompactEntry records
+SYS_SELECT = 'sys'
+
+# selector of a selective run -> content type and field of the root entries it picks by name
+SELECTORS = {
+    'flows': ('flow', 'key'),
+    'intents': ('flow', 'intent'),
+    'entity_types': ('entityType', 'entityType'),
+}
+
+
+class FetchPlannerError(Exception):
+    """Custom exception for FetchPlanner class."""
+    pass
+
+
+class FetchPlanner:
+    """Plan the contentful queries needed by the migration from the content type definitions.
+
+    Only the root content types and the content types reachable through their link fields are fetched,
+    each one with a select projection of the fields that the compiler reads. Link fields without a
+    linkContentType validation can point to any content type, so their entries are fetched
+    afterwards by id (see ContentfulService._fetch_missing_linked_entries).
+    """
+
+    def __init__(self, content_types, root_content_types=ROOT_CONTENT_TYPES):
+        self.definitions = {content_type.raw['sys']['id']: content_type.raw for content_type in content_types.items}
+        self.root_content_types = root_content_types
+
+    def plan(self) -> dict:
+        """Return the query of each content type to fetch: content type id -> query params."""
+        queries = {}
+        pending = list(self.root_content_types)
+        while pending:
+            content_type = pending.pop()
+            if content_type in queries:
+                continue
+            fields = self._selected_fields(content_type)
+            queries[content_type] = self._query(content_type, fields)
+            pending.extend(self._linked_content_types(content_type, fields))
+
+        info_logger.info(f"Fetch plan: {', '.join(queries)}")
+        return queries
+
+    def plan_selection(self, selection: dict) -> list[dict]:
+        """Return the queries of the root entries picked by name, with the select projection of plan.
+
+        The entries they link to are not planned by content type, they are fetched afterwards by id, so
+        only the link closure of the selected entries is downloaded.
+
+        Args:
+            selection (dict): selector of SELECTORS -> names, such as {'flows': ['Reclamos']}.
+        """
+        queries = []
+        for selector, names in selection.items():
+            if selector not in SELECTORS:
+                raise FetchPlannerError(f'Unknown selector {selector}, expected one of {", ".join(SELECTORS)}')
+            content_type, field = SELECTORS[selector]
+            query = self._query(content_type, self._selected_fields(content_type))
+            names = list(dict.fromkeys(names))
+            # [in] takes comma separated values, a name with a comma is matched alone
+            listed = [name for name in names if ',' not in name]
+            if listed:
+                queries.append({**query, f'fields.{field}[in]': ','.join(listed)})
+            queries.extend({**query, f'fields.{field}': name} for name in names if ',' in name)
+        info_logger.info(f"Selective fetch plan: {len(queries)} queries")
+        return queries
+
+    @staticmethod
+    def _query(content_type, fields):
+        query = {'content_type': content_type}
+        if fields is not None:
+            query['select'] = ','.join([SYS_SELECT] + [f'fields.{field}' for field in fields])
+        return query
+
+    def _selected_fields(self, content_type):
+        """Fields to select, or None to fetch all fields when the definition is unknown."""
+        definition = self.definitions.get(content_type)
+        if definition is None:
+            return None
+        wanted = FIELDS_BY_CONTENT_TYPE.get(content_type, LINKED_ENTRY_FIELDS)
+        defined = [field['id'] for field in definition.get('fields', [])]
+        return [field for field in wanted if field in defined]
+
+    def _linked_content_types(self, content_type, fields):
+        definition = self.definitions.get(content_type, {})
+        linked = []
+        for field in definition.get('fields', []):
+            if fields is not None and field['id'] not in fields:
+                continue
+            link = field.get('items', {}) if field.get('type') == 'Array' else field
+            if link.get('type') != 'Link' or link.get('linkType') != 'Entry':
+                continue
+            for validation in link.get('validations', []):
+                linked.extend(validation.get('linkContentType', []))
+        return linked
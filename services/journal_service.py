@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import time
+
+from loggers.logger import get_logger
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+class OperationJournalError(Exception):
+    """Custom exception for OperationJournal class."""
+    pass
+
+
+class OperationJournal:
+    """Append-only local journal of completed Dialogflow mutations.
+
+    Each line of the journal is a json record with the operation kind and key, the hash of the
+    content that was written and the resulting resource name. When the journal is opened with
+    resume=True, operations already recorded with the same content hash are skipped, so a
+    crashed migration only repeats the work that was left.
+    """
+
+    def __init__(self, path='.cf-to-df/journal.jsonl', resume=False):
+        self.path = path
+        self.resume = resume
+        self._operations = {}
+        self.skipped = 0
+        self.recorded = 0
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        if self.resume:
+            self._load()
+        else:
+            # a new run starts a new journal
+            open(self.path, 'w').close()
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def content_hash(payload) -> str:
+        """Stable sha256 of any json serializable payload."""
+        serialized = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+    def lookup(self, kind: str, key: str, payload):
+        """Return the journaled resource name of an operation, or None if it has to be executed.
+
+        Args:
+            kind (str): Operation kind such as entity_type, intent, flow, page or route.
+            key (str): Unique key of the operation inside its kind.
+            payload: Content written by the operation, used to detect changes between runs.
+        """
+        record = self._operations.get(f'{kind}:{key}')
+        if record is None or record['hash'] != self.content_hash(payload):
+            return None
+        self.skipped += 1
+        debug_logger.debug(f'Skipping journaled operation {kind}:{key}')
+        return record['resource_name']
+
+    def record(self, kind: str, key: str, payload, resource_name: str):
+        """Append a completed operation to the journal and flush it to disk."""
+        record = {'kind': kind,
+                  'key': key,
+                  'hash': self.content_hash(payload),
+                  'resource_name': resource_name,
+                  'timestamp': time.time()}
+        try:
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except Exception as e:
+            error_logger.error(f'error trying to write journal record {kind}:{key}: {e}')
+            raise OperationJournalError(f'Failed to write journal record: {e}')
+        self._operations[f'{kind}:{key}'] = record
+        self.recorded += 1
+
+    def close(self):
+        info_logger.info(f'Journal closed: {self.recorded} operations recorded, {self.skipped} skipped')
+        self._file.close()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as journal_file:
+            for line_number, line in enumerate(journal_file, start=1):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # the last line can be truncated if the process crashed while writing it
+                    error_logger.warning(f'Ignoring malformed journal line {line_number} in {self.path}')
+                    continue
+                self._operations[f"{record['kind']}:{record['key']}"] = record
+        info_logger.info(f'Loaded {len(self._operations)} journaled operations from {self.path}')
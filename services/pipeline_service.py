@@ -0,0 +1,366 @@
+import queue
+import threading
+import time
+
+from loggers.logger import get_logger
+from services.contentful_service import ContentfulService, ContentfulServiceError
+from services.fetch_service import FetchPlanner, FIELDS_BY_CONTENT_TYPE, ROOT_CONTENT_TYPES
+from services.journal_service import OperationJournal
+from services.validation_service import ValidationService
+from utils.partition_utils import PartitionUtils
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+# items waiting between two stages, the entries of a few pages or a few compiled flows
+QUEUE_SIZE = 1000
+# entity types first, so they are deployed before the flows whose pages use them
+ROOT_ORDER = {'entityType': 0, 'flow': 1}
+# end of the items of a stage
+END = None
+
+
+class PipelineServiceError(Exception):
+    """Custom exception for PipelineService class."""
+    pass
+
+
+class StageCounter:
+    """Throughput of a pipeline stage.
+
+    blocked_seconds is the time the stage waited for room in the next queue (backpressure) and
+    idle_seconds the time it waited for items of the previous one, the rest of its time is its own work.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.failed = 0
+        self.blocked_seconds = 0.0
+        self.idle_seconds = 0.0
+        self.max_queue = 0
+        self._started = None
+        self._finished = None
+
+    def start(self):
+        self._started = time.perf_counter()
+
+    def finish(self):
+        self._finished = time.perf_counter()
+
+    def to_dict(self) -> dict:
+        wall = ((self._finished or time.perf_counter()) - self._started) if self._started else 0.0
+        busy = max(wall - self.blocked_seconds - self.idle_seconds, 0.0)
+        return {'items': self.items, 'failed': self.failed, 'seconds': round(wall, 3), 'busy_seconds': round(busy, 3),
+                'blocked_seconds': round(self.blocked_seconds, 3), 'idle_seconds': round(self.idle_seconds, 3),
+                'items_per_second': round(self.items / busy, 1) if busy else None, 'max_queue': self.max_queue}
+
+
+class LinkResolver:
+    """Index of the fetched entries that tells when a root entry and every entry it links to are fetched.
+
+    Each root entry (flow or entity type) keeps the set of linked ids still missing, and each missing
+    id the roots that wait for it, so adding an entry only walks the links of the entries it completes.
+    Each entry counts the pending roots that reached it, and is dropped once they are all released, so
+    only the entries of the pending roots are kept. A root found later that links to a dropped entry
+    waits for it like for any missing entry, and it is fetched again by id.
+    """
+
+    def __init__(self, root_content_types=ROOT_CONTENT_TYPES):
+        self.root_content_types = root_content_types
+        self.entries = {}
+        self._links = {}
+        # root id -> missing ids, and the ids already walked for it
+        self._missing = {}
+        self._visited = {}
+        # missing id -> root ids waiting for it
+        self._waiting = {}
+        # entry id -> pending or unreleased roots that reached it, and the entries of the ready roots
+        self._references = {}
+        self._ready = {}
+
+    def add(self, entry) -> list:
+        """Add a fetched entry, return the ids of the roots completed by it, entity types first."""
+        self.entries[entry.id] = entry
+        self._links[entry.id] = set(ContentfulService._find_link_ids(entry.fields))
+        touched = set(self._waiting.pop(entry.id, ()))
+        if entry.content_type_id in self.root_content_types and entry.id not in self._missing:
+            self._missing[entry.id] = set()
+            self._visited[entry.id] = set()
+            touched.add(entry.id)
+        for root_id in touched:
+            self._missing[root_id].discard(entry.id)
+            self._visit(root_id, entry.id)
+        return self._pop_ready([root_id for root_id in touched if not self._missing[root_id]])
+
+    @property
+    def missing_ids(self) -> set:
+        """Linked ids that pending roots wait for."""
+        return set(self._waiting)
+
+    def flush(self) -> list:
+        """Release the pending roots, their missing links don't exist and are left out like in a full compile."""
+        return self._pop_ready(list(self._missing))
+
+    def release(self, root_id):
+        """Drop the entries of a root already emitted that no other root reached.
+
+        The roots themselves are kept, the flows link to the entity types, and they are few.
+        """
+        for entry_id in self._ready.pop(root_id, ()):
+            self._references[entry_id] -= 1
+            if self._references[entry_id]:
+                continue
+            del self._references[entry_id]
+            if self.entries[entry_id].content_type_id not in self.root_content_types:
+                del self.entries[entry_id]
+                del self._links[entry_id]
+
+    def _visit(self, root_id, start_id):
+        visited, missing = self._visited[root_id], self._missing[root_id]
+        stack = [start_id]
+        while stack:
+            entry_id = stack.pop()
+            if entry_id in visited:
+                continue
+            if entry_id not in self.entries:
+                missing.add(entry_id)
+                self._waiting.setdefault(entry_id, set()).add(root_id)
+                continue
+            visited.add(entry_id)
+            self._references[entry_id] = self._references.get(entry_id, 0) + 1
+            stack.extend(self._links[entry_id])
+
+    def _pop_ready(self, root_ids):
+        for root_id in root_ids:
+            del self._missing[root_id]
+            self._ready[root_id] = self._visited.pop(root_id)
+        for waiting in self._waiting.values():
+            waiting.difference_update(root_ids)
+        self._waiting = {entry_id: roots for entry_id, roots in self._waiting.items() if roots}
+        return sorted(root_ids, key=lambda root_id: ROOT_ORDER.get(self.entries[root_id].content_type_id, len(ROOT_ORDER)))
+
+
+class PipelineService:
+    """Stream the entries from contentful to dialogflow: fetch -> resolve and compile -> deploy.
+
+    The stages run at the same time, connected by bounded queues: the fetch stage reads the entries
+    page by page, the compile stage compiles each flow and entity type as soon as all the entries it
+    links to are fetched, and the deploy stage writes them while the next pages are fetched. A full
+    queue blocks the stage before it, so only queue_size items wait between two stages, and no
+    dataframe of the whole space is built. The faqs are synced at the end, because their groups
+    are planned from the whole catalog, and then the changed flows are trained.
+
+    Unlike the deploy command, the compiled data is not validated as a whole before the first write.
+    """
+
+    def __init__(self, cf_service, df_service, queue_size=QUEUE_SIZE, train=True, flow_budget=None):
+        """
+        Args:
+            cf_service (ContentfulService): service with the contentful client and the root content types.
+            df_service (DialogflowServiceCX): service of the agent, with its journal.
+            queue_size (int, optional): items between two stages. Defaults to QUEUE_SIZE.
+            train (bool, optional): train the changed flows at the end. Defaults to True.
+            flow_budget (dict, optional): limits that replace the ones in FLOW_BUDGET to split the flows.
+        """
+        self.cf_service = cf_service
+        self.df_service = df_service
+        self.queue_size = queue_size
+        self.train = train
+        self.flow_budget = flow_budget
+        self.counters = {name: StageCounter(name) for name in ('fetch', 'compile', 'deploy')}
+        self._stop = threading.Event()
+        self._errors = []
+
+    def run(self) -> dict:
+        """Run the pipeline until every entry is deployed.
+
+        Returns:
+            dict: counters of each stage, and the training report when train is on.
+        """
+        entries_queue = queue.Queue(maxsize=self.queue_size)
+        compiled_queue = queue.Queue(maxsize=self.queue_size)
+        threads = [threading.Thread(target=self._run_stage, args=(self._fetch, entries_queue), name='pipeline-fetch',
+                                    daemon=True),
+                   threading.Thread(target=self._run_stage, args=(self._compile, entries_queue, compiled_queue),
+                                    name='pipeline-compile', daemon=True)]
+        for thread in threads:
+            thread.start()
+        try:
+            report = self._deploy(compiled_queue)
+        except Exception:
+            self._stop.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+        if self._errors:
+            raise PipelineServiceError(f'Pipeline failed: {self._errors[0]}') from self._errors[0]
+        stats = {name: counter.to_dict() for name, counter in self.counters.items()}
+        info_logger.info('Pipeline: ' + '; '.join(f"{name}: {counter['items']} items, {counter['items_per_second']}/s"
+                                                  for name, counter in stats.items()))
+        if report is not None:
+            stats['training'] = report
+        return stats
+
+    def _run_stage(self, stage, *queues):
+        try:
+            stage(*queues)
+        except Exception as e:
+            error_logger.error(f'error in pipeline stage {stage.__name__}: {e}')
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            # the next stage always gets the end of the items, even after an error
+            self._put(queues[-1], END, None)
+
+    def _put(self, items_queue, item, counter):
+        started = time.perf_counter()
+        while not self._stop.is_set() or item is END:
+            try:
+                items_queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                if item is END and self._stop.is_set():
+                    # nobody reads the queue anymore
+                    return
+        if counter is not None:
+            counter.blocked_seconds += time.perf_counter() - started
+            counter.max_queue = max(counter.max_queue, items_queue.qsize())
+
+    def _get(self, items_queue, counter):
+        started = time.perf_counter()
+        item = END
+        while True:
+            try:
+                item = items_queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if self._stop.is_set():
+                    # the stage before could not put its end in a full queue
+                    break
+        counter.idle_seconds += time.perf_counter() - started
+        return item
+
+    def _fetch(self, entries_queue):
+        counter = self.counters['fetch']
+        counter.start()
+        client = self.cf_service.client
+        root_content_types = self.cf_service.root_content_types
+        queries = FetchPlanner(self.cf_service.content_types, root_content_types).plan() if root_content_types \
+            else {None: None}
+        try:
+            for content_type, query in queries.items():
+                info_logger.info(f"Streaming entries of content type {content_type or 'all'}")
+                for entry in client.iter_compact_entries(query=query):
+                    if self._stop.is_set():
+                        return
+                    self._put(entries_queue, entry, counter)
+                    counter.items += 1
+        finally:
+            counter.finish()
+
+    def _compile(self, entries_queue, compiled_queue):
+        counter = self.counters['compile']
+        counter.start()
+        resolver = LinkResolver(self.cf_service.root_content_types or ROOT_CONTENT_TYPES)
+        # resolves the links of the records over the entries fetched so far
+        records = ContentfulService(self.cf_service.client)
+        records._all_entries_dict = resolver.entries
+        while True:
+            entry = self._get(entries_queue, counter)
+            if entry is END:
+                break
+            for root_id in resolver.add(entry):
+                self._emit(records, root_id, compiled_queue, counter)
+                resolver.release(root_id)
+
+        # the links to content types outside the plan are fetched by id, like ContentfulService does
+        while resolver.missing_ids and not self._stop.is_set():
+            missing_ids = sorted(resolver.missing_ids)
+            info_logger.info(f"Fetching {len(missing_ids)} linked entries missing from the streamed content types")
+            found = self.cf_service.client.entries_by_ids(missing_ids)
+            for entry in found:
+                for root_id in resolver.add(entry):
+                    self._emit(records, root_id, compiled_queue, counter)
+                    resolver.release(root_id)
+            if not found:
+                error_logger.warning(f"Linked entries not found: {missing_ids}")
+                break
+        for root_id in resolver.flush():
+            self._emit(records, root_id, compiled_queue, counter)
+            resolver.release(root_id)
+        counter.finish()
+
+    def _emit(self, records, root_id, compiled_queue, counter):
+        record = next(records.iter_records([root_id]))
+        for field in FIELDS_BY_CONTENT_TYPE.get(record['type'], []):
+            # the records of a dataframe have every column of the content type
+            record.setdefault(field, None)
+        try:
+            if record['type'] == 'entityType':
+                item = ('entity_type', record, record)
+            elif not ContentfulService.validate_flows([record])[0]:
+                # quarantined, the errors are logged by validate_flows
+                counter.failed += 1
+                return
+            elif record['intent'].startswith('faq'):
+                item = ('faq', records.compile_faqs([record])[0], record)
+            else:
+                item = ('flow', records.compile_flows([record])[0], record)
+        except (ContentfulServiceError, IndexError) as e:
+            error_logger.error(f"Entry {root_id} could not be compiled, it is not deployed: {e}")
+            counter.failed += 1
+            return
+        self._put(compiled_queue, item, counter)
+        counter.items += 1
+
+    def _deploy(self, compiled_queue):
+        from services.faq_service import FaqServiceCX
+        from services.training_service import TrainingServiceCX
+
+        counter = self.counters['deploy']
+        counter.start()
+        entity_type_hashes, intents, faqs, flows, hashes = {}, [], [], [], {}
+        refresh = True
+        while True:
+            item = self._get(compiled_queue, counter)
+            if item is END:
+                break
+            if self._stop.is_set():
+                continue
+            kind, compiled, record = item
+            if kind == 'entity_type':
+                self.df_service.create_entity_types(entity_types=[compiled], refresh=refresh)
+                refresh = False
+                if isinstance(compiled.get('entityType'), str):
+                    entity_type_hashes[ValidationService.entity_type_display_name(compiled['entityType'])] = \
+                        OperationJournal.content_hash(compiled['entityValue'])
+            else:
+                intent = {'intent': record['intent'], 'default_training_phrase': record['question']}
+                intents.append(intent)
+                if kind == 'faq':
+                    faqs.append(compiled)
+                else:
+                    self.df_service.create_intents(intents=[intent])
+                    # a flow over the budget is deployed with its sub flows
+                    flows_list = PartitionUtils.partition_flows([compiled], self.flow_budget)
+                    self.df_service.create_flows(flows_list=flows_list)
+                    flows.append({'display_name': compiled['display_name'], 'intent': compiled['intent']})
+                    for flow in flows_list:
+                        hashes[flow['display_name']] = TrainingServiceCX.flow_hash(flow, entity_type_hashes)
+            counter.items += 1
+        try:
+            if self._stop.is_set():
+                return None
+            if faqs:
+                FaqServiceCX(self.df_service).sync(faqs)
+        finally:
+            counter.finish()
+        if not self.train:
+            return None
+        hashes[None] = TrainingServiceCX.default_flow_hash(intents, faqs, flows)
+        return TrainingServiceCX(self.df_service).train_hashes(hashes)
@@ -0,0 +1,166 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+from loggers.logger import get_logger
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+class StackSampler:
+    """Sampling profiler: a background thread reads the python stack of every other thread at a fixed interval.
+
+    The samples are kept as collapsed stacks (root;caller;function -> count), the input format of
+    flamegraph.pl, speedscope and inferno. Threads waiting on a lock or a socket are sampled too,
+    so the time spent waiting for dialogflow RPCs shows up under the calls that wait for them.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self.stacks[self._collapse(thread_names.get(thread_id, str(thread_id)), frame)] += 1
+            self.samples += 1
+
+    @staticmethod
+    def _collapse(thread_name, frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        frames.append(thread_name)
+        # collapsed stacks go from the root to the leaf, separated by ;
+        return ';'.join(reversed(frames))
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as collapsed_file:
+            for stack, count in self.stacks.most_common():
+                collapsed_file.write(f'{stack} {count}\n')
+
+
+class PhaseProfiler:
+    """Wrap each phase of a migration (fetch, compile, deploy...) in a sampling profiler and tracemalloc snapshots.
+
+    For each phase it writes to the run directory:
+    - <phase>.collapsed: collapsed stacks of the StackSampler, when profile is on.
+    - <phase>.memory.txt: memory allocated by the phase (peak and retained) and its top allocators, when trace_memory is on.
+    and summary.json with the wall time, cpu time, samples and memory of every phase.
+
+    With both options off, phase() returns right away and nothing is written.
+    """
+
+    def __init__(self, run_directory, profile=False, trace_memory=False, interval=0.005, top_allocators=25,
+                 traceback_frames=10):
+        """
+        Args:
+            run_directory (str): directory of the files written for this run.
+            profile (bool, optional): sample the stacks of each phase. Defaults to False.
+            trace_memory (bool, optional): trace the memory allocated by each phase. Defaults to False.
+            interval (float, optional): seconds between stack samples. Defaults to 0.005.
+            top_allocators (int, optional): number of allocators written by phase. Defaults to 25.
+            traceback_frames (int, optional): frames kept by tracemalloc for each allocation, more frames
+                make the allocators easier to find but slow down the traced code. Defaults to 10.
+        """
+        self.run_directory = run_directory
+        self.profile = profile
+        self.trace_memory = trace_memory
+        self.interval = interval
+        self.top_allocators = top_allocators
+        self.traceback_frames = traceback_frames
+        self.summary = {}
+
+    @property
+    def enabled(self):
+        return self.profile or self.trace_memory
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+
+        os.makedirs(self.run_directory, exist_ok=True)
+        sampler = StackSampler(self.interval) if self.profile else None
+        memory_before = self._start_memory_trace() if self.trace_memory else None
+        if sampler:
+            sampler.start()
+        started, cpu_started = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            result = {'wall_seconds': round(time.perf_counter() - started, 4),
+                      'cpu_seconds': round(time.process_time() - cpu_started, 4)}
+            if sampler:
+                sampler.stop()
+                sampler.write(os.path.join(self.run_directory, f'{name}.collapsed'))
+                result['samples'] = sampler.samples
+            if memory_before is not None:
+                result.update(self._write_memory_trace(name, memory_before))
+            self.summary[name] = result
+            info_logger.info(f'Phase {name}: ' + ', '.join(f'{key}={value}' for key, value in result.items()))
+
+    def close(self):
+        """Write summary.json and stop tracing memory."""
+        if not self.enabled:
+            return
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        os.makedirs(self.run_directory, exist_ok=True)
+        with open(os.path.join(self.run_directory, 'summary.json'), 'w', encoding='utf-8') as summary_file:
+            json.dump(self.summary, summary_file, indent=2)
+
+    def _start_memory_trace(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.traceback_frames)
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        return snapshot, tracemalloc.get_traced_memory()[0]
+
+    def _write_memory_trace(self, name, memory_before):
+        snapshot_before, traced_before = memory_before
+        # peak above the memory traced when the phase started
+        peak = tracemalloc.get_traced_memory()[1] - traced_before
+        snapshot = tracemalloc.take_snapshot()
+        differences = snapshot.compare_to(snapshot_before, 'traceback')
+        # the snapshots are not filtered up front, filter_traces is slow on big heaps, so the memory
+        # of tracemalloc and of the stack sampler is only left out of the listed allocators
+        differences = [difference for difference in differences
+                       if difference.traceback[0].filename not in (tracemalloc.__file__, __file__)]
+        allocated = sum(difference.size_diff for difference in differences)
+        with open(os.path.join(self.run_directory, f'{name}.memory.txt'), 'w', encoding='utf-8') as memory_file:
+            memory_file.write(f'peak allocated by the phase: {peak / 1024 ** 2:.1f} MiB\n')
+            memory_file.write(f'retained by the phase: {allocated / 1024 ** 2:.1f} MiB\n\n')
+            for difference in differences[:self.top_allocators]:
+                memory_file.write(f'{difference.size_diff / 1024:+.1f} KiB in {difference.count_diff:+d} blocks\n')
+                for line in difference.traceback.format(limit=5, most_recent_first=True):
+                    memory_file.write(f'{line}\n')
+                memory_file.write('\n')
+        return {'memory_peak_bytes': peak, 'memory_retained_bytes': allocated}
@@ -0,0 +1,303 @@
+import glob
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+
+from loggers.logger import get_logger
+from services.journal_service import OperationJournal
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+SHARDS_PATH = '.cf-to-df/shards'
+# seconds a worker waits for the shared resources of the leader, and the coordinator for the shards
+SHARD_TIMEOUT = 3600
+POLL_SECONDS = 1.0
+# seconds without heartbeat after which the lock of a task is taken over, its worker is gone
+LOCK_STALE_SECONDS = 120
+
+
+class ShardServiceError(Exception):
+    """Custom exception for ShardService class."""
+    pass
+
+
+class ShardService:
+    """Deploy the compiled flows in shards, from several processes or hosts that share a work directory.
+
+    The flows are split by a hash of their key, so a flow always falls in the same shard. The work
+    directory holds the compiled data and one lock file by task, created with O_EXCL, so each task is
+    claimed by exactly one worker. The worker of a task touches its lock while it runs, a lock without
+    report and without heartbeat for stale_seconds belongs to a worker that died, and is taken over:
+
+        work.json              compiled data, shard count and resume flag, written by prepare
+        leader.lock/.json      the shared resources (entity types, intents and faqs), deployed first
+        shard-<n>.lock/.json   the flows of shard n, deployed once leader.json exists
+
+    Each task writes its report (.json) when it ends and keeps its own journal, so a resumed run only
+    repeats the shards that didn't finish. The routes from the default start flow to the new flows
+    are not written by the workers, they would overwrite each other's updates of that flow: they are
+    collected in the reports and written in one update by add_default_flow_routes after merge.
+    """
+
+    def __init__(self, directory=SHARDS_PATH, df_service_factory=None, worker_id=None, timeout=SHARD_TIMEOUT,
+                 poll_seconds=POLL_SECONDS, stale_seconds=LOCK_STALE_SECONDS):
+        """
+        Args:
+            directory (str, optional): work directory shared by the workers. Defaults to SHARDS_PATH.
+            df_service_factory (callable, optional): returns the DialogflowServiceCX of a worker, needed by run_worker.
+            worker_id (str, optional): name of the worker in the reports. Defaults to <host>:<pid>.
+            timeout (int, optional): seconds to wait for the leader or the shards. Defaults to SHARD_TIMEOUT.
+            poll_seconds (float, optional): seconds between two checks of the work directory. Defaults to POLL_SECONDS.
+            stale_seconds (int, optional): seconds without heartbeat after which a lock is taken over.
+                Defaults to LOCK_STALE_SECONDS.
+        """
+        self.directory = directory
+        self.df_service_factory = df_service_factory
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.timeout = timeout
+        self.poll_seconds = poll_seconds
+        self.stale_seconds = stale_seconds
+
+    @staticmethod
+    def shard_of(flow_key: str, shard_count: int) -> int:
+        """Shard of a flow, stable between runs and hosts."""
+        return int(hashlib.sha1(flow_key.encode('utf-8')).hexdigest(), 16) % shard_count
+
+    @staticmethod
+    def split(flows: list[dict], shard_count: int) -> list[list[dict]]:
+        """Split the compiled flows in shard_count shards by their display name.
+
+        The sub flows of a split flow go in the shard of the flow, which deletes the ones it doesn't have anymore.
+        """
+        shards = [[] for _ in range(shard_count)]
+        for flow in flows:
+            shards[ShardService.shard_of(flow.get('parent_flow', flow['display_name']), shard_count)].append(flow)
+        return shards
+
+    def prepare(self, compiled: dict, shard_count: int, resume=False):
+        """Write the work of a sharded deploy, before the workers start.
+
+        With resume, the reports of the tasks that finished with the same compiled data are kept and
+        the locks of the others are released. Otherwise the work directory starts empty.
+        """
+        if shard_count < 1:
+            raise ShardServiceError(f'shard count must be at least 1, got {shard_count}')
+        os.makedirs(self.directory, exist_ok=True)
+        work = {'shard_count': shard_count, 'resume': resume, 'hash': OperationJournal.content_hash(compiled),
+                'compiled': compiled}
+        previous = self._read('work.json')
+        same_work = resume and previous is not None and \
+            (previous['shard_count'], previous['hash']) == (shard_count, work['hash'])
+        # the journals are kept, a resumed task skips the writes they record
+        for path in glob.glob(os.path.join(self.directory, '*.json')) + glob.glob(os.path.join(self.directory, '*.lock')):
+            task = os.path.splitext(os.path.basename(path))[0]
+            report = self._read(f'{task}.json') if same_work and task != 'work' else None
+            if report is None or report['status'] != 'deployed':
+                self._remove(f'{task}.json', f'{task}.lock')
+        self._write('work.json', work)
+        info_logger.info(f"Prepared {len(compiled['flows'])} flows in {shard_count} shards in {self.directory}")
+
+    def run_worker(self) -> dict:
+        """Claim and deploy tasks until none is left: the leader task first, then the shards.
+
+        Returns:
+            dict: task -> status of the tasks deployed by this worker.
+        """
+        work = self._read('work.json')
+        if work is None:
+            raise ShardServiceError(f'No sharded deploy prepared in {self.directory}')
+        compiled = work['compiled']
+        df_service = self.df_service_factory()
+        done = {}
+        leader = None
+        while leader is None:
+            if self._claim('leader'):
+                done['leader'] = self._run_task('leader', df_service, work['resume'],
+                                                lambda report: self._deploy_shared(df_service, compiled, report))
+            # None when the leader died, its task is claimed again
+            leader = self._wait_for('leader.json', task='leader')
+        if leader['status'] != 'deployed':
+            raise ShardServiceError(f"The shared resources were not deployed: {leader.get('error')}")
+
+        for shard, flows in enumerate(self.split(compiled['flows'], work['shard_count'])):
+            task = f'shard-{shard}'
+            if self._claim(task):
+                done[task] = self._run_task(task, df_service, work['resume'],
+                                            lambda report, flows=flows: self._deploy_flows(df_service, flows, report))
+        info_logger.info(f"Worker {self.worker_id} finished: {', '.join(done) or 'nothing left to claim'}")
+        return done
+
+    def wait(self) -> dict:
+        """Wait until every shard has a report, then merge them."""
+        work = self._read('work.json')
+        leader = self._wait_for('leader.json', task='leader')
+        if leader is None or leader['status'] != 'deployed':
+            # the shards don't start without the shared resources
+            return self.merge()
+        for shard in range(work['shard_count']):
+            if self._wait_for(f'shard-{shard}.json', task=f'shard-{shard}') is None:
+                # missing in the merged report, the next worker started or a resumed run deploys it
+                error_logger.warning(f'The worker of shard-{shard} stopped without report')
+        return self.merge()
+
+    def merge(self) -> dict:
+        """Merge the reports of the leader and the shards in one report.
+
+        Returns:
+            dict: status of each task, flows deployed and failed, the default start flow routes to
+                write and the tasks without report.
+        """
+        work = self._read('work.json')
+        merged = {'tasks': {}, 'flows': [], 'failed': [], 'default_flow_routes': [], 'missing': []}
+        for task in ['leader'] + [f'shard-{shard}' for shard in range(work['shard_count'])]:
+            report = self._read(f'{task}.json')
+            if report is None:
+                merged['missing'].append(task)
+                continue
+            merged['tasks'][task] = {key: report[key] for key in ('status', 'worker', 'seconds')}
+            merged['flows'].extend(report.get('flows', []))
+            merged['failed'].extend(report.get('failed', []))
+            merged['default_flow_routes'].extend(report.get('default_flow_routes', []))
+            if report['status'] == 'failed' and 'error' in report:
+                merged['failed'].append({'task': task, 'error': report['error']})
+        return merged
+
+    def _deploy_shared(self, df_service, compiled, report):
+        """The resources used by several flows, deployed once before the shards."""
+        df_service.create_entity_types(entity_types=compiled['entity_types'])
+        faqs = compiled.get('faqs')
+        intents = compiled['intents'] if faqs is None else \
+            [intent for intent in compiled['intents'] if not intent['intent'].startswith('faq')]
+        df_service.create_intents(intents=intents)
+        if faqs:
+            from services.faq_service import FaqServiceCX
+
+            FaqServiceCX(df_service).sync(faqs)
+        report.update(entity_types=len(compiled['entity_types']), intents=len(intents), faqs=len(faqs or []))
+
+    def _deploy_flows(self, df_service, flows, report):
+        """The flows of a shard, one by one with their sub flows, so a failed flow doesn't stop the others."""
+        report.update(flows=[], failed=[], default_flow_routes=[])
+        partitions = {}
+        for flow in flows:
+            partitions.setdefault(flow.get('parent_flow', flow['display_name']), []).append(flow)
+        for display_name, flows_list in partitions.items():
+            try:
+                df_service.create_flows(flows_list=flows_list, default_flow_routes=report['default_flow_routes'])
+            except Exception as e:
+                error_logger.error(f"error trying to deploy flow {display_name}: {e}")
+                report['failed'].append({'flow': display_name, 'error': str(e)})
+                continue
+            report['flows'].extend(flow['display_name'] for flow in flows_list)
+        if report['failed']:
+            report['status'] = 'failed'
+
+    def _run_task(self, task, df_service, resume, deploy):
+        info_logger.info(f'Worker {self.worker_id} deploying {task}')
+        started = time.perf_counter()
+        report = {'task': task, 'worker': self.worker_id, 'status': 'deployed'}
+        df_service.journal = OperationJournal(path=os.path.join(self.directory, f'{task}.journal.jsonl'), resume=resume)
+        stopped = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(task, stopped), daemon=True)
+        heartbeat.start()
+        try:
+            try:
+                deploy(report)
+            except Exception as e:
+                error_logger.error(f'error trying to deploy {task}: {e}')
+                report.update(status='failed', error=str(e))
+            finally:
+                df_service.journal.close()
+                df_service.journal = None
+            report['seconds'] = round(time.perf_counter() - started, 2)
+            self._write(f'{task}.json', report)
+        finally:
+            # stopped once the report is written, so the lock is never stale without it
+            stopped.set()
+            heartbeat.join()
+        return report['status']
+
+    def _heartbeat(self, task, stopped):
+        while not stopped.wait(self.stale_seconds / 4):
+            try:
+                os.utime(os.path.join(self.directory, f'{task}.lock'))
+            except FileNotFoundError:
+                error_logger.warning(f'The lock of {task} was removed while {self.worker_id} deployed it')
+
+    def _claim(self, task) -> bool:
+        path = os.path.join(self.directory, f'{task}.lock')
+        try:
+            descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self._is_stale(task):
+                return False
+            # renamed, not removed, so only one of the workers that found it stale takes it over
+            stale_path = f'{path}.{self.worker_id.replace(os.sep, "_")}.stale'
+            try:
+                os.rename(path, stale_path)
+            except FileNotFoundError:
+                return False
+            if time.time() - os.path.getmtime(stale_path) < self.stale_seconds:
+                # another worker took it over meanwhile, its lock is given back
+                os.rename(stale_path, path)
+                return False
+            os.remove(stale_path)
+            error_logger.warning(f'Worker {self.worker_id} takes over {task}, its lock had no heartbeat '
+                                 f'for {self.stale_seconds} seconds')
+            return self._claim(task)
+        with os.fdopen(descriptor, 'w') as lock_file:
+            lock_file.write(self.worker_id)
+        return True
+
+    def _is_stale(self, task) -> bool:
+        """Whether the lock of a task has no report and no heartbeat for stale_seconds."""
+        try:
+            modified = os.path.getmtime(os.path.join(self.directory, f'{task}.lock'))
+        except FileNotFoundError:
+            return False
+        return time.time() - modified >= self.stale_seconds and self._read(f'{task}.json') is None
+
+    def _wait_for(self, name, task=None):
+        """Wait for a report of the work directory.
+
+        With a task, returns None as soon as its lock is stale, the worker that claimed it died.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            data = self._read(name)
+            if data is not None:
+                return data
+            if task is not None and self._is_stale(task):
+                return None
+            if time.monotonic() > deadline:
+                raise ShardServiceError(f'Timed out waiting for {os.path.join(self.directory, name)}')
+            time.sleep(self.poll_seconds)
+
+    def _read(self, name):
+        try:
+            with open(os.path.join(self.directory, name), encoding='utf-8') as work_file:
+                return json.load(work_file)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, name, data):
+        # written whole and renamed, so the other workers never read half a report
+        path = os.path.join(self.directory, name)
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as work_file:
+            json.dump(data, work_file, ensure_ascii=False, default=str)
+        os.replace(temporary_path, path)
+
+    def _remove(self, *names):
+        for name in names:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,71 @@
+import json
+import os
+import threading
+
+from loggers.logger import get_logger
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+class StateStore:
+    """Local state of the resources written or trained by previous runs, kept across runs.
+
+    Each key (a resource name or display name) has the content hash of its last successful write
+    or training, and optionally the resource name it got. The journal records the writes of one
+    run so it can be resumed, the state tells the next runs which resources are unchanged. Each
+    record is saved as soon as it is made, so a failed run keeps the records of its writes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._records = None
+
+    @property
+    def records(self) -> dict:
+        if self._records is None:
+            try:
+                with open(self.path, encoding='utf-8') as state_file:
+                    self._records = json.load(state_file)
+            except FileNotFoundError:
+                self._records = {}
+            except ValueError as e:
+                error_logger.warning(f'Ignoring unreadable state {self.path}: {e}')
+                self._records = {}
+        return self._records
+
+    def get(self, key: str) -> dict:
+        """The record of a key, with its hash and resource name, empty if it has none."""
+        with self._lock:
+            return dict(self.records.get(key, {}))
+
+    def content_hash(self, key: str):
+        return self.get(key).get('hash')
+
+    def record(self, key: str, content_hash: str, name: str = None):
+        """Save the content hash, and the resource name if given, of a resource written or trained."""
+        record = {'hash': content_hash} if name is None else {'name': name, 'hash': content_hash}
+        with self._lock:
+            if self.records.get(key) == record:
+                return
+            self.records[key] = record
+            self._save()
+
+    def forget(self, key: str):
+        """Drop the record of a key, the next run writes its resource again."""
+        with self._lock:
+            if self.records.pop(key, None) is not None:
+                debug_logger.debug(f'Forgot the state of {key}')
+                self._save()
+
+    def _save(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as state_file:
+            json.dump(self._records, state_file, indent=2)
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,163 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loggers.logger import get_logger
+from services.journal_service import OperationJournal
+from services.state_service import StateStore
+from services.validation_service import ValidationService
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+# concurrent train_flow operations, below the default quota of the dialogflow CX training requests
+MAX_CONCURRENT_TRAININGS = 4
+# seconds to wait for the training of one flow
+TRAINING_TIMEOUT = 900
+
+
+class TrainingServiceCXError(Exception):
+    """Custom exception for TrainingServiceCX class."""
+    pass
+
+
+class TrainingServiceCX:
+    """Train the NLU models of the flows changed by a deploy, concurrently.
+
+    The content of each flow (its compiled pages and the entity types they use, and for the default
+    start flow the intents, faqs and flows it routes to) is hashed, and only the flows whose hash
+    differs from the one of their last successful training are trained. The train_flow operations
+    are started and waited on by a pool of max_concurrent threads, so the trainings run together
+    within the quota and each one reports its own duration.
+    """
+
+    def __init__(self, df_service, state: StateStore = None, max_concurrent=MAX_CONCURRENT_TRAININGS,
+                 timeout=TRAINING_TIMEOUT):
+        """
+        Args:
+            df_service (DialogflowServiceCX): service with the flow manager of the agent.
+            state (StateStore, optional): content hash of each flow at its last training.
+                Defaults to .cf-to-df/trained_flows.json.
+            max_concurrent (int, optional): flows trained at the same time. Defaults to MAX_CONCURRENT_TRAININGS.
+            timeout (int, optional): seconds to wait for each training. Defaults to TRAINING_TIMEOUT.
+        """
+        self.df_service = df_service
+        self.state = state if state is not None else StateStore('.cf-to-df/trained_flows.json')
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+
+    @staticmethod
+    def flow_hashes(compiled: dict) -> dict:
+        """Content hash of each compiled flow by display name, and of the default start flow under None."""
+        translations = compiled.get('translations') or {}
+        entity_type_hashes = {ValidationService.entity_type_display_name(entity_type['entityType']):
+                              OperationJournal.content_hash(entity_type['entityValue'])
+                              for entity_type in compiled['entity_types'] if isinstance(entity_type.get('entityType'), str)}
+        hashes = {flow['display_name']: TrainingServiceCX.flow_hash(flow, entity_type_hashes, translations)
+                  for flow in compiled['flows']}
+        hashes[None] = TrainingServiceCX.default_flow_hash(compiled['intents'], compiled.get('faqs'),
+                                                           compiled['flows'], translations)
+        return hashes
+
+    @staticmethod
+    def flow_hash(flow: dict, entity_type_hashes: dict, translations: dict = None) -> str:
+        """Hash of a compiled flow, the entity types it uses (display name -> hash of the values) and its translations."""
+        names = [page['entityType'] for page in flow['subpages'] if page.get('entityType')]
+        if isinstance(flow.get('start_page_entity_types'), list):
+            names += [entity_type['entityType'] for entity_type in flow['start_page_entity_types']
+                      if isinstance(entity_type, dict) and 'entityType' in entity_type]
+        names = sorted(set(names))
+        used = {name: entity_type_hashes.get(ValidationService.entity_type_display_name(name)) for name in names}
+        localized = {locale: {'flow': translation.get('flows', {}).get(flow['display_name']),
+                              'entity_types': {name: translation.get('entity_types', {}).get(name) for name in names}}
+                     for locale, translation in (translations or {}).items()}
+        return OperationJournal.content_hash({'flow': flow, 'entity_types': used, 'translations': localized})
+
+    @staticmethod
+    def default_flow_hash(intents: list, faqs: list, flows: list, translations: dict = None) -> str:
+        """Hash of what the default start flow routes to: the intents, the faqs and the intents of the flows."""
+        return OperationJournal.content_hash({
+            'intents': intents,
+            'faqs': faqs,
+            'translations': {locale: {key: translation.get(key) for key in ('intents', 'faqs')}
+                             for locale, translation in (translations or {}).items()},
+            'flows': [(flow['display_name'], flow['intent']) for flow in flows]})
+
+    def train_changed(self, compiled: dict) -> dict:
+        """Train the deployed flows whose content changed since their last training.
+
+        Returns:
+            dict: flow display name -> status (trained, unchanged, missing or failed) and seconds of training.
+        """
+        return self.train_hashes(self.flow_hashes(compiled))
+
+    def train_hashes(self, hashes: dict) -> dict:
+        """Train the flows whose hash differs from the one of their last training.
+
+        Args:
+            hashes (dict): flow display name -> content hash, the default start flow under None.
+
+        Returns:
+            dict: flow display name -> status (trained, unchanged, missing or failed) and seconds of training.
+        """
+        flow_manager = self.df_service.flow_manager
+        remote_flows = flow_manager.get_flows_by_display_name()
+        report = {}
+        pending = {}
+        for display_name, content_hash in hashes.items():
+            flow_name = flow_manager.parent if display_name is None else getattr(remote_flows.get(display_name), 'name', None)
+            display_name = display_name or 'Default Start Flow'
+            if flow_name is None:
+                report[display_name] = {'status': 'missing'}
+            elif self.state.content_hash(flow_name) == content_hash:
+                report[display_name] = {'status': 'unchanged'}
+            else:
+                pending[flow_name] = (display_name, content_hash)
+
+        trainings = self.train(list(pending))
+        for flow_name, (display_name, content_hash) in pending.items():
+            report[display_name] = trainings[flow_name]
+            if trainings[flow_name]['status'] == 'trained':
+                self.state.record(flow_name, content_hash)
+        return report
+
+    @staticmethod
+    def raise_for_failures(report: dict):
+        """Raise when some flows of a report of train_changed or train_hashes could not be trained."""
+        failed = sorted(display_name for display_name, result in report.items() if result['status'] == 'failed')
+        if failed:
+            raise TrainingServiceCXError(f"{len(failed)} flows could not be trained ({', '.join(failed)}), "
+                                         f"the next deploy trains them again")
+
+    def train(self, flow_names: list) -> dict:
+        """Train the given flows, at most max_concurrent at a time, and wait for all of them.
+
+        Returns:
+            dict: flow name -> status (trained or failed), seconds and error.
+        """
+        if not flow_names:
+            return {}
+        info_logger.info(f'Training {len(flow_names)} flows, {self.max_concurrent} at a time')
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_concurrent) as executor:
+            futures = {flow_name: executor.submit(self._train_flow, flow_name) for flow_name in flow_names}
+            results = {flow_name: future.result() for flow_name, future in futures.items()}
+        failed = [flow_name for flow_name, result in results.items() if result['status'] == 'failed']
+        info_logger.info(f'Trained {len(results) - len(failed)} flows in {time.perf_counter() - started:.1f}s, '
+                         f'{len(failed)} failed')
+        return results
+
+    def _train_flow(self, flow_name):
+        started = time.perf_counter()
+        try:
+            operation = self.df_service.flow_manager.train_flow(flow_name)
+            operation.result(timeout=self.timeout)
+        except Exception as e:
+            seconds = round(time.perf_counter() - started, 2)
+            error_logger.error(f'error trying to train flow {flow_name} after {seconds}s: {e}')
+            return {'status': 'failed', 'seconds': seconds, 'error': str(e)}
+        seconds = round(time.perf_counter() - started, 2)
+        info_logger.info(f'Flow {flow_name} trained in {seconds}s')
+        return {'status': 'trained', 'seconds': seconds}
@@ -0,0 +1,232 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud import dialogflowcx_v3beta1 as dialogflowcx
+
+from clients.dialogflow_client import EntityTypeManager
+from loggers.logger import get_logger
+from services.contentful_service import LOCALIZED_PAGE_FIELDS
+from services.faq_service import FaqServiceCX
+from utils.utils_dialogflow import DialogFlowUtils
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+class TranslationServiceCXError(Exception):
+    """Custom exception for TranslationServiceCX class."""
+    pass
+
+
+class TranslationServiceCX:
+    """Write the texts of the other locales on the resources created in the default language.
+
+    Dialogflow CX keeps one structure for each resource (form parameters, routes, entity values) and
+    its texts by language. The resources are created once, in the default language, by
+    DialogflowServiceCX and FaqServiceCX, and each other language is an update with language_code of
+    the resources that exist, built from the same structure with the translated texts. The updates
+    of all the resources and languages are independent, so they run concurrently.
+    """
+
+    def __init__(self, df_service, language_codes: dict = None, max_workers=4):
+        """
+        Args:
+            df_service (DialogflowServiceCX): service with the managers of the agent.
+            language_codes (dict, optional): contentful locale -> dialogflow language code, such as
+                {'en-US': 'en'}. Defaults to the language of the locale.
+            max_workers (int, optional): concurrent updates, like the gRPC channels of the factory. Defaults to 4.
+        """
+        self.df_service = df_service
+        self.language_codes = language_codes or {}
+        self.max_workers = max_workers
+        self.stats = {}
+        self._listed = {}
+
+    def language_code(self, locale: str) -> str:
+        """Dialogflow language code of a contentful locale: en-US -> en, unless it is in language_codes."""
+        return self.language_codes.get(locale, locale.split('-')[0].lower())
+
+    def sync(self, compiled: dict) -> dict:
+        """Update the entity types, intents, pages, route groups and faqs in the language of each translation.
+
+        Args:
+            compiled (dict): compiled data with translations, locale -> ContentfulService.compile_translations.
+
+        Returns:
+            dict: counters of the updates written, unchanged since the journaled run, missing in dialogflow and failed.
+        """
+        self.stats = {'written': 0, 'unchanged': 0, 'missing': 0, 'failed': 0}
+        # the resources are listed once in the default language, for all the languages
+        self._listed = {}
+        tasks = []
+        for locale, translation in (compiled.get('translations') or {}).items():
+            language_code = self.language_code(locale)
+            info_logger.info(f"Translating the resources to {language_code} ({locale})")
+            tasks.extend(self._entity_type_tasks(language_code, translation.get('entity_types', {})))
+            tasks.extend(self._intent_tasks(language_code, translation.get('intents', {})))
+            tasks.extend(self._flow_tasks(language_code, compiled['flows'], translation.get('flows', {})))
+            tasks.extend(self._faq_tasks(language_code, compiled.get('faqs') or [], translation.get('faqs', {})))
+        self._run(tasks)
+        info_logger.info('Translations: ' + ', '.join(f'{key}={value}' for key, value in self.stats.items()))
+        if self.stats['failed']:
+            raise TranslationServiceCXError(f"{self.stats['failed']} translations could not be written")
+        return self.stats
+
+    def _list(self, key, operation):
+        if key not in self._listed:
+            self._listed[key] = operation()
+        return self._listed[key]
+
+    def _entity_type_tasks(self, language_code, entity_types):
+        manager = self.df_service.entity_type_manager
+        remote_entity_types = self._list('entity_types', manager.get_entity_types_by_display_name)
+        tasks = []
+        for name, entities in entity_types.items():
+            display_name = DialogFlowUtils.clean_display_name(name.replace(' ', '-'))
+            synonyms = {entity['value']: entity['synonyms'] for entity in entities}
+            # an entity type split in parts has its values in the parts, the entity type lists them
+            remote = [entity_type for remote_name, entity_type in remote_entity_types.items()
+                      if (remote_name == display_name or EntityTypeManager.is_part(remote_name, display_name))
+                      and entity_type.kind == dialogflowcx.EntityType.Kind.KIND_MAP]
+            if not remote:
+                self.stats['missing'] += 1
+                continue
+            for entity_type in remote:
+                localized = [{'value': entity.value, 'synonyms': synonyms.get(entity.value, list(entity.synonyms))}
+                             for entity in entity_type.entities]
+                tasks.append(('entity_type_translation', f'{language_code}|{entity_type.name}', localized,
+                              lambda entity_type=entity_type, localized=localized: manager.update_entity_type(
+                                  dialogflowcx.EntityType(name=entity_type.name),
+                                  [dialogflowcx.EntityType.Entity(value=entity['value'], synonyms=entity['synonyms'])
+                                   for entity in localized],
+                                  language_code=language_code)))
+        return tasks
+
+    def _intent_tasks(self, language_code, intents):
+        manager = self.df_service.intent_manager
+        remote_intents = self._list('intents', manager.get_intents_by_display_name)
+        tasks = []
+        for display_name, training_phrase in intents.items():
+            intent = remote_intents.get(display_name)
+            if intent is None or not isinstance(training_phrase, str) or not training_phrase.strip():
+                self.stats['missing'] += 1
+                continue
+            training_phrase = training_phrase.strip()
+            tasks.append(('intent_translation', f'{language_code}|{intent.name}', training_phrase,
+                          lambda intent=intent, training_phrase=training_phrase: manager.update_intent_language(
+                              intent.name, training_phrase, language_code)))
+        return tasks
+
+    def _flow_tasks(self, language_code, flows, flow_translations):
+        remote_flows = self._list('flows', self.df_service.flow_manager.get_flows_by_display_name)
+        tasks = []
+        for flow in flows:
+            translation = flow_translations.get(flow['display_name'])
+            remote_flow = remote_flows.get(flow['display_name'])
+            if translation is None:
+                continue
+            if remote_flow is None:
+                self.stats['missing'] += 1
+                continue
+            pages = self._list(f'pages|{remote_flow.name}',
+                               lambda: self.df_service.pages_manager.get_pages_by_display_name(remote_flow.name))
+            page_translations = translation.get('pages', {})
+            # the end pages are answered by the fulfillment of the route to them, in the parent page or a group
+            texts = {page['entry_fulfillment']: page_translations[page['display_name']]['entry_fulfillment']
+                     for page in flow['subpages']
+                     if page['is_end_flow'] and 'entry_fulfillment' in page_translations.get(page['display_name'], {})}
+
+            # a sub flow or a shared flow has no start page of its own, and its pages are not in the flows that route to it
+            page_dicts = ([] if flow.get('entry_page') else [(flow, translation, True)]) + \
+                [(page, page_translations[page['display_name']], False) for page in flow['subpages']
+                 if page['parent'] is not None and not page.get('target_flow') and page['display_name'] in page_translations]
+            for page_dict, page_translation, is_start_page in page_dicts:
+                remote_page = pages.get(page_dict['display_name'])
+                if remote_page is None:
+                    self.stats['missing'] += 1
+                    continue
+                localized = {**page_dict, **{key: value for key, value in page_translation.items()
+                                             if key in LOCALIZED_PAGE_FIELDS}}
+                payload = {'page': {key: value for key, value in localized.items() if key != 'subpages'},
+                           'texts': texts}
+                tasks.append(('page_translation', f'{language_code}|{remote_page.name}', payload,
+                              lambda remote_page=remote_page, localized=localized, is_start_page=is_start_page, texts=texts:
+                                  self._update_page(remote_page, localized, is_start_page, texts, language_code)))
+
+            if texts:
+                route_groups = self._list(f'route_groups|{remote_flow.name}',
+                                          lambda: self.df_service.transition_route_manager.get_route_groups_by_display_name(remote_flow.name))
+                for route_group in route_groups.values():
+                    tasks.append(('route_group_translation', f'{language_code}|{route_group.name}', texts,
+                                  lambda route_group=route_group, texts=texts:
+                                      self._update_route_group(route_group, texts, language_code)))
+        return tasks
+
+    def _faq_tasks(self, language_code, faqs, faq_translations):
+        if not faq_translations:
+            return []
+        route_manager = self.df_service.transition_route_manager
+        flow_name = self.df_service.flow_manager.parent
+        remote_intents = self._list('intents', self.df_service.intent_manager.get_intents_by_display_name)
+        route_groups = self._list(f'route_groups|{flow_name}',
+                                  lambda: route_manager.get_route_groups_by_display_name(flow_name))
+        # the same groups as FaqServiceCX.sync, so the routes of each group are the same in all the languages
+        faqs = [faq for faq in {faq['intent']: faq for faq in faqs}.values() if faq['intent'] in remote_intents]
+        tasks = []
+        for display_name, group_faqs in FaqServiceCX.plan_groups(faqs).items():
+            route_group = route_groups.get(display_name)
+            if route_group is None:
+                self.stats['missing'] += 1
+                continue
+            localized = [(remote_intents[faq['intent']].name, {**faq, **faq_translations.get(faq['intent'], {})})
+                         for faq in group_faqs]
+            tasks.append(('route_group_translation', f'{language_code}|{route_group.name}', localized,
+                          lambda route_group=route_group, localized=localized: route_manager.update_route_group_language(
+                              dialogflowcx.TransitionRouteGroup(
+                                  name=route_group.name,
+                                  transition_routes=[DialogFlowUtils.build_faq_route(intent_name, faq)
+                                                     for intent_name, faq in localized]),
+                              language_code)))
+        return tasks
+
+    def _update_page(self, remote_page, page_dict, is_start_page, texts, language_code):
+        """Rebuild the texts of a page as DialogflowServiceCX.create_page does, keeping its routes."""
+        page = dialogflowcx.Page(name=remote_page.name, display_name=remote_page.display_name)
+        page = DialogFlowUtils.page_validations(page=page, page_dict=page_dict, is_start_page=is_start_page,
+                                                entity_type_manager=self.df_service.entity_type_manager)
+        page.transition_routes = DialogFlowUtils.localize_transition_routes(remote_page.transition_routes, texts)
+        return self.df_service.pages_manager.update_page_language(page, ["form", "event_handlers", "transition_routes"],
+                                                                  language_code)
+
+    def _update_route_group(self, route_group, texts, language_code):
+        localized = dialogflowcx.TransitionRouteGroup(
+            name=route_group.name,
+            transition_routes=DialogFlowUtils.localize_transition_routes(route_group.transition_routes, texts))
+        return self.df_service.transition_route_manager.update_route_group_language(localized, language_code)
+
+    def _run(self, tasks):
+        """Run the (kind, key, payload, operation) tasks not journaled yet, concurrently, and journal them."""
+        journal = self.df_service.journal
+        pending = []
+        for kind, key, payload, operation in tasks:
+            if journal is not None and journal.lookup(kind, key, payload) is not None:
+                self.stats['unchanged'] += 1
+            else:
+                pending.append((kind, key, payload, operation))
+        if not pending:
+            return
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [(kind, key, payload, executor.submit(operation)) for kind, key, payload, operation in pending]
+            # the journal is written from this thread only, in the order of the tasks
+            for kind, key, payload, future in futures:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error_logger.error(f'error trying to write {kind} {key}: {e}')
+                    self.stats['failed'] += 1
+                    continue
+                self.stats['written'] += 1
+                resource_name = getattr(result, 'name', '')
+                if journal is not None and resource_name:
+                    journal.record(kind, key, payload, resource_name)
@@ -0,0 +1,328 @@
+import json
+from collections import Counter
+
+from loggers.logger import get_logger
+from utils.entity_utils import EntityUtils
+from utils.route_utils import RouteUtils
+from utils.text_utils import TextUtils
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+# Dialogflow CX quotas and limits checked before a deploy, they can be changed with ValidationService(limits=...)
+CX_LIMITS = {
+    'flows_per_agent': 50,
+    'pages_per_flow': 250,
+    'intents_per_agent': 2000,
+    'entity_types_per_agent': 250,
+    'entities_per_entity_type': 30000,
+    'routes_per_page': 500,
+    'display_name_length': 64,
+    # bytes of the fulfillments and payloads written with one page, requests above it are rejected
+    'page_bytes': 4 * 1024 * 1024,
+}
+
+
+class ValidationServiceError(Exception):
+    """Custom exception for ValidationService class."""
+    pass
+
+
+class ValidationReport:
+    """Issues found by ValidationService, each one a dict with severity, check, flow, page and message.
+
+    Errors make the deploy fail or silently lose data (a parameter or a route is not written),
+    warnings are written to dialogflow but probably not as expected.
+    """
+
+    def __init__(self):
+        self.issues = []
+
+    def add(self, severity, check, message, flow=None, page=None):
+        self.issues.append({'severity': severity, 'check': check, 'flow': flow, 'page': page, 'message': message})
+
+    @property
+    def errors(self):
+        return [issue for issue in self.issues if issue['severity'] == 'error']
+
+    @property
+    def warnings(self):
+        return [issue for issue in self.issues if issue['severity'] == 'warning']
+
+    @property
+    def is_valid(self):
+        return not self.errors
+
+    def to_dict(self):
+        return {'valid': self.is_valid, 'errors': len(self.errors), 'warnings': len(self.warnings),
+                'issues': self.issues}
+
+    def format(self) -> str:
+        lines = []
+        for issue in self.issues:
+            location = ' / '.join(part for part in (issue['flow'], issue['page']) if part)
+            location = f' [{location}]' if location else ''
+            lines.append(f"{issue['severity']}: {issue['check']}{location}: {issue['message']}")
+        lines.append(f'{len(self.errors)} errors, {len(self.warnings)} warnings')
+        return '\n'.join(lines)
+
+
+class ValidationService:
+    """Static checks of the compiled entity types, intents and flows, without calling dialogflow.
+
+    It reproduces the names that DialogflowServiceCX writes, so a reference that would not be found
+    during the deploy, or two resources that would be written with the same name, are reported before
+    any write:
+
+    - references: entity types used as page parameters, intents of the flows and parent pages of the routes.
+    - name collisions: entity types, flows, pages of a flow and parameters of a page.
+    - routes: conditions without parameter, duplicated conditions, unreachable pages and cycles.
+    - limits: the CX quotas and sizes in CX_LIMITS.
+
+    Every check is a single pass over the compiled data, so it runs in milliseconds even for big agents.
+    """
+
+    def __init__(self, entity_types: list[dict], intents: list[dict], flows: list[dict], limits: dict = None,
+                 quarantined: list[dict] = None):
+        """
+        Args:
+            entity_types (list[dict]): ContentfulService.entity_types
+            intents (list[dict]): ContentfulService.intents
+            flows (list[dict]): ContentfulService.flows_with_subpages
+            limits (dict, optional): limits that replace the ones in CX_LIMITS.
+            quarantined (list[dict], optional): ContentfulService.quarantined_flows, reported as warnings.
+        """
+        self.entity_types = entity_types
+        self.intents = intents
+        self.flows = flows
+        self.limits = {**CX_LIMITS, **(limits or {})}
+        self.quarantined = quarantined or []
+
+    @classmethod
+    def from_compiled(cls, compiled: dict, limits: dict = None):
+        """Build the validator from the output of the compile command."""
+        return cls(compiled['entity_types'], compiled['intents'], compiled['flows'], limits=limits,
+                   quarantined=compiled.get('quarantined'))
+
+    def validate(self) -> ValidationReport:
+        report = ValidationReport()
+        for flow in self.quarantined:
+            # the other flows are deployed, the quarantined ones are left as they are in dialogflow
+            report.add('warning', 'flow_schema', f"not compiled: {'; '.join(flow['errors'])}",
+                       flow=flow['key'] or flow['id'])
+        entity_type_names = self._check_entity_types(report)
+        intent_names = self._check_intents(report)
+        self._check_flows(report, entity_type_names, intent_names)
+        info_logger.info(f'Validation: {len(report.errors)} errors, {len(report.warnings)} warnings')
+        return report
+
+    @staticmethod
+    def entity_type_display_name(name: str) -> str:
+        """Display name of an entity type in dialogflow, as written by EntityTypeManager.create_or_update_entity_type
+        and searched by DialogFlowUtils.add_entity_type_as_parameter_to_page."""
+        return TextUtils.clean_display_name(name.replace(' ', '-'))
+
+    def _check_entity_types(self, report):
+        names = {}
+        part_count = 0
+        for entity_type in self.entity_types:
+            name = entity_type.get('entityType')
+            if not isinstance(name, str) or not name.strip():
+                report.add('error', 'entity_type_name', f'entity type without name: {entity_type}')
+                continue
+            display_name = self.entity_type_display_name(name)
+            if display_name in names and names[display_name] != name:
+                report.add('error', 'name_collision',
+                           f"entity types '{names[display_name]}' and '{name}' are both written as '{display_name}'")
+            names.setdefault(display_name, name)
+            self._check_display_name(report, display_name)
+
+            values = entity_type.get('entityValue')
+            values = [value['entityValue'] for value in values] if isinstance(values, list) else []
+            if not values:
+                report.add('warning', 'empty_entity_type', f"entity type '{name}' has no values")
+            duplicated = sorted(str(value) for value, count in Counter(values).items() if count > 1)
+            if duplicated:
+                report.add('warning', 'duplicate_entity_value',
+                           f"entity type '{name}' repeats the values {', '.join(duplicated)}, they are merged")
+            if len(values) > self.limits['entities_per_entity_type']:
+                # written as a list of sub types, each one is an entity type of the agent
+                parts = len(EntityUtils.split_entities(EntityUtils.normalize_entities(entity_type['entityValue']),
+                                                       max_entities=self.limits['entities_per_entity_type']))
+                part_count += parts
+                report.add('warning', 'split_entity_type', f"entity type '{name}' has {len(values)} values, "
+                                                            f"the limit is {self.limits['entities_per_entity_type']}, "
+                                                            f"it is split in {parts} sub types")
+
+        if len(names) + part_count > self.limits['entity_types_per_agent']:
+            report.add('error', 'limit', f'{len(names) + part_count} entity types, '
+                                         f'the limit is {self.limits["entity_types_per_agent"]}')
+        return set(names)
+
+    def _check_intents(self, report):
+        phrases = {}
+        for intent in self.intents:
+            name = intent['intent']
+            phrase = (intent.get('default_training_phrase') or '').strip()
+            if not phrase:
+                report.add('error', 'intent_training_phrase', f"intent '{name}' has no training phrase")
+            if name in phrases and phrases[name] != phrase:
+                # create_intent_if_not_exists updates the intent, so only the last training phrase is kept
+                report.add('warning', 'name_collision',
+                           f"intent '{name}' is defined with different training phrases, only the last one is kept")
+            phrases[name] = phrase
+            self._check_display_name(report, name)
+
+        if len(phrases) > self.limits['intents_per_agent']:
+            report.add('error', 'limit', f'{len(phrases)} intents, the limit is {self.limits["intents_per_agent"]}')
+        return set(phrases)
+
+    def _check_flows(self, report, entity_type_names, intent_names):
+        flows_by_name = {}
+        flows_by_intent = {}
+        for flow in self.flows:
+            name = flow['display_name']
+            if name in flows_by_name:
+                # create_flow reuses the existing flow, so the pages of both flows are mixed
+                report.add('error', 'name_collision', 'two flows are written with the same name', flow=name)
+            flows_by_name[name] = flow
+            self._check_display_name(report, name, flow=name)
+
+            intent = flow.get('intent')
+            if flow.get('entry_page'):
+                # a sub flow or a shared flow is entered from other flows, not by an intent route of the default start flow
+                pass
+            elif intent not in intent_names:
+                report.add('error', 'missing_intent', f"intent '{intent}' is not in the compiled intents", flow=name)
+            elif intent in flows_by_intent:
+                report.add('error', 'duplicate_intent_route',
+                           f"intent '{intent}' already routes to flow '{flows_by_intent[intent]}' from the default start flow",
+                           flow=name)
+            else:
+                flows_by_intent[intent] = name
+
+            self._check_flow_pages(report, flow, entity_type_names)
+
+        if len(flows_by_name) > self.limits['flows_per_agent']:
+            report.add('error', 'limit', f'{len(flows_by_name)} flows, the limit is {self.limits["flows_per_agent"]}')
+
+    def _check_flow_pages(self, report, flow, entity_type_names):
+        flow_name = flow['display_name']
+        start_entity_types = flow.get('start_page_entity_types')
+        start_entity_types = [entity_type['entityType'] for entity_type in start_entity_types
+                              if isinstance(entity_type, dict) and 'entityType' in entity_type] \
+            if isinstance(start_entity_types, list) else []
+        pages = {}
+        if not flow.get('entry_page'):
+            self._check_parameters(report, flow_name, flow_name, start_entity_types, entity_type_names)
+            self._check_page_size(report, flow_name, flow_name, flow)
+            pages[flow_name] = flow
+        # parent page -> condition -> child page, the routes written by create_subpages_in_flow
+        routes = {}
+        for page in flow['subpages']:
+            page_name = page['display_name']
+            if page['parent'] is None or page.get('target_flow'):
+                # the start page of the flow, it is written from the flow dict, or a page of a sub flow
+                continue
+            if page_name in pages and pages[page_name] is not page and pages[page_name] != page:
+                report.add('error', 'name_collision', 'two pages of the flow are written with the same name',
+                           flow=flow_name, page=page_name)
+                continue
+            if page_name in pages:
+                # the same page listed twice by the compiler, it is written once
+                continue
+            pages[page_name] = page
+            self._check_display_name(report, page_name, flow=flow_name, page=page_name)
+            self._check_page_size(report, flow_name, page_name, page)
+            self._check_parameters(report, flow_name, page_name, [page['entityType']] if page['entityType'] else [],
+                                   entity_type_names)
+
+            if not page['entityValues']:
+                report.add('warning', 'unreachable_page', 'no route leads to the page, it has no entity values',
+                           flow=flow_name, page=page_name)
+            elif not page['route_params_entity_types']:
+                report.add('error', 'route_condition', 'the routes to the page have no session parameter in the condition',
+                           flow=flow_name, page=page_name)
+
+            page_routes = routes.setdefault(page['parent'], {})
+            for value in page['entityValues']:
+                condition = f'{page["route_params_entity_types"]} = "{value}"'
+                if condition in page_routes and page_routes[condition] != page_name:
+                    report.add('warning', 'duplicate_route',
+                               f"condition {condition} of page '{page['parent']}' already routes to "
+                               f"'{page_routes[condition]}'", flow=flow_name, page=page_name)
+                    continue
+                page_routes[condition] = page_name
+
+        # the routes of a page are written merged by target, see RouteUtils.plan_page_routes
+        planned_routes = RouteUtils.plan_page_routes(flow['subpages'])
+        for parent_name, page_routes in routes.items():
+            if parent_name not in pages and parent_name != flow.get('entry_page'):
+                for page_name in sorted(set(page_routes.values())):
+                    report.add('error', 'missing_parent_page', f"parent page '{parent_name}' does not exist",
+                               flow=flow_name, page=page_name)
+            route_count = len(planned_routes.get(parent_name, []))
+            if route_count > self.limits['routes_per_page']:
+                report.add('error', 'limit', f"{route_count} routes, the limit is {self.limits['routes_per_page']}",
+                           flow=flow_name, page=parent_name)
+
+        if len(pages) > self.limits['pages_per_flow']:
+            report.add('error', 'limit', f'{len(pages)} pages, the limit is {self.limits["pages_per_flow"]}', flow=flow_name)
+
+        for cycle in self._find_cycles(routes):
+            report.add('error', 'route_cycle', ' -> '.join(cycle), flow=flow_name, page=cycle[0])
+
+    def _check_parameters(self, report, flow_name, page_name, entity_types, entity_type_names):
+        parameters = set()
+        for entity_type in entity_types:
+            display_name = self.entity_type_display_name(entity_type)
+            if display_name not in entity_type_names:
+                # add_parameter_to_page skips the parameter when the entity type is not found
+                report.add('error', 'missing_entity_type',
+                           f"entity type '{display_name}' is not in the compiled entity types, the parameter is skipped",
+                           flow=flow_name, page=page_name)
+            if display_name in parameters:
+                report.add('error', 'name_collision', f"parameter '{display_name}' is added twice to the page",
+                           flow=flow_name, page=page_name)
+            parameters.add(display_name)
+
+    def _check_page_size(self, report, flow_name, page_name, page):
+        content = {key: page.get(key) for key in ('entry_fulfillment', 'fallback_message', 'payload_responses', 'buttons')}
+        size = len(json.dumps(content, ensure_ascii=False, default=str).encode('utf-8'))
+        if size > self.limits['page_bytes']:
+            report.add('error', 'limit', f"{size} bytes of fulfillments, the limit is {self.limits['page_bytes']}",
+                       flow=flow_name, page=page_name)
+
+    def _check_display_name(self, report, name, flow=None, page=None):
+        if len(name) > self.limits['display_name_length']:
+            report.add('warning', 'limit', f"display name '{name}' has {len(name)} characters, "
+                                           f"the limit is {self.limits['display_name_length']}", flow=flow, page=page)
+
+    @staticmethod
+    def _find_cycles(routes):
+        """Cycles of the route graph (parent page -> condition -> child page), each one as a list of page names."""
+        graph = {parent: set(children.values()) for parent, children in routes.items()}
+        state = {}
+        cycles = []
+        for root in graph:
+            if root in state:
+                continue
+            # iterative depth first search, the stack keeps the path from the root
+            state[root] = 'visiting'
+            path = [root]
+            stack = [iter(sorted(graph[root]))]
+            while stack:
+                child = next(stack[-1], None)
+                if child is None:
+                    state[path.pop()] = 'done'
+                    stack.pop()
+                elif state.get(child) == 'visiting':
+                    cycles.append(path[path.index(child):] + [child])
+                elif child not in state:
+                    state[child] = 'visiting'
+                    path.append(child)
+                    stack.append(iter(sorted(graph.get(child, ()))))
+        return cycles
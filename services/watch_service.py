@@ -0,0 +1,186 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from loggers.logger import get_logger
+from utils.partition_utils import PartitionUtils
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+# contentful topics look like ContentManagement.Entry.publish
+ENTRY_ACTIONS = ('publish', 'unpublish', 'delete')
+
+
+class WatchServiceError(Exception):
+    """Custom exception for WatchService class."""
+    pass
+
+
+class ChangeBuffer:
+    """Debounce and coalesce the entry changes received by webhooks.
+
+    Changes are kept by entry id, so a burst of edits of the same entry becomes one change with the
+    last action received. The callback is called with all pending changes once no new change
+    arrived during debounce_seconds. Only one callback runs at a time, changes received meanwhile
+    are applied in the next one.
+    """
+
+    def __init__(self, callback, debounce_seconds=2.0):
+        self.callback = callback
+        self.debounce_seconds = debounce_seconds
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._apply_lock = threading.Lock()
+        self._timer = None
+
+    def add(self, entry_id: str, action: str):
+        with self._lock:
+            self._pending[entry_id] = action
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.debounce_seconds, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._apply_lock:
+            with self._lock:
+                changes, self._pending = self._pending, {}
+                self._timer = None
+            if not changes:
+                return
+            try:
+                self.callback(changes)
+            except Exception as e:
+                error_logger.error(f'error trying to apply {len(changes)} entry changes: {e}')
+
+
+class WatchService:
+    """Long running service that applies contentful webhooks to the dialogflow agent incrementally.
+
+    The contentful and dialogflow services are created once, so the gRPC channels and the entry
+    store stay warm between events. Each batch of changes only redeploys the entity types, intents
+    and flows that use the changed entries.
+    """
+
+    def __init__(self, cf_service, df_service, host='127.0.0.1', port=8080, debounce_seconds=2.0, secret=None,
+                 dependencies_path=None):
+        self.cf_service = cf_service
+        self.df_service = df_service
+        self.host = host
+        self.port = port
+        self.secret = secret
+        # the dependency index is saved there after each change, when it is set
+        self.dependencies_path = dependencies_path
+        self.buffer = ChangeBuffer(self.apply_changes, debounce_seconds=debounce_seconds)
+        self._server = None
+        # set once the endpoint accepts webhooks
+        self.ready = threading.Event()
+
+    def handle_webhook(self, topic: str, body: dict):
+        """Queue the change of a contentful webhook. Returns False if the webhook is ignored."""
+        parts = (topic or '').split('.')
+        if len(parts) != 3 or parts[1] != 'Entry' or parts[2] not in ENTRY_ACTIONS:
+            debug_logger.debug(f'Ignoring webhook with topic {topic}')
+            return False
+        entry_id = body.get('sys', {}).get('id')
+        if not entry_id:
+            raise WatchServiceError(f'Webhook {topic} without sys.id')
+        self.buffer.add(entry_id, parts[2])
+        return True
+
+    def apply_changes(self, changes: dict):
+        """Redeploy the dialogflow resources affected by the changed entries.
+
+        Args:
+            changes (dict): entry id -> publish, unpublish or delete
+        """
+        published_ids = [entry_id for entry_id, action in changes.items() if action == 'publish']
+        removed_ids = [entry_id for entry_id, action in changes.items() if action != 'publish']
+        info_logger.info(f'Applying {len(published_ids)} published and {len(removed_ids)} removed entries')
+
+        removed_flows = [flow for flow in self.cf_service.flows if flow['id'] in removed_ids]
+        # the links of the removed entries are only in the index before the changes, the new ones after them
+        resources = self.cf_service.dependency_index.affected(changes)
+        affected_ids = self.cf_service.apply_entry_changes(published_ids, removed_ids)
+        for kind, names in self.cf_service.dependency_index.affected(changes).items():
+            resources[kind] |= names
+        if self.dependencies_path:
+            self.cf_service.dependency_index.save(self.dependencies_path)
+
+        entity_types = [entity_type for entity_type in self.cf_service.entity_types if entity_type['id'] in affected_ids]
+        flows = [flow for flow in self.cf_service.flows if flow['id'] in affected_ids]
+        # the intent of a flow only comes from its own entry, not from the entries it links to
+        intents = [{'intent': flow['intent'], 'default_training_phrase': flow['question']}
+                   for flow in flows if flow['intent'] in resources['intents'] and not flow['intent'].startswith('faq')]
+        faqs = self.cf_service.compile_faqs(flows)
+
+        if entity_types:
+            self.df_service.create_entity_types(entity_types=entity_types)
+        if intents:
+            self.df_service.create_intents(intents=intents)
+        if flows:
+            self.df_service.create_flows(flows_list=PartitionUtils.partition_flows(self.cf_service.compile_flows(flows)))
+        if faqs or any(str(flow.get('intent')).startswith('faq') for flow in removed_flows):
+            from services.faq_service import FaqServiceCX
+
+            # unchanged faq groups are skipped, so the whole catalog is synced
+            FaqServiceCX(self.df_service).sync(self.cf_service.faqs)
+        for flow in removed_flows:
+            self.df_service.delete_flow(flow['key'])
+
+        info_logger.info(f'Redeployed {len(entity_types)} entity types, {len(intents)} intents, '
+                         f"{len(flows)} flows ({len(resources['pages'])} pages changed), {len(faqs)} faqs "
+                         f'and deleted {len(removed_flows)} flows')
+        return {'entity_types': len(entity_types), 'intents': len(intents), 'flows': len(flows),
+                'pages': len(resources['pages']), 'faqs': len(faqs), 'deleted_flows': len(removed_flows)}
+
+    def serve_forever(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler_class())
+        info_logger.info(f'Listening contentful webhooks on http://{self.host}:{self.port}')
+        self.ready.set()
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+        self.buffer.flush()
+
+    def _handler_class(self):
+        watch_service = self
+
+        class ContentfulWebhookHandler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                if watch_service.secret and self.headers.get('X-Webhook-Secret') != watch_service.secret:
+                    self._reply(401, {'error': 'invalid secret'})
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                    queued = watch_service.handle_webhook(self.headers.get('X-Contentful-Topic'), body)
+                except (ValueError, WatchServiceError) as e:
+                    error_logger.error(f'Invalid webhook: {e}')
+                    self._reply(400, {'error': str(e)})
+                    return
+                self._reply(202 if queued else 200, {'queued': queued})
+
+            def _reply(self, status, body):
+                response = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format, *args):
+                debug_logger.debug(format % args)
+
+        return ContentfulWebhookHandler
@@ -0,0 +1,95 @@
+import json
+import os
+import runpy
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI = os.path.join(ROOT, 'cf-to-df.py')
+HEAVY_MODULES = ['contentful', 'google.cloud.dialogflowcx_v3beta1', 'pandas', 'grpc']
+# seconds to import the cli and the modules used by compile and plan
+IMPORT_TIME_BUDGET = 0.5
+
+
+def run_python(code, cwd):
+    result = subprocess.run([sys.executable, '-c', code], cwd=cwd, capture_output=True, text=True,
+                            env={**os.environ, 'PYTHONPATH': ROOT})
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout)
+
+
+def test_cli_import_time_budget_without_heavy_modules(tmp_path):
+    code = f'''
+import json, runpy, sys, time
+start = time.perf_counter()
+cli = runpy.run_path({CLI!r})
+cli['build_parser']().parse_args(['plan'])
+import services.contentful_service, clients.entry_store_client
+elapsed = time.perf_counter() - start
+print(json.dumps({{'elapsed': elapsed, 'loaded': [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+'''
+    result = run_python(code, cwd=tmp_path)
+    assert result['loaded'] == []
+    assert result['elapsed'] < IMPORT_TIME_BUDGET
+
+
+def test_top_level_options_are_kept_by_the_command():
+    parser = runpy.run_path(CLI)['build_parser']()
+
+    for argv in (['--resume', '--skip-training', '--stream', 'run'], ['run', '--resume', '--skip-training', '--stream']):
+        args = parser.parse_args(argv)
+        assert (args.resume, args.skip_training, args.stream) == (True, True, True)
+    args = parser.parse_args(['--skip-validation', '--profile', '--trace-memory', '--journal', 'other.jsonl', 'deploy'])
+    assert (args.skip_validation, args.profile, args.trace_memory, args.journal) == (True, True, True, 'other.jsonl')
+
+    # the defaults are the same before and after the command
+    args = parser.parse_args(['deploy'])
+    assert (args.resume, args.skip_validation, args.journal, args.compiled) == (False, False, '.cf-to-df/journal.jsonl',
+                                                                                '.cf-to-df/compiled.json')
+
+
+def test_selection_before_or_after_run():
+    cli = runpy.run_path(CLI)
+    parser = cli['build_parser']()
+
+    for argv in (['--flow', 'Mi flujo', '--entity-type', 'tipo', 'run'], ['run', '--flow', 'Mi flujo', '--entity-type', 'tipo']):
+        assert cli['selection_from_args'](parser.parse_args(argv)) == {'flows': ['Mi flujo'], 'entity_types': ['tipo']}
+    assert cli['selection_from_args'](parser.parse_args(['run'])) is None
+
+
+def test_import_does_not_create_log_files(tmp_path):
+    run_python('import json, services.contentful_service, services.journal_service; print("{}")', cwd=tmp_path)
+    assert not os.path.exists(tmp_path / 'logs')
+
+
+def test_compile_and_plan_from_entry_store(tmp_path):
+    def entry(entry_id, content_type, fields):
+        return {'sys': {'id': entry_id, 'locale': 'es', 'contentType': {'sys': {'id': content_type}}}, 'fields': fields}
+
+    entity_type = entry('et', 'entityType', {'entityType': 'tipo', 'entityValue': [{'entityValue': 'A'}]})
+    flow = entry('f1', 'flow', {'key': 'Mi flujo', 'intent': 'flow.x.info', 'question': 'hola?',
+                                'flowEntityTypes': [{'sys': {'id': 'et'}}],
+                                'startNode': {'text': 'Que quieres?', 'fallbacks': [{'text': 'no entendi'}],
+                                              'entityType': {'sys': {'id': 'et'}},
+                                              'chips': [{'text': 'A', 'location': {'text': 'fin A'},
+                                                         'entityValue': {'entityValue': 'A'}}]}})
+    with open(tmp_path / 'entries.json', 'w') as store_file:
+        json.dump({'content_types': [], 'entries': [entity_type, flow]}, store_file)
+
+    subprocess.run([sys.executable, CLI, 'compile', '--entries', 'entries.json', '--output', 'compiled.json'],
+                   cwd=tmp_path, check=True, capture_output=True)
+    with open(tmp_path / 'compiled.json') as compiled_file:
+        compiled = json.load(compiled_file)
+    assert [flow['display_name'] for flow in compiled['flows']] == ['Mi flujo']
+    assert compiled['intents'] == [{'intent': 'flow.x.info', 'default_training_phrase': 'hola?'}]
+
+    plan = subprocess.run([sys.executable, CLI, 'plan', '--compiled', 'compiled.json'],
+                          cwd=tmp_path, check=True, capture_output=True, text=True)
+    assert 'flows:        1' in plan.stdout
+
+    validate = subprocess.run([sys.executable, CLI, 'validate', '--compiled', 'compiled.json', '--json'],
+                              cwd=tmp_path, capture_output=True, text=True)
+    report = json.loads(validate.stdout)
+    assert validate.returncode == (0 if report['valid'] else 1)
+    assert report['errors'] == len([issue for issue in report['issues'] if issue['severity'] == 'error'])
@@ -0,0 +1,31 @@
+from clients.compact_entry import CompactEntry
+
+
+RAW_ENTRY = {'metadata': {'tags': []},
+             'sys': {'id': 'f1', 'type': 'Entry', 'revision': 3, 'locale': 'es',
+                     'createdAt': '2023-08-01T00:00:00.000Z',
+                     'contentType': {'sys': {'type': 'Link', 'linkType': 'ContentType', 'id': 'flow'}}},
+             'fields': {'key': 'Mi flujo'}}
+
+
+def test_compact_entry_keeps_only_projected_fields():
+    entry = CompactEntry.from_raw(RAW_ENTRY)
+
+    assert (entry.id, entry.type, entry.content_type_id, entry.locale, entry.revision) == ('f1', 'Entry', 'flow', 'es', 3)
+    assert entry.fields == {'key': 'Mi flujo'}
+    assert not hasattr(entry, '__dict__')
+
+
+def test_compact_entry_round_trip_through_the_entry_store_format():
+    entry = CompactEntry.from_raw(CompactEntry.from_raw(RAW_ENTRY).to_raw())
+
+    assert (entry.id, entry.content_type_id, entry.revision, entry.fields) == ('f1', 'flow', 3, {'key': 'Mi flujo'})
+
+
+def test_localize_an_entry_fetched_with_all_locales():
+    raw = {**RAW_ENTRY, 'sys': {**RAW_ENTRY['sys'], 'locale': None},
+           'fields': {'key': {'es': 'Mi flujo'}, 'question': {'es': 'hola?', 'en': 'hello?'}}}
+    entry = CompactEntry.from_raw(raw).localize('en', fallback_locale='es')
+
+    assert entry.locale == 'en'
+    assert entry.fields == {'key': 'Mi flujo', 'question': 'hello?'}
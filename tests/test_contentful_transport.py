@@ -0,0 +1,85 @@
+import gzip
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from clients.contentful_client import ContentfulClient
+from clients.contentful_transport import ContentfulTransport
+
+
+ENTRIES = [{'sys': {'id': f'id{i}', 'type': 'Entry', 'locale': 'es', 'revision': 1,
+                    'contentType': {'sys': {'id': 'flow'}}},
+            'fields': {'key': f'flujo {i}', 'question': 'hola ' * 50}} for i in range(3)]
+
+
+class StubContentfulHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        query = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        skip, limit = int(query['skip']), int(query['limit'])
+        body = json.dumps({'total': len(ENTRIES), 'skip': skip, 'limit': limit,
+                           'items': ENTRIES[skip:skip + limit]}).encode('utf-8')
+        etag = '"' + hashlib.md5(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_response(200)
+            self.send_header('Content-Encoding', 'gzip')
+        else:
+            self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubContentfulHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(stub_server, transport):
+    client = ContentfulClient('space', 'token', api_url=stub_server, https=False, transport=transport)
+    return [entry.id for entry in client.compact_entries(limit=2)]
+
+
+def test_pages_reuse_one_compressed_connection(stub_server, tmp_path):
+    transport = ContentfulTransport(cache_directory=str(tmp_path), http2=False)
+
+    assert fetch(stub_server, transport) == ['id0', 'id1', 'id2']
+
+    stats = transport.stats()
+    assert stats['requests'] == 2
+    assert stats['connections'] == 1
+    assert stats['reused_connections'] == 1
+    assert stats['bytes_transferred'] < stats['bytes_decoded']
+
+
+def test_unchanged_pages_are_revalidated_with_etag(stub_server, tmp_path):
+    fetch(stub_server, ContentfulTransport(cache_directory=str(tmp_path), http2=False))
+    next_run = ContentfulTransport(cache_directory=str(tmp_path), http2=False)
+
+    assert fetch(stub_server, next_run) == ['id0', 'id1', 'id2']
+
+    stats = next_run.stats()
+    assert stats['not_modified'] == 2
+    assert stats['bytes_transferred'] == 0
@@ -0,0 +1,65 @@
+from clients.compact_entry import CompactEntry
+from services.contentful_service import ContentfulService
+from services.dependency_service import DependencyIndex
+
+
+def entry(entry_id, content_type, fields):
+    return CompactEntry(id=entry_id, type='Entry', content_type_id=content_type, locale='es', revision=1, fields=fields)
+
+
+class FakeClient:
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def compact_entries(self, limit=1000, query=None):
+        return self.entries
+
+
+def build_service():
+    link = lambda entry_id: {'sys': {'id': entry_id}}
+    fallback = link('fallback')
+    return ContentfulService(FakeClient([
+        entry('fallback', 'fallback', {'text': 'no entendi'}),
+        entry('et', 'entityType', {'entityType': 'tipo', 'entityValue': [link('va')]}),
+        entry('va', 'entityValue', {'entityValue': 'Cuenta', 'synonyms': ['cuenta']}),
+        entry('menu', 'node', {'text': 'Que cuenta?', 'fallbacks': [fallback], 'chips': [link('checking')]}),
+        entry('checking', 'chip', {'text': 'Corriente', 'location': link('end')}),
+        entry('end', 'node', {'text': 'fin corriente'}),
+        entry('chip', 'chip', {'text': 'Cuenta', 'location': link('menu'), 'entityValue': link('va')}),
+        entry('card', 'chip', {'text': 'Tarjeta', 'location': link('card_end')}),
+        entry('card_end', 'node', {'text': 'fin tarjeta'}),
+        entry('start', 'node', {'text': 'Que quieres?', 'fallbacks': [fallback], 'entityType': link('et'),
+                                'chips': [link('chip'), link('card')]}),
+        entry('f1', 'flow', {'key': 'Cuentas', 'intent': 'flow.cuentas.info', 'question': 'cuentas?',
+                             'flowEntityTypes': [link('et')], 'startNode': link('start')}),
+        entry('help', 'node', {'text': 'Te ayudo', 'fallbacks': [fallback]}),
+        entry('f2', 'flow', {'key': 'Ayuda', 'intent': 'faq.ayuda.info', 'question': 'ayuda?',
+                             'startNode': link('help')}),
+    ]))
+
+
+def test_shared_entries_point_to_the_pages_they_feed():
+    index = build_service().dependency_index
+
+    assert index.affected(['end']) == {'flows': {'Cuentas'}, 'pages': {'Cuentas > Cuenta > Corriente'},
+                                       'intents': set(), 'entity_types': set(), 'faqs': set()}
+    assert index.affected(['menu'])['pages'] == {'Cuentas > Cuenta', 'Cuentas > Cuenta > Corriente'}
+    # a fallback only changes the page of its node, in every flow that uses it
+    assert index.affected(['fallback']) == {'flows': {'Cuentas'}, 'pages': {'Cuentas', 'Cuentas > Cuenta'},
+                                            'intents': set(), 'entity_types': set(), 'faqs': {'faq.ayuda.info'}}
+    # an entity value is linked by the entity type, the flow entity types and a chip
+    assert index.affected(['va'])['entity_types'] == {'tipo'}
+    assert len(index.affected(['va'])['pages']) == 4
+    assert index.affected(['card'])['pages'] == {'Cuentas', 'Cuentas > Tarjeta'}
+    assert index.affected(['f1'])['intents'] == {'flow.cuentas.info'}
+    assert index.affected(['unknown']) == {kind: set() for kind in index.affected([])}
+
+
+def test_index_is_saved_between_runs(tmp_path):
+    path = str(tmp_path / 'dependencies.json')
+    build_service().dependency_index.save(path)
+
+    index = DependencyIndex.load(path)
+    assert index.affected(['end'])['pages'] == {'Cuentas > Cuenta > Corriente'}
+    assert DependencyIndex.load(str(tmp_path / 'missing.json')).entries == {}
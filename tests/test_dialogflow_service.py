@@ -0,0 +1,270 @@
+from unittest.mock import MagicMock
+
+from google.cloud import dialogflowcx_v3beta1 as dialogflowcx
+
+from clients.dialogflow_client import AgentManager, TransitionRouteManager
+from clients.resource_id_cache import ResourceIdCache
+from services.dialogflow_service import DialogflowServiceCX
+from utils.utils_dialogflow import DialogFlowUtils
+
+
+BASE_PARENT = 'projects/p/locations/l'
+AGENT_PARENT = f'{BASE_PARENT}/agents/agent-1'
+START_FLOW = f'{AGENT_PARENT}/flows/00000000-0000-0000-0000-000000000000'
+
+
+def make_factory(agent_name='Mi agente'):
+    factory = MagicMock(base_parent=BASE_PARENT)
+    factory.get_agent_parent.side_effect = lambda agent_id: f'{BASE_PARENT}/agents/{agent_id}'
+    factory.get_flow_parent.side_effect = lambda agent_id, flow_id: f'{BASE_PARENT}/agents/{agent_id}/flows/{flow_id}'
+    agents_client = factory.agents_client.return_value
+    agents_client.list_agents.return_value = [dialogflowcx.Agent(name=AGENT_PARENT, display_name=agent_name)]
+    agents_client.get_agent.return_value = dialogflowcx.Agent(name=AGENT_PARENT, display_name=agent_name,
+                                                              start_flow=START_FLOW)
+    return factory, agents_client
+
+
+def test_explicit_ids_skip_discovery():
+    factory, agents_client = make_factory()
+
+    service = DialogflowServiceCX(factory, 'Mi agente', agent_id='agent-1', default_flow_id='flow-1')
+
+    assert service.flow_manager.parent == f'{AGENT_PARENT}/flows/flow-1'
+    agents_client.list_agents.assert_not_called()
+    agents_client.get_agent.assert_not_called()
+    factory.flows_client.return_value.list_flows.assert_not_called()
+
+
+def test_cold_start_resolves_ids_once_and_caches_them(tmp_path):
+    factory, agents_client = make_factory()
+    id_cache = ResourceIdCache(str(tmp_path / 'ids.json'))
+    # the managers don't list anything when they are created
+    assert AgentManager(factory, 'Mi agente').agent_id is None
+    agents_client.list_agents.assert_not_called()
+
+    service = DialogflowServiceCX(factory, 'Mi agente', id_cache=id_cache)
+
+    agents_client.list_agents.assert_called_once()
+    assert (service.agent_manager.agent_id, service.flow_manager.default_flow_id) == \
+        ('agent-1', '00000000-0000-0000-0000-000000000000')
+    factory.flows_client.return_value.list_flows.assert_not_called()
+    assert ResourceIdCache(str(tmp_path / 'ids.json')).get(f'{BASE_PARENT}|Mi agente')['agent_id'] == 'agent-1'
+
+
+def test_cached_ids_are_used_and_checked_in_background(tmp_path):
+    factory, agents_client = make_factory()
+    id_cache = ResourceIdCache(str(tmp_path / 'ids.json'))
+    id_cache.set(f'{BASE_PARENT}|Mi agente', agent_id='agent-1', default_flow_id='00000000-0000-0000-0000-000000000000')
+
+    service = DialogflowServiceCX(factory, 'Mi agente', id_cache=id_cache)
+
+    assert service.id_verification.result(timeout=5) is True
+    agents_client.list_agents.assert_not_called()
+    agents_client.get_agent.assert_called_once()
+
+
+def test_stale_cached_ids_are_invalidated(tmp_path):
+    factory, agents_client = make_factory(agent_name='Otro agente')
+    id_cache = ResourceIdCache(str(tmp_path / 'ids.json'))
+    id_cache.set(f'{BASE_PARENT}|Mi agente', agent_id='agent-1', default_flow_id='flow-1')
+
+    service = DialogflowServiceCX(factory, 'Mi agente', id_cache=id_cache)
+
+    assert service.id_verification.result(timeout=5) is False
+    assert ResourceIdCache(str(tmp_path / 'ids.json')).get(f'{BASE_PARENT}|Mi agente') == {}
+
+
+def test_stale_cached_ids_are_resolved_again_before_the_first_write(tmp_path):
+    factory, agents_client = make_factory()
+    id_cache = ResourceIdCache(str(tmp_path / 'ids.json'))
+    id_cache.set(f'{BASE_PARENT}|Mi agente', agent_id='agent-0', default_flow_id='flow-0')
+
+    service = DialogflowServiceCX(factory, 'Mi agente', id_cache=id_cache)
+    agents_client.list_agents.assert_not_called()
+    service.create_entity_types([])
+
+    assert service.entity_type_manager.parent == AGENT_PARENT
+    assert service.flow_manager.parent == START_FLOW
+    assert ResourceIdCache(str(tmp_path / 'ids.json')).get(f'{BASE_PARENT}|Mi agente') == \
+        {'agent_id': 'agent-1', 'default_flow_id': '00000000-0000-0000-0000-000000000000'}
+
+
+def test_subpage_routes_are_written_once_per_parent_page():
+    factory, _ = make_factory()
+    service = DialogflowServiceCX(factory, 'Mi agente', agent_id='agent-1', default_flow_id='flow-1')
+    service.create_page = lambda page_dict, dialogflow_flow_parent, is_start_page=False: \
+        dialogflowcx.Page(name=f"{dialogflow_flow_parent}/pages/{page_dict['display_name']}",
+                          display_name=page_dict['display_name'])
+    service.pages_manager = MagicMock()
+    service.pages_manager.get_page_by_display_name.side_effect = lambda display_name, parent_flow: \
+        dialogflowcx.Page(name=f'{parent_flow}/pages/{display_name}', display_name=display_name)
+    service.transition_route_manager = MagicMock()
+    service.transition_route_manager.get_route_groups_by_display_name.return_value = {}
+    service.transition_route_manager.create_or_update_route_group.side_effect = \
+        lambda parent_flow, display_name, transition_routes, existing_groups=None: dialogflowcx.TransitionRouteGroup(
+            name=f'{parent_flow}/transitionRouteGroups/{display_name}', transition_routes=transition_routes)
+
+    def sub_page(display_name, parent, values, is_end_flow=False):
+        return {'display_name': display_name, 'parent': parent, 'entityValues': values, 'is_end_flow': is_end_flow,
+                'entry_fulfillment': 'listo' if is_end_flow else display_name, 'depth': display_name.count('>'),
+                'route_params_entity_types': '$session.params.tipo'}
+
+    flow = dialogflowcx.Flow(name='flows/f1', display_name='F')
+    service.create_subpages_in_flow(flow, [sub_page('F', None, []),
+                                           sub_page('F > X', 'F', ['X', 'Z']),
+                                           sub_page('F > X > fin', 'F > X', ['A'], is_end_flow=True),
+                                           sub_page('F > Y', 'F', ['Y']),
+                                           sub_page('F > Y > fin', 'F > Y', ['A'], is_end_flow=True)])
+
+    updates = {call.args[0].display_name: call.args[0] for call in service.pages_manager.update_page_routes.call_args_list}
+    assert sorted(updates) == ['F', 'F > X', 'F > Y']
+    assert [route.condition for route in updates['F'].transition_routes] == \
+        ['$session.params.tipo = "X" OR $session.params.tipo = "Z"', '$session.params.tipo = "Y"']
+    assert updates['F > X'].transition_route_groups == updates['F > Y'].transition_route_groups
+    assert len(updates['F > X'].transition_routes) == 0
+    service.transition_route_manager.create_or_update_route_group.assert_called_once()
+
+
+def test_flow_without_routes_drops_the_routes_of_the_previous_run():
+    factory, _ = make_factory()
+    service = DialogflowServiceCX(factory, 'Mi agente', agent_id='agent-1', default_flow_id='flow-1')
+    service.pages_manager = MagicMock()
+    service.pages_manager.get_page_by_display_name.return_value = dialogflowcx.Page(
+        name='flows/f1/pages/F', display_name='F', transition_routes=[dialogflowcx.TransitionRoute(
+            condition='$session.params.tipo = "X"', target_page='flows/f1/pages/X')],
+        transition_route_groups=['flows/f1/transitionRouteGroups/old'])
+    service.transition_route_manager = MagicMock()
+    service.transition_route_manager.get_route_groups_by_display_name.return_value = {
+        'shared-routes-old': dialogflowcx.TransitionRouteGroup(name='flows/f1/transitionRouteGroups/old')}
+
+    service.create_subpages_in_flow(dialogflowcx.Flow(name='flows/f1', display_name='F'),
+                                    [{'display_name': 'F', 'parent': None, 'entityValues': [], 'is_end_flow': False,
+                                      'entry_fulfillment': 'hola', 'depth': 0}])
+
+    page = service.pages_manager.update_page_routes.call_args.args[0]
+    assert (list(page.transition_routes), list(page.transition_route_groups)) == ([], [])
+    service.transition_route_manager.delete_route_group.assert_called_once_with('flows/f1/transitionRouteGroups/old')
+
+
+def test_default_flow_routes_are_added_in_one_update(tmp_path):
+    from services.journal_service import OperationJournal
+
+    factory, _ = make_factory()
+    flows_client = factory.flows_client.return_value
+    flows_client.get_flow.return_value = dialogflowcx.Flow(
+        name=START_FLOW, transition_routes=[dialogflowcx.TransitionRoute(intent='intents/a', target_flow='flows/a')])
+    journal = OperationJournal(path=str(tmp_path / 'journal.jsonl'))
+    service = DialogflowServiceCX(factory, 'Mi agente', journal=journal, agent_id='agent-1',
+                                  default_flow_id='00000000-0000-0000-0000-000000000000')
+    routes = [{'intent': f'intents/{name}', 'target_flow': f'flows/{name}'} for name in 'abc']
+
+    service.add_default_flow_routes(routes)
+    service.add_default_flow_routes(routes)
+
+    flows_client.update_flow.assert_called_once()
+    flow = flows_client.update_flow.call_args.kwargs['request'].flow
+    assert [route.intent for route in flow.transition_routes] == ['intents/a', 'intents/b', 'intents/c']
+
+
+def test_dedupe_routes_updates_only_the_resources_with_duplicates():
+    factory, _ = make_factory()
+    service = DialogflowServiceCX(factory, 'Mi agente', agent_id='agent-1', default_flow_id='flow-1')
+    route = dialogflowcx.TransitionRoute(condition='$session.params.tipo = "A"', target_page='pages/a')
+    pages = {'F': dialogflowcx.Page(display_name='F', transition_routes=[route, route, route]),
+             'G': dialogflowcx.Page(display_name='G', transition_routes=[route])}
+    service.flow_manager = MagicMock()
+    service.flow_manager.parent = 'flows/default'
+    service.flow_manager.get_flows_by_display_name.return_value = {'F': dialogflowcx.Flow(name='flows/f')}
+    service.flow_manager.get_flow.side_effect = lambda name: dialogflowcx.Flow(name=name)
+    service.pages_manager = MagicMock()
+    service.pages_manager.get_pages_by_display_name.side_effect = lambda flow_name: pages if flow_name == 'flows/f' else {}
+    service.transition_route_manager = MagicMock()
+    service.transition_route_manager.get_route_groups_by_display_name.return_value = {}
+
+    stats = service.dedupe_routes()
+
+    assert stats == {'flows': 0, 'pages': 1, 'route_groups': 0, 'routes_removed': 2}
+    service.pages_manager.update_page_routes.assert_called_once()
+    assert len(service.pages_manager.update_page_routes.call_args.args[0].transition_routes) == 1
+    service.flow_manager.update_flow_routes.assert_not_called()
+
+
+def test_reconciled_page_routes_replace_the_existing_ones():
+    def route(condition, target_page='pages/a', name=''):
+        return dialogflowcx.TransitionRoute(name=name, condition=condition, target_page=target_page)
+
+    # the routes of two previous runs: a duplicate and a condition that is not planned anymore
+    page = dialogflowcx.Page(display_name='F', transition_routes=[route('A', name='r1'), route('A', name='r2'),
+                                                                  route('B', name='r3')],
+                             transition_route_groups=['groups/manual', 'groups/shared-old'])
+    pages_manager = MagicMock()
+    pages_manager.update_page_routes.side_effect = lambda page: page
+
+    page = DialogFlowUtils.set_routes_on_page(page, [route('A'), route('C', target_page=None), route('C', target_page=None)],
+                                              ['groups/shared-new'], pages_manager,
+                                              managed_group_names={'groups/shared-old'})
+
+    assert [(route.condition, route.target_page) for route in page.transition_routes] == [('A', 'pages/a'), ('C', '')]
+    assert list(page.transition_route_groups) == ['groups/manual', 'groups/shared-new']
+
+    # a second run with the same routes doesn't update the page
+    page.transition_routes = [route('A', name='r4'), route('C', target_page=None, name='r5')]
+    DialogFlowUtils.set_routes_on_page(page, [route('A'), route('C', target_page=None)], ['groups/shared-new'],
+                                       pages_manager, managed_group_names={'groups/shared-new'})
+    pages_manager.update_page_routes.assert_called_once()
+
+
+def test_flow_routes_are_one_by_intent():
+    flow = dialogflowcx.Flow(name='flows/default', transition_routes=[
+        dialogflowcx.TransitionRoute(intent='intents/a', target_flow='flows/old'),
+        dialogflowcx.TransitionRoute(intent='intents/a', target_flow='flows/old'),
+        dialogflowcx.TransitionRoute(intent='intents/b', target_flow='flows/b')])
+    flow_client = MagicMock()
+    flow_client.get_flow.return_value = flow
+    manager = TransitionRouteManager(MagicMock(), flow_client, 'flows/default', MagicMock())
+
+    manager.add_transition_route_to_new_flow('intents/a', 'flows/new')
+    assert [(route.intent, route.target_flow) for route in flow.transition_routes] == \
+        [('intents/a', 'flows/new'), ('intents/b', 'flows/b')]
+
+    flow_client.update_flow.reset_mock()
+    assert manager.add_transition_route_to_new_flow('intents/a', 'flows/new') is None
+    flow_client.update_flow.assert_not_called()
+
+
+def make_flows_service(flow_names):
+    factory, _ = make_factory()
+    flows_client = factory.flows_client.return_value
+    flows = {name: dialogflowcx.Flow(name=f'flows/{name}', display_name=name) for name in flow_names}
+    flows_client.list_flows.side_effect = lambda request: list(flows.values())
+    flows_client.create_flow.side_effect = lambda request: flows.setdefault(
+        request.flow.display_name, dialogflowcx.Flow(name=f'flows/{request.flow.display_name}',
+                                                     display_name=request.flow.display_name))
+    flows_client.delete_flow.side_effect = lambda request: flows.pop(request.name.split('/')[-1])
+    service = DialogflowServiceCX(factory, 'Mi agente', agent_id='agent-1', default_flow_id='flow-1')
+    service.create_page = lambda page_dict, dialogflow_flow_parent, is_start_page=False: \
+        dialogflowcx.Page(name=f"{dialogflow_flow_parent}/pages/{page_dict['display_name']}")
+    service.create_subpages_in_flow = MagicMock()
+    service.transition_route_manager = MagicMock()
+    service._add_parent_to_intent = lambda flow: flow.update(parent_intent=f"intents/{flow['intent']}")
+    return service, flows
+
+
+def test_sub_flows_of_a_bigger_partition_are_deleted():
+    service, flows = make_flows_service(['F', 'F #2', 'F #3', 'F #10', 'F #2 copia', 'G #2'])
+    flow = {'display_name': 'F', 'intent': 'flow.f.info', 'parent_intent': 'intents/f', 'subpages': []}
+    sub_flow = {'display_name': 'F #2', 'parent_flow': 'F', 'entry_page': 'F', 'subpages': []}
+
+    service.create_flows(flows_list=[flow, sub_flow], default_flow_routes=[])
+
+    assert sorted(flows) == ['F', 'F #2', 'F #2 copia', 'G #2']
+    service.create_flows(flows_list=[flow], default_flow_routes=[])
+    assert sorted(flows) == ['F', 'F #2 copia', 'G #2']
+
+
+def test_deleted_flow_takes_its_sub_flows():
+    service, flows = make_flows_service(['F', 'F #2', 'F #3', 'FF #2'])
+
+    service.delete_flow('F')
+
+    assert sorted(flows) == ['FF #2']
@@ -0,0 +1,124 @@
+from unittest.mock import MagicMock
+
+from google.cloud import dialogflowcx_v3beta1 as dialogflowcx
+
+from clients.dialogflow_client import EntityTypeManager
+from utils.entity_utils import EntityUtils
+
+
+def make_values(count):
+    return [{'entityValue': f'producto {i}', 'synonyms': [f'producto {i}', f'prod {i}']} for i in range(count)]
+
+
+def make_manager():
+    """EntityTypeManager over a client that keeps the entity types in memory."""
+    entity_types = {}
+    client = MagicMock()
+    client.list_entity_types.side_effect = lambda request: list(entity_types.values())
+
+    def create_entity_type(parent, entity_type):
+        entity_type.name = f'{parent}/entityTypes/{entity_type.display_name}'
+        entity_types[entity_type.name] = entity_type
+        return entity_type
+
+    def update_entity_type(request):
+        entity_types[request.entity_type.name] = request.entity_type
+        return request.entity_type
+
+    client.create_entity_type.side_effect = create_entity_type
+    client.update_entity_type.side_effect = update_entity_type
+    client.delete_entity_type.side_effect = lambda name, force: entity_types.pop(name)
+    factory = MagicMock()
+    factory.entity_types_client.return_value = client
+    factory.get_agent_parent.return_value = 'agents/a'
+    return EntityTypeManager(factory, 'a'), client, entity_types
+
+
+def test_normalize_entities_trims_and_merges_duplicates():
+    entities = EntityUtils.normalize_entities([
+        {'entityValue': ' Cuenta  corriente ', 'synonyms': ['cuenta corriente', 'CUENTA CORRIENTE ', 'cc']},
+        {'entityValue': 'Cuenta corriente', 'synonyms': ['ctacte']},
+        {'entityValue': 'Vista'},
+        {'entityValue': '  '},
+    ])
+
+    assert entities == [
+        {'value': 'Cuenta corriente', 'synonyms': ['cuenta corriente', 'cc', 'ctacte']},
+        {'value': 'Vista', 'synonyms': ['Vista']},
+    ]
+
+
+def test_split_entities_keeps_the_chunk_of_unchanged_values():
+    entities = EntityUtils.normalize_entities(make_values(100))
+    chunks = EntityUtils.split_entities(entities, max_entities=30)
+    assert len(chunks) == 4
+    assert all(len(chunk) <= 30 for chunk in chunks)
+    assert sorted(entity['value'] for chunk in chunks for entity in chunk) == sorted(e['value'] for e in entities)
+
+    changed = EntityUtils.split_entities(entities[:-1], max_entities=30)
+    assert sum(chunk != other for chunk, other in zip(chunks, changed)) == 1
+
+
+def test_split_entities_by_bytes():
+    entities = EntityUtils.normalize_entities(make_values(10))
+    size = sum(EntityUtils.entity_size(entity) for entity in entities)
+    assert len(EntityUtils.split_entities(entities, max_bytes=size)) == 1
+    assert len(EntityUtils.split_entities(entities, max_bytes=size // 2)) > 1
+
+
+def test_same_entities_ignores_order():
+    entities = EntityUtils.normalize_entities(make_values(3))
+    assert EntityUtils.same_entities(entities, list(reversed(entities)))
+    assert not EntityUtils.same_entities(entities, entities[:2])
+
+
+def test_unchanged_entity_type_is_not_written():
+    manager, client, _ = make_manager()
+    manager.create_or_update_entity_type('productos', make_values(5))
+    manager.refresh()
+    manager.create_or_update_entity_type('productos', list(reversed(make_values(5))))
+
+    assert client.create_entity_type.call_count == 1
+    client.update_entity_type.assert_not_called()
+
+    manager.create_or_update_entity_type('productos', make_values(6))
+    assert client.update_entity_type.call_count == 1
+
+
+def test_big_entity_type_is_a_list_of_parts():
+    manager, client, entity_types = make_manager()
+    entity_type = manager.create_or_update_entity_type('productos', make_values(100), max_entities=30)
+
+    parts = sorted(name for name in entity_types if '-part' in name)
+    assert len(parts) == 4
+    assert entity_type.kind == dialogflowcx.EntityType.Kind.KIND_LIST
+    assert sorted(entity.value for entity in entity_type.entities) == \
+        sorted(f'@{name.rsplit("/", 1)[1]}' for name in parts)
+
+    # one changed value rewrites its part only
+    client.create_entity_type.reset_mock()
+    values = make_values(100)
+    values[0]['synonyms'].append('nuevo')
+    manager.create_or_update_entity_type('productos', values, max_entities=30)
+    assert client.update_entity_type.call_count == 1
+    client.create_entity_type.assert_not_called()
+
+    # back under the limit, the parts are deleted
+    entity_type = manager.create_or_update_entity_type('productos', make_values(10), max_entities=30)
+    assert entity_type.kind == dialogflowcx.EntityType.Kind.KIND_MAP
+    assert list(entity_types) == ['agents/a/entityTypes/productos']
+
+
+def test_only_the_parts_of_a_split_entity_type_are_deleted():
+    manager, client, entity_types = make_manager()
+    manager.create_or_update_entity_type('cuenta-partner', make_values(3))
+    manager.create_or_update_entity_type('cuenta', make_values(100), max_entities=30)
+
+    # back under the limit, the parts go and the entity type with a similar name stays
+    manager.create_or_update_entity_type('cuenta', make_values(10), max_entities=30)
+    assert sorted(entity_types) == ['agents/a/entityTypes/cuenta', 'agents/a/entityTypes/cuenta-partner']
+
+    # an entity type that was never split deletes nothing
+    client.delete_entity_type.reset_mock()
+    manager.create_or_update_entity_type('cuenta', make_values(11), max_entities=30)
+    client.delete_entity_type.assert_not_called()
@@ -0,0 +1,47 @@
+import csv
+import json
+
+import pytest
+
+from clients.entry_store_client import EntryStoreClient
+from services.contentful_service import ContentfulService
+from services.export_service import ExportService, ExportServiceError
+
+
+def entry(entry_id, content_type, fields):
+    return {'sys': {'id': entry_id, 'locale': 'es', 'contentType': {'sys': {'id': content_type}}}, 'fields': fields}
+
+
+@pytest.fixture
+def export_service(tmp_path):
+    entries = [entry('message', 'message', {'text': 'hola'}),
+               entry('f1', 'flow', {'key': 'a', 'startNode': {'sys': {'id': 'message'}}}),
+               entry('f2', 'flow', {'key': 'b', 'intent': 'flow.b'})]
+    with open(tmp_path / 'entries.json', 'w') as store_file:
+        json.dump({'content_types': [], 'entries': entries}, store_file)
+    return ExportService(ContentfulService(EntryStoreClient(str(tmp_path / 'entries.json'))), row_group_size=1)
+
+
+def test_export_csv_by_content_type(export_service, tmp_path):
+    paths = export_service.export(str(tmp_path / 'out'), file_format='csv')
+
+    assert sorted(paths) == [str(tmp_path / 'out' / 'flow.csv'), str(tmp_path / 'out' / 'message.csv')]
+    with open(tmp_path / 'out' / 'flow.csv') as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert [row['key'] for row in rows] == ['a', 'b']
+    assert json.loads(rows[0]['startNode']) == {'text': 'hola'}
+    assert rows[0]['intent'] == ''
+
+
+def test_export_parquet_in_row_groups(export_service, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    export_service.export(str(tmp_path / 'out'), file_format='parquet')
+
+    parquet_file = pq.ParquetFile(tmp_path / 'out' / 'flow.parquet')
+    assert parquet_file.num_row_groups == 2
+    assert parquet_file.read().column('key').to_pylist() == ['a', 'b']
+
+
+def test_export_unknown_format(export_service, tmp_path):
+    with pytest.raises(ExportServiceError):
+        export_service.export(str(tmp_path / 'out'), file_format='json')
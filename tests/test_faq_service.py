@@ -0,0 +1,172 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+from google.cloud import dialogflowcx_v3beta1 as dialogflowcx
+
+from services.contentful_service import ContentfulService
+from services.faq_service import FaqServiceCX, FaqServiceCXError
+from services.state_service import StateStore
+
+
+FLOW = 'projects/p/locations/l/agents/a/flows/default'
+
+
+def make_faqs(count, answer='respuesta'):
+    return [{'display_name': f'faq {i}', 'intent': f'faq.tema{i}.info', 'locale': 'es', 'question': f'pregunta {i}?',
+             'entry_fulfillment': f'{answer} {i}', 'payload_responses': []} for i in range(count)]
+
+
+class FakeBackend:
+    """Intents and route groups of the default flow kept in memory."""
+
+    def __init__(self):
+        self.intents = {}
+        self.groups = {}
+        self.flow = dialogflowcx.Flow(name=FLOW)
+        self.group_writes = 0
+
+        intent_manager = MagicMock()
+        intent_manager.get_intents_by_display_name.side_effect = lambda: dict(self.intents)
+        intent_manager.create_intent.side_effect = self.create_intent
+        route_manager = MagicMock()
+        route_manager.get_route_groups_by_display_name.side_effect = lambda parent_flow: dict(self.groups)
+        route_manager.create_or_update_route_group.side_effect = self.write_group
+        route_manager.set_flow_route_groups.side_effect = \
+            lambda flow_name, names: setattr(self.flow, 'transition_route_groups', names)
+        route_manager.delete_route_group.side_effect = \
+            lambda name: self.groups.pop(next(key for key, group in self.groups.items() if group.name == name))
+        flow_manager = MagicMock()
+        flow_manager.parent = FLOW
+        flow_manager.get_flow.side_effect = lambda name: self.flow
+        self.df_service = SimpleNamespace(intent_manager=intent_manager, flow_manager=flow_manager,
+                                          transition_route_manager=route_manager)
+
+    def create_intent(self, display_name, training_phrase):
+        part = dialogflowcx.Intent.TrainingPhrase.Part(text=training_phrase)
+        intent = dialogflowcx.Intent(name=f'intents/{display_name}', display_name=display_name,
+                                     training_phrases=[dialogflowcx.Intent.TrainingPhrase(parts=[part])])
+        self.intents[display_name] = intent
+        return intent
+
+    def write_group(self, parent_flow, display_name, transition_routes, existing_groups):
+        self.group_writes += 1
+        group = dialogflowcx.TransitionRouteGroup(name=f'{parent_flow}/transitionRouteGroups/{display_name}',
+                                                  display_name=display_name, transition_routes=transition_routes)
+        self.groups[display_name] = group
+        return group
+
+
+def test_faqs_are_routes_in_groups_of_the_default_flow(tmp_path):
+    backend = FakeBackend()
+
+    stats = FaqServiceCX(backend.df_service, state=StateStore(str(tmp_path / 'faq.json')),
+                         routes_per_group=10).sync(make_faqs(25))
+
+    assert stats['intents_created'] == 25
+    assert len(backend.groups) == 4
+    assert sum(len(group.transition_routes) for group in backend.groups.values()) == 25
+    route = next(iter(backend.groups.values())).transition_routes[0]
+    assert route.intent.startswith('intents/faq.tema') and not route.target_page
+    assert route.trigger_fulfillment.messages[0].text.text[0].startswith('respuesta')
+    assert sorted(backend.flow.transition_route_groups) == sorted(group.name for group in backend.groups.values())
+
+
+def test_unchanged_faqs_are_skipped(tmp_path):
+    backend = FakeBackend()
+    FaqServiceCX(backend.df_service, state=StateStore(str(tmp_path / 'faq.json')),
+                 routes_per_group=10).sync(make_faqs(25))
+    writes = backend.group_writes
+
+    faqs = make_faqs(25)
+    faqs[3]['entry_fulfillment'] = 'nueva respuesta'
+    stats = FaqServiceCX(backend.df_service, state=StateStore(str(tmp_path / 'faq.json')),
+                         routes_per_group=10).sync(faqs)
+
+    assert stats['intents_unchanged'] == 25
+    assert (stats['groups_written'], stats['groups_unchanged']) == (1, 3)
+    assert backend.group_writes == writes + 1
+
+
+def test_stale_groups_are_detached_and_deleted(tmp_path):
+    backend = FakeBackend()
+    state = StateStore(str(tmp_path / 'faq.json'))
+    FaqServiceCX(backend.df_service, state=state, routes_per_group=10).sync(make_faqs(25))
+
+    stats = FaqServiceCX(backend.df_service, state=state, routes_per_group=10).sync(make_faqs(5))
+
+    assert stats['groups_deleted'] == 4
+    assert len(backend.groups) == 1
+    assert list(backend.flow.transition_route_groups) == [group.name for group in backend.groups.values()]
+
+
+def test_compile_faqs_keeps_the_answer_and_chips():
+    flows = [{'key': 'Horario', 'intent': 'faq.horario.info', 'locale': 'es', 'question': 'horario?',
+              'startNode': {'text': 'De 9 a 18', 'chips': [{'text': 'Sucursales', 'url': 'https://x'}]}},
+             {'key': 'Flujo', 'intent': 'flow.x.info', 'locale': 'es', 'question': 'x?', 'startNode': {'text': 'x'}}]
+
+    [faq] = ContentfulService(None).compile_faqs(flows)
+
+    assert faq['entry_fulfillment'] == 'De 9 a 18'
+    assert faq['payload_responses']['RichContent'][0][0]['options'] == [{'text': 'Sucursales', 'url': 'https://x'}]
+
+
+def test_upsert_replaces_the_given_faqs_and_keeps_the_others(tmp_path):
+    backend = FakeBackend()
+    state = StateStore(str(tmp_path / 'faq.json'))
+    FaqServiceCX(backend.df_service, state=state, routes_per_group=10).sync(make_faqs(25))
+    groups = dict(backend.groups)
+    # a group of the agent named like the faq groups, without <count>-<index>
+    backend.groups['faq-routes-manual'] = dialogflowcx.TransitionRouteGroup(name=f'{FLOW}/transitionRouteGroups/manual',
+                                                                            display_name='faq-routes-manual')
+
+    faq = make_faqs(25, answer='nueva respuesta')[3]
+    stats = FaqServiceCX(backend.df_service, state=state, routes_per_group=10).upsert([faq])
+
+    assert (stats['groups_written'], stats['groups_deleted']) == (1, 0)
+    assert sorted(backend.groups) == sorted([*groups, 'faq-routes-manual'])
+    routes = [route for group in backend.groups.values() for route in group.transition_routes]
+    assert len(routes) == 25
+    [route] = [route for route in routes if route.intent == 'intents/faq.tema3.info']
+    assert route.trigger_fulfillment.messages[0].text.text[0] == 'nueva respuesta 3'
+    # the next sync writes the group again from the whole catalog
+    assert FaqServiceCX(backend.df_service, state=state, routes_per_group=10).sync(make_faqs(25))['groups_written'] == 1
+    assert 'faq-routes-manual' in backend.groups
+
+
+def test_group_count_is_kept_until_a_group_overflows(tmp_path):
+    backend = FakeBackend()
+    state = StateStore(str(tmp_path / 'faq.json'))
+    FaqServiceCX(backend.df_service, state=state, routes_per_group=10).sync(make_faqs(25))
+    groups = sorted(backend.groups)
+
+    # 15 faqs would fit in 2 groups, the 4 groups of the previous sync are kept
+    stats = FaqServiceCX(backend.df_service, state=state, routes_per_group=10).sync(make_faqs(15))
+    assert sorted(backend.groups) == groups and stats['groups_deleted'] == 0
+
+    FaqServiceCX(backend.df_service, state=state, routes_per_group=10).sync(make_faqs(60))
+    [group_count] = {FaqServiceCX.group_count(name) for name in backend.groups}
+    assert group_count > 4
+    assert all(len(group.transition_routes) <= 10 for group in backend.groups.values())
+
+
+def test_failed_groups_are_counted_and_written_by_the_next_sync(tmp_path):
+    backend = FakeBackend()
+    state = StateStore(str(tmp_path / 'faq.json'))
+    write_group = backend.write_group
+
+    def failing_write_group(parent_flow, display_name, transition_routes, existing_groups):
+        if display_name.endswith('-0'):
+            raise RuntimeError('quota exceeded')
+        return write_group(parent_flow, display_name, transition_routes, existing_groups)
+
+    backend.df_service.transition_route_manager.create_or_update_route_group.side_effect = failing_write_group
+    service = FaqServiceCX(backend.df_service, state=state, routes_per_group=10)
+    with pytest.raises(FaqServiceCXError):
+        service.sync(make_faqs(25))
+    assert (service.stats['groups_written'], service.stats['groups_failed']) == (3, 1)
+    assert len(backend.flow.transition_route_groups) == 3
+
+    backend.df_service.transition_route_manager.create_or_update_route_group.side_effect = write_group
+    stats = FaqServiceCX(backend.df_service, state=state, routes_per_group=10).sync(make_faqs(25))
+    assert (stats['groups_written'], stats['groups_unchanged'], stats['groups_failed']) == (1, 3, 0)
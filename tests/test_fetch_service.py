@@ -0,0 +1,160 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+from clients.compact_entry import CompactEntry
+from clients.contentful_client import ContentfulClient
+from services.contentful_service import ContentfulService
+from services.fetch_service import FetchPlanner, ROOT_CONTENT_TYPES
+
+
+def content_type(content_type_id, fields):
+    return SimpleNamespace(raw={'sys': {'id': content_type_id}, 'fields': fields})
+
+
+def link_field(field_id, link_content_types=None, array=False):
+    link = {'type': 'Link', 'linkType': 'Entry',
+            'validations': [{'linkContentType': link_content_types}] if link_content_types else []}
+    field = {'id': field_id, **link}
+    return {'id': field_id, 'type': 'Array', 'items': link} if array else field
+
+
+CONTENT_TYPES = SimpleNamespace(items=[
+    content_type('flow', [{'id': 'key', 'type': 'Symbol'}, {'id': 'intent', 'type': 'Symbol'},
+                          {'id': 'internalNotes', 'type': 'Text'}, link_field('startNode', ['node']),
+                          link_field('flowEntityTypes', ['entityType'], array=True)]),
+    content_type('node', [{'id': 'text', 'type': 'Symbol'}, link_field('chips', array=True)]),
+    content_type('entityType', [{'id': 'entityType', 'type': 'Symbol'}, {'id': 'entityValue', 'type': 'Object'}]),
+    content_type('blogPost', [{'id': 'title', 'type': 'Symbol'}]),
+])
+
+
+def entry(entry_id, content_type_id, fields):
+    return CompactEntry(id=entry_id, type='Entry', content_type_id=content_type_id, locale='es', revision=1, fields=fields)
+
+
+class RecordingClient:
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.queries = []
+        self.requested_ids = []
+
+    def content_types(self):
+        return CONTENT_TYPES
+
+    def compact_entries(self, limit=1000, query=None):
+        self.queries.append(query)
+        return [entry for entry in self.entries if entry.content_type_id == query['content_type']]
+
+    def entries_by_ids(self, ids, limit=1000):
+        self.requested_ids.append(ids)
+        return [entry for entry in self.entries if entry.id in ids]
+
+
+def test_plan_follows_links_from_root_content_types_with_select():
+    queries = FetchPlanner(CONTENT_TYPES, ROOT_CONTENT_TYPES).plan()
+
+    assert sorted(queries) == ['entityType', 'flow', 'node']
+    assert queries['flow']['select'] == 'sys,fields.key,fields.intent,fields.startNode,fields.flowEntityTypes'
+    assert queries['node']['select'] == 'sys,fields.text,fields.chips'
+
+
+def test_planned_fetch_pulls_missing_linked_entries_by_id():
+    client = RecordingClient([entry('flow1', 'flow', {'key': 'a', 'startNode': {'sys': {'id': 'node1'}}}),
+                              entry('node1', 'node', {'text': 'hola', 'chips': [{'sys': {'id': 'chip1'}}]}),
+                              entry('chip1', 'chip', {'text': 'chip', 'location': {'sys': {'id': 'chip2'}}}),
+                              entry('chip2', 'chip', {'text': 'fin'}),
+                              entry('post1', 'blogPost', {'title': 'no'})])
+    cf_service = ContentfulService(client, root_content_types=ROOT_CONTENT_TYPES)
+
+    fetched_ids = sorted(entry.id for entry in cf_service.all_entries)
+
+    assert fetched_ids == ['chip1', 'chip2', 'flow1', 'node1']
+    assert client.requested_ids == [['chip1'], ['chip2']]
+    assert 'blogPost' not in [query['content_type'] for query in client.queries]
+
+
+def test_ids_are_batched_by_url_length():
+    ids = [f'entry{i:04d}' for i in range(100)] + ['entry0000']
+    batches = ContentfulClient.id_batches(ids, max_length=130)
+
+    assert [entry_id for batch in batches for entry_id in batch] == ids[:100]
+    assert all(sum(len(entry_id) + 3 for entry_id in batch) <= 130 for batch in batches)
+    assert len(batches) == 10
+    assert [len(batch) for batch in ContentfulClient.id_batches(ids, max_ids=40)] == [40, 40, 20]
+
+
+def test_entries_by_ids_queries_the_batches_concurrently():
+    class RecordingTransport:
+        def __init__(self):
+            self.queries = []
+            self.running = self.max_running = 0
+            self._lock = threading.Lock()
+
+        def get(self, url, params, headers):
+            with self._lock:
+                self.queries.append(params['sys.id[in]'].split(','))
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+            time.sleep(0.05)
+            with self._lock:
+                self.running -= 1
+            items = [{'sys': {'id': entry_id, 'type': 'Entry', 'contentType': {'sys': {'id': 'node'}}}, 'fields': {}}
+                     for entry_id in params['sys.id[in]'].split(',')]
+            return json.dumps({'total': len(items), 'items': items}).encode('utf-8')
+
+    transport = RecordingTransport()
+    client = ContentfulClient('space', 'token', transport=transport)
+
+    entries = client.entries_by_ids([f'id{i}' for i in range(2500)])
+
+    assert len(entries) == 2500
+    assert sorted(map(len, transport.queries)) == sorted(map(len, ContentfulClient.id_batches([f'id{i}' for i in range(2500)])))
+    assert len(transport.queries) == 4
+    assert transport.max_running > 1
+
+
+def test_full_fetch_resolves_links_to_entries_left_out():
+    class PartialClient(RecordingClient):
+        def compact_entries(self, limit=1000, query=None):
+            # a fetch that only returned the flows, like a filtered or partial export
+            return [entry for entry in self.entries if entry.content_type_id == 'flow']
+
+    client = PartialClient([entry('flow1', 'flow', {'key': 'a', 'startNode': {'sys': {'id': 'node1'}},
+                                                    'flowEntityTypes': [{'sys': {'id': 'et1'}}]}),
+                            entry('node1', 'node', {'text': 'hola', 'chips': [{'sys': {'id': 'chip1'}}]}),
+                            entry('et1', 'entityType', {'entityType': 'tipo'}),
+                            entry('chip1', 'chip', {'text': 'chip', 'location': {'sys': {'id': 'gone'}}})])
+    cf_service = ContentfulService(client)
+
+    assert sorted(entry.id for entry in cf_service.all_entries) == ['chip1', 'et1', 'flow1', 'node1']
+    assert client.requested_ids == [['et1', 'node1'], ['chip1'], ['gone']]
+
+
+class SelectingClient(RecordingClient):
+
+    def compact_entries(self, limit=1000, query=None):
+        return [item for item in super().compact_entries(limit, query)
+                if item.fields.get('key') in query['fields.key[in]'].split(',')]
+
+
+def test_selected_fetch_queries_the_named_entries_and_their_links():
+    client = SelectingClient([entry('flow1', 'flow', {'key': 'a', 'startNode': {'sys': {'id': 'node1'}}}),
+                              entry('flow2', 'flow', {'key': 'b', 'startNode': {'sys': {'id': 'node2'}}}),
+                              entry('node1', 'node', {'text': 'hola', 'chips': [{'sys': {'id': 'chip1'}}]}),
+                              entry('node2', 'node', {'text': 'chao'}),
+                              entry('chip1', 'chip', {'text': 'chip'})])
+    cf_service = ContentfulService(client, root_content_types=ROOT_CONTENT_TYPES,
+                                   selection={'flows': ['a', 'no existe']})
+
+    assert sorted(entry.id for entry in cf_service.all_entries) == ['chip1', 'flow1', 'node1']
+    assert client.queries == [{'content_type': 'flow', 'fields.key[in]': 'a,no existe',
+                               'select': 'sys,fields.key,fields.intent,fields.startNode,fields.flowEntityTypes'}]
+    assert client.requested_ids == [['node1'], ['chip1']]
+
+    queries = FetchPlanner(CONTENT_TYPES).plan_selection({'intents': ['flow.a'], 'entity_types': ['Tipo, con coma']})
+    assert [{key: value for key, value in query.items() if key != 'select'} for query in queries] == [
+        {'content_type': 'flow', 'fields.intent[in]': 'flow.a'},
+        {'content_type': 'entityType', 'fields.entityType': 'Tipo, con coma'}]
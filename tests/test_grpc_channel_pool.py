@@ -0,0 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+import pytest
+
+from clients.grpc_channel_pool import CHANNEL_OPTIONS, GrpcChannelPool
+
+
+@pytest.fixture
+def grpc_server():
+    server = grpc.server(ThreadPoolExecutor(max_workers=1))
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    yield f'127.0.0.1:{port}'
+    server.stop(None)
+
+
+def test_channels_are_assigned_round_robin(grpc_server):
+    created = []
+
+    def create_channel():
+        created.append(grpc.insecure_channel(grpc_server, options=CHANNEL_OPTIONS))
+        return created[-1]
+
+    pool = GrpcChannelPool(create_channel, size=2)
+    assigned = [pool.next_channel() for _ in range(4)]
+
+    assert len(created) == 2
+    assert assigned == [created[0], created[1], created[0], created[1]]
+    pool.close()
+
+
+def test_warm_up_connects_all_channels(grpc_server):
+    pool = GrpcChannelPool(lambda: grpc.insecure_channel(grpc_server), size=3)
+
+    assert pool.warm_up(timeout=5) == 3
+    pool.close()
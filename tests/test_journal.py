@@ -0,0 +1,47 @@
+from services.journal_service import OperationJournal
+
+
+def test_journaled_operation_is_skipped_on_resume(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = OperationJournal(path=path)
+    journal.record('page', 'flow|page', {'text': 'hola'}, 'projects/p/pages/1')
+    journal.close()
+
+    resumed = OperationJournal(path=path, resume=True)
+    assert resumed.lookup('page', 'flow|page', {'text': 'hola'}) == 'projects/p/pages/1'
+    resumed.close()
+
+
+def test_changed_payload_is_not_skipped(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = OperationJournal(path=path)
+    journal.record('intent', 'flow.example', 'hola', 'projects/p/intents/1')
+    journal.close()
+
+    resumed = OperationJournal(path=path, resume=True)
+    assert resumed.lookup('intent', 'flow.example', 'chao') is None
+    resumed.close()
+
+
+def test_new_run_without_resume_starts_empty_journal(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = OperationJournal(path=path)
+    journal.record('flow', 'example', 'example', 'projects/p/flows/1')
+    journal.close()
+
+    new_run = OperationJournal(path=path)
+    assert new_run.lookup('flow', 'example', 'example') is None
+    new_run.close()
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    path = tmp_path / 'journal.jsonl'
+    journal = OperationJournal(path=str(path))
+    journal.record('flow', 'example', 'example', 'projects/p/flows/1')
+    journal.close()
+    with open(path, 'a') as journal_file:
+        journal_file.write('{"kind": "flow", "key": "broken"')
+
+    resumed = OperationJournal(path=str(path), resume=True)
+    assert resumed.lookup('flow', 'example', 'example') == 'projects/p/flows/1'
+    resumed.close()
@@ -0,0 +1,55 @@
+from services.validation_service import ValidationService
+from utils.partition_utils import PartitionUtils
+from utils.route_utils import RouteUtils
+
+
+def page(display_name, parent, value, is_end_flow=False):
+    group = display_name.split(' > ')[1] if ' > ' in display_name else None
+    return {'display_name': display_name, 'entry_fulfillment': display_name, 'parent': parent, 'payload_responses': [],
+            'depth': display_name.count('>'), 'is_end_flow': is_end_flow, 'entityType': 'Tipo',
+            'entityValues': [value] if value else [], 'parent_entity_type': '',
+            'route_params_entity_types': '$session.params.Tipo', 'page_group': group}
+
+
+def make_flow():
+    subpages = [page('F', None, None), page('F > Fin', 'F', 'Fin', is_end_flow=True)]
+    for name in ('A', 'B', 'C'):
+        subpages += [page(f'F > {name}', 'F', name),
+                     page(f'F > {name} > 1', f'F > {name}', '1'),
+                     page(f'F > {name} > 2', f'F > {name}', '2', is_end_flow=True)]
+    return {'display_name': 'F', 'intent': 'flow.f', 'locale': 'es', 'question': 'hola?', 'payload_responses': [],
+            'entry_fulfillment': 'Que quieres?', 'start_page_entity_types': [{'entityType': 'Tipo'}],
+            'fallback_message': 'no entendi', 'subpages': subpages}
+
+
+def test_flows_under_the_budget_are_not_split():
+    flow = make_flow()
+
+    assert PartitionUtils.measure(flow)['pages'] == 11
+    assert PartitionUtils.partition_flows([flow]) == [flow]
+
+
+def test_oversized_flows_are_split_at_page_groups():
+    flows = PartitionUtils.partition_flows([make_flow()], budget={'pages': 5})
+
+    assert [(flow['display_name'], flow.get('parent_flow')) for flow in flows] == \
+        [('F', None), ('F #2', 'F'), ('F #3', 'F')]
+    main, second, third = flows
+    assert [(item['display_name'], item.get('target_flow')) for item in main['subpages']] == [
+        ('F', None), ('F > Fin', None), ('F > A', None), ('F > A > 1', None), ('F > A > 2', None),
+        ('F > B', 'F #2'), ('F > C', 'F #3')]
+    assert [item['display_name'] for item in second['subpages']] == ['F > B', 'F > B > 1', 'F > B > 2']
+    assert [item['display_name'] for item in third['subpages']] == ['F > C', 'F > C > 1', 'F > C > 2']
+    assert all(PartitionUtils.measure(flow)['pages'] <= 5 for flow in flows)
+
+    # the start page routes to the sub flow with the condition of the page, which routes to it again
+    start_routes = RouteUtils.plan_page_routes(main['subpages'])['F']
+    assert {'condition': '$session.params.Tipo = "B"', 'target_page': None, 'fulfillment': None,
+            'target_flow': 'F #2'} in start_routes
+    assert RouteUtils.plan_page_routes(second['subpages'])['F'] == [
+        {'condition': '$session.params.Tipo = "B"', 'target_page': 'F > B', 'fulfillment': None}]
+
+    entity_types = [{'entityType': 'Tipo', 'entityValue': [{'entityValue': value} for value in
+                                                          ('A', 'B', 'C', 'Fin', '1', '2')]}]
+    intents = [{'intent': 'flow.f', 'default_training_phrase': 'hola?'}]
+    assert ValidationService(entity_types, intents, flows).validate().issues == []
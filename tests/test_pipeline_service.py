@@ -0,0 +1,118 @@
+import threading
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from clients.compact_entry import CompactEntry
+from services.fetch_service import ROOT_CONTENT_TYPES
+from services.pipeline_service import LinkResolver, PipelineService
+
+
+def entry(entry_id, content_type_id, fields):
+    return CompactEntry(id=entry_id, type='Entry', content_type_id=content_type_id, locale='es', revision=1, fields=fields)
+
+
+def make_entries():
+    link = {'sys': {'id': 'et'}}
+    return [
+        entry('f1', 'flow', {'key': 'Mi flujo', 'intent': 'flow.x.info', 'question': 'hola?',
+                             'flowEntityTypes': [link], 'startNode': {'sys': {'id': 'n1'}}}),
+        entry('et', 'entityType', {'entityType': 'tipo', 'entityValue': [{'sys': {'id': 'va'}}]}),
+        entry('f2', 'flow', {'key': 'Sin pregunta', 'intent': 'flow.y.info', 'startNode': {'sys': {'id': 'n2'}}}),
+        entry('va', 'entityValue', {'entityValue': 'Cuenta', 'synonyms': ['cuenta']}),
+        entry('n1', 'node', {'text': 'Que quieres?', 'fallbacks': [{'sys': {'id': 'fb'}}], 'entityType': link,
+                             'chips': [{'sys': {'id': 'c1'}}]}),
+        entry('fb', 'fallback', {'text': 'no entendi'}),
+        entry('c1', 'chip', {'text': 'Cuenta', 'location': {'sys': {'id': 'n2'}}, 'entityValue': {'sys': {'id': 'va'}}}),
+        entry('n2', 'node', {'text': 'fin cuenta'}),
+    ]
+
+
+class StreamingClient:
+    """Client without content type definitions: the roots are streamed, the linked entries fetched by id."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.requested_ids = []
+
+    def content_types(self):
+        return SimpleNamespace(items=[])
+
+    def iter_compact_entries(self, limit=1000, query=None):
+        return (entry for entry in self.entries if entry.content_type_id == query['content_type'])
+
+    def entries_by_ids(self, ids, limit=1000):
+        self.requested_ids.append(ids)
+        return [entry for entry in self.entries if entry.id in ids]
+
+
+def make_df_service(calls):
+    df_service = MagicMock()
+    df_service.create_entity_types.side_effect = lambda entity_types, refresh: calls.append(
+        ('entity_type', entity_types[0]['entityType'], refresh))
+    df_service.create_intents.side_effect = lambda intents: calls.append(('intent', intents[0]['intent']))
+    df_service.create_flows.side_effect = lambda flows_list: calls.append(('flow', flows_list[0]['display_name']))
+    return df_service
+
+
+def test_resolver_releases_a_root_when_its_links_are_fetched():
+    entries = {entry.id: entry for entry in make_entries()}
+    resolver = LinkResolver(ROOT_CONTENT_TYPES)
+
+    assert resolver.add(entries['f1']) == []
+    assert resolver.add(entries['et']) == []
+    assert resolver.add(entries['f2']) == []
+    assert resolver.missing_ids == {'va', 'n1', 'n2'}
+    assert resolver.add(entries['va']) == ['et']
+    assert resolver.add(entries['n2']) == ['f2']
+    for entry_id in ('n1', 'fb'):
+        assert resolver.add(entries[entry_id]) == []
+    assert resolver.add(entries['c1']) == ['f1']
+    assert resolver.missing_ids == set()
+
+
+def test_resolver_drops_the_entries_of_the_released_roots():
+    entries = {entry.id: entry for entry in make_entries()}
+    resolver = LinkResolver(ROOT_CONTENT_TYPES)
+    for entry_id in ('f1', 'et', 'f2', 'va', 'n1', 'fb', 'c1'):
+        for root_id in resolver.add(entries[entry_id]):
+            resolver.release(root_id)
+    # et is released, va is kept for f1, that waits for n2 through c1
+    assert sorted(resolver.entries) == ['c1', 'et', 'f1', 'f2', 'fb', 'n1', 'va']
+
+    assert sorted(resolver.add(entries['n2'])) == ['f1', 'f2']
+    resolver.release('f1')
+    assert sorted(resolver.entries) == ['et', 'f1', 'f2', 'n2']
+    resolver.release('f2')
+    assert sorted(resolver.entries) == ['et', 'f1', 'f2']
+
+
+def test_pipeline_deploys_each_root_once_its_entries_are_resolved():
+    calls = []
+    client = StreamingClient(make_entries())
+    cf_service = SimpleNamespace(client=client, content_types=client.content_types(),
+                                 root_content_types=ROOT_CONTENT_TYPES)
+
+    pipeline = PipelineService(cf_service, make_df_service(calls), queue_size=1, train=False)
+    stats = pipeline.run()
+
+    assert calls == [('entity_type', 'tipo', True), ('intent', 'flow.x.info'), ('flow', 'Mi flujo')]
+    # n2 is dropped once f2 is deployed, before c1 tells that f1 links to it too
+    assert client.requested_ids == [['n1', 'n2', 'va'], ['c1', 'fb'], ['n2']]
+    assert stats['fetch']['items'] == 3
+    assert (stats['compile']['items'], stats['compile']['failed']) == (2, 1)
+    assert stats['deploy']['items'] == 2
+    assert stats['compile']['max_queue'] <= 1
+
+
+def test_pipeline_stops_the_stages_when_a_deploy_fails():
+    client = StreamingClient(make_entries() * 50)
+    cf_service = SimpleNamespace(client=client, content_types=client.content_types(),
+                                 root_content_types=ROOT_CONTENT_TYPES)
+    df_service = MagicMock()
+    df_service.create_entity_types.side_effect = RuntimeError('quota')
+
+    with pytest.raises(RuntimeError):
+        PipelineService(cf_service, df_service, queue_size=1, train=False).run()
+    assert [thread.name for thread in threading.enumerate() if thread.name.startswith('pipeline-')] == []
@@ -0,0 +1,57 @@
+import json
+import os
+import time
+
+from services.profiling_service import PhaseProfiler
+
+
+def busy_compile(seconds=0.2):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+
+
+def allocate_records():
+    return [{'id': str(i), 'fields': list(range(20))} for i in range(20000)]
+
+
+def test_profile_writes_collapsed_stacks_by_phase(tmp_path):
+    profiler = PhaseProfiler(str(tmp_path), profile=True, interval=0.001)
+
+    with profiler.phase('compile'):
+        busy_compile()
+    profiler.close()
+
+    with open(tmp_path / 'compile.collapsed') as collapsed_file:
+        lines = collapsed_file.read().splitlines()
+    stack, count = lines[0].rsplit(' ', 1)
+    assert stack.startswith('MainThread;')
+    assert any('busy_compile (test_profiling_service.py:' in line for line in lines)
+    assert int(count) > 0
+    with open(tmp_path / 'summary.json') as summary_file:
+        assert json.load(summary_file)['compile']['samples'] > 0
+
+
+def test_trace_memory_writes_top_allocators_by_phase(tmp_path):
+    profiler = PhaseProfiler(str(tmp_path), trace_memory=True)
+
+    with profiler.phase('entries'):
+        records = allocate_records()
+    profiler.close()
+
+    with open(tmp_path / 'entries.memory.txt') as memory_file:
+        report = memory_file.read()
+    assert 'test_profiling_service.py' in report.split('\n\n')[1]
+    assert profiler.summary['entries']['memory_retained_bytes'] > 1024 * 1024
+    assert len(records) == 20000
+
+
+def test_disabled_profiler_writes_nothing(tmp_path):
+    profiler = PhaseProfiler(str(tmp_path / 'run'))
+
+    with profiler.phase('compile'):
+        busy_compile(0.01)
+    profiler.close()
+
+    assert not os.path.exists(tmp_path / 'run')
+    assert profiler.summary == {}
@@ -0,0 +1,50 @@
+from utils import route_utils
+from utils.route_utils import RouteUtils
+
+
+def page(display_name, parent, values, is_end_flow=False, fulfillment=None):
+    return {'display_name': display_name, 'parent': parent, 'entityValues': values, 'is_end_flow': is_end_flow,
+            'entry_fulfillment': fulfillment or display_name, 'route_params_entity_types': '$session.params.tipo'}
+
+
+def test_values_with_the_same_target_share_one_or_condition():
+    routes = RouteUtils.plan_page_routes([
+        page('F', None, []),
+        page('F > A', 'F', ['A', 'B', 'A']),
+        page('F > C', 'F', ['C'], is_end_flow=True, fulfillment='listo'),
+        page('F > D', 'F', ['D'], is_end_flow=True, fulfillment='listo'),
+    ])
+
+    assert routes == {'F': [
+        {'condition': '$session.params.tipo = "A" OR $session.params.tipo = "B"', 'target_page': 'F > A', 'fulfillment': None},
+        {'condition': '$session.params.tipo = "C" OR $session.params.tipo = "D"', 'target_page': None, 'fulfillment': 'listo'},
+    ]}
+
+
+def test_long_conditions_are_split(monkeypatch):
+    monkeypatch.setattr(route_utils, 'MAX_VALUES_PER_CONDITION', 2)
+
+    routes = RouteUtils.plan_page_routes([page('F > A', 'F', ['A', 'B', 'C'])])
+
+    assert [route['condition'] for route in routes['F']] == ['$session.params.tipo = "A" OR $session.params.tipo = "B"',
+                                                             '$session.params.tipo = "C"']
+
+
+def test_routes_repeated_on_several_pages_move_to_a_group():
+    page_routes = RouteUtils.plan_page_routes([
+        page('F > X', 'F', ['X']),
+        page('F > X > fin', 'F > X', ['A'], is_end_flow=True, fulfillment='listo'),
+        page('F > Y', 'F', ['Y']),
+        page('F > Y > fin', 'F > Y', ['A'], is_end_flow=True, fulfillment='listo'),
+        page('F > Y > otro', 'F > Y', ['B'], is_end_flow=True, fulfillment='otro'),
+    ])
+
+    remaining, groups, page_groups = RouteUtils.plan_route_groups(page_routes, flow_name='flows/1')
+
+    [(group_name, group_routes)] = groups.items()
+    assert group_routes == [{'condition': '$session.params.tipo = "A"', 'target_page': None, 'fulfillment': 'listo'}]
+    assert page_groups == {'F > X': [group_name], 'F > Y': [group_name]}
+    assert remaining['F > X'] == []
+    assert [route['fulfillment'] for route in remaining['F > Y']] == ['otro']
+    assert len(remaining['F']) == 2
+
@@ -0,0 +1,61 @@
+import copy
+
+from clients.compact_entry import CompactEntry
+from schema_flow_contentful import flow_with_chips
+from services.contentful_service import ContentfulService
+from services.validation_service import ValidationService
+from utils.schema_utils import SchemaUtils
+
+
+def make_flow(**fields):
+    return {**copy.deepcopy(flow_with_chips), 'key': 'Reclamos', 'locale': 'es', 'flowEntityTypes': [], **fields}
+
+
+class FakeClient:
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def compact_entries(self, limit=1000, query=None):
+        return self.entries
+
+
+def test_sample_flow_matches_the_schema():
+    assert SchemaUtils.flow_errors(make_flow()) == []
+    # a missing field of a dataframe record is NaN
+    assert SchemaUtils.flow_errors(make_flow(flowEntityTypes=float('nan'))) == []
+    assert SchemaUtils.flow_errors(make_flow(intent='faq.reclamos.info', startNode={'text': 'hola'})) == []
+
+
+def test_every_error_is_reported_with_its_path():
+    flow = make_flow(question=float('nan'))
+    del flow['startNode']['chips'][1]['location']['text']
+    flow['startNode']['chips'][2]['forgetParameter'] = 'no'
+    flow['startNode']['fallbacks'] = []
+    flow['startNode']['entityType'] = {'sys': {'id': 'not-found'}}
+
+    assert SchemaUtils.flow_errors(flow) == [
+        'question: expected string, got null',
+        'startNode.chips[1].location.text: is required',
+        'startNode.chips[2].forgetParameter: expected boolean, got string',
+        'startNode.fallbacks: expected at least 1 items, got 0',
+    ]
+
+
+def test_invalid_flows_are_quarantined_and_the_others_compiled():
+    def entry(entry_id, fields):
+        return CompactEntry(id=entry_id, type='Entry', content_type_id='flow', locale='es', revision=1, fields=fields)
+
+    valid = make_flow()
+    invalid = make_flow(key='Sin texto', intent='flow.sintexto.info')
+    del invalid['startNode']['chips'][0]['location']['text']
+    cf_service = ContentfulService(FakeClient([entry('valid', valid), entry('invalid', invalid)]))
+
+    assert [flow['display_name'] for flow in cf_service.flows_with_subpages] == ['Reclamos']
+    assert cf_service.intents == [{'intent': valid['intent'], 'default_training_phrase': valid['question']}]
+    assert cf_service.quarantined_flows == [{'id': 'invalid', 'key': 'Sin texto',
+                                             'errors': ['startNode.chips[0].location.text: is required']}]
+
+    report = ValidationService([], cf_service.intents, [], quarantined=cf_service.quarantined_flows).validate()
+    assert [(issue['severity'], issue['check'], issue['flow']) for issue in report.issues] == \
+        [('warning', 'flow_schema', 'Sin texto')]
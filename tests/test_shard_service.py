@@ -0,0 +1,154 @@
+import multiprocessing
+import os
+import threading
+import time
+
+from services.shard_service import ShardService
+
+
+def make_compiled(count=12):
+    flows = [{'display_name': f'flujo {i}', 'intent': f'flow.f{i}.info', 'subpages': []} for i in range(count)]
+    return {'entity_types': [{'entityType': 'tipo', 'entityValue': [{'entityValue': 'A'}]}],
+            'intents': [{'intent': flow['intent'], 'default_training_phrase': 'hola?'} for flow in flows],
+            'flows': flows, 'faqs': []}
+
+
+class FakeCX:
+    """DialogflowServiceCX of a worker that records its writes in memory."""
+
+    def __init__(self, writes, fail=()):
+        self.writes = writes
+        self.fail = fail
+        self.journal = None
+        self._lock = threading.Lock()
+
+    def _write(self, *write):
+        with self._lock:
+            self.writes.append(write)
+
+    def create_entity_types(self, entity_types):
+        self._write('entity_types', len(entity_types))
+
+    def create_intents(self, intents):
+        self._write('intents', len(intents))
+
+    def create_flows(self, flows_list, default_flow_routes):
+        for flow in flows_list:
+            if flow['display_name'] in self.fail:
+                raise RuntimeError('quota exceeded')
+            assert self.journal is not None
+            self._write('flow', flow['display_name'])
+            default_flow_routes.append({'intent': f"intents/{flow['intent']}", 'target_flow': f"flows/{flow['display_name']}"})
+
+
+def run_workers(directory, writes, count=3, fail=()):
+    threads = [threading.Thread(target=ShardService(directory, df_service_factory=lambda: FakeCX(writes, fail),
+                                                    worker_id=f'w{i}', poll_seconds=0.01).run_worker)
+               for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def worker_process(directory, worker_id):
+    ShardService(directory, df_service_factory=lambda: FakeCX([]), worker_id=worker_id, poll_seconds=0.01).run_worker()
+
+
+def test_split_by_flow_key_is_stable():
+    flows = make_compiled()['flows']
+    shards = ShardService.split(flows, 4)
+
+    assert sorted(flow['display_name'] for shard in shards for flow in shard) == sorted(f['display_name'] for f in flows)
+    assert ShardService.split(list(reversed(flows)), 4)[1] == list(reversed(shards[1]))
+    # the sub flows of a split flow are deployed by the shard of the flow
+    sub_flows = [{'display_name': f'flujo 0 #{number}', 'parent_flow': 'flujo 0'} for number in (2, 3)]
+    shard = ShardService.shard_of('flujo 0', 4)
+    assert ShardService.split(flows + sub_flows, 4)[shard] == shards[shard] + sub_flows
+
+
+def test_workers_deploy_each_flow_once_after_the_shared_resources(tmp_path):
+    writes = []
+    shard_service = ShardService(str(tmp_path), poll_seconds=0.01)
+    shard_service.prepare(make_compiled(), shard_count=4)
+
+    run_workers(str(tmp_path), writes)
+    report = shard_service.wait()
+
+    assert writes[:2] == [('entity_types', 1), ('intents', 12)]
+    assert sorted(write[1] for write in writes[2:]) == sorted(f'flujo {i}' for i in range(12))
+    assert sorted(report['flows']) == sorted(f'flujo {i}' for i in range(12))
+    assert len(report['default_flow_routes']) == 12
+    assert sorted(report['tasks']) == ['leader', 'shard-0', 'shard-1', 'shard-2', 'shard-3']
+    assert report['failed'] == report['missing'] == []
+
+
+def test_resume_only_repeats_the_failed_shards(tmp_path):
+    compiled = make_compiled()
+    shard_service = ShardService(str(tmp_path), poll_seconds=0.01)
+    shard_service.prepare(compiled, shard_count=4)
+    run_workers(str(tmp_path), [], fail=('flujo 3',))
+    report = shard_service.merge()
+    assert report['failed'] == [{'flow': 'flujo 3', 'error': 'quota exceeded'}]
+    failed_shard = f"shard-{ShardService.shard_of('flujo 3', 4)}"
+    assert report['tasks'][failed_shard]['status'] == 'failed'
+
+    writes = []
+    shard_service.prepare(compiled, shard_count=4, resume=True)
+    run_workers(str(tmp_path), writes)
+    report = shard_service.wait()
+
+    assert sorted(write[1] for write in writes) == \
+        sorted(flow['display_name'] for flow in ShardService.split(compiled['flows'], 4)[int(failed_shard[6:])])
+    assert report['failed'] == []
+    assert sorted(report['flows']) == sorted(f'flujo {i}' for i in range(12))
+
+
+def test_worker_processes_share_the_work_directory(tmp_path):
+    shard_service = ShardService(str(tmp_path), poll_seconds=0.01)
+    shard_service.prepare(make_compiled(), shard_count=3)
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=worker_process, args=(str(tmp_path), f'p{i}')) for i in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    report = shard_service.wait()
+    assert [process.exitcode for process in processes] == [0, 0]
+    assert len(report['flows']) == 12
+    assert {task['worker'] for task in report['tasks'].values()} <= {'p0', 'p1'}
+
+
+def test_lock_of_a_dead_leader_is_taken_over(tmp_path):
+    shard_service = ShardService(str(tmp_path), poll_seconds=0.01, stale_seconds=1)
+    shard_service.prepare(make_compiled(), shard_count=2)
+    # the leader claimed its task and died before its report
+    (tmp_path / 'leader.lock').write_text('dead')
+    os.utime(tmp_path / 'leader.lock', (time.time() - 5, time.time() - 5))
+
+    writes = []
+    started = time.monotonic()
+    done = ShardService(str(tmp_path), df_service_factory=lambda: FakeCX(writes), worker_id='w0', poll_seconds=0.01,
+                        stale_seconds=1).run_worker()
+
+    assert time.monotonic() - started < 5
+    assert sorted(done) == ['leader', 'shard-0', 'shard-1']
+    assert writes[:2] == [('entity_types', 1), ('intents', 12)]
+    assert shard_service.wait()['tasks']['leader']['worker'] == 'w0'
+
+
+def test_lock_with_heartbeat_is_kept(tmp_path):
+    shard_service = ShardService(str(tmp_path), poll_seconds=0.01, stale_seconds=1)
+    shard_service.prepare(make_compiled(), shard_count=2)
+    (tmp_path / 'shard-0.lock').write_text('alive')
+
+    assert not shard_service._claim('shard-0')
+    os.utime(tmp_path / 'shard-0.lock', (time.time() - 5, time.time() - 5))
+    assert shard_service._claim('shard-0')
+    assert (tmp_path / 'shard-0.lock').read_text() == shard_service.worker_id
+    # a task with report is never claimed again, even without heartbeat
+    (tmp_path / 'shard-1.lock').write_text('done')
+    os.utime(tmp_path / 'shard-1.lock', (time.time() - 5, time.time() - 5))
+    (tmp_path / 'shard-1.json').write_text('{"status": "deployed"}')
+    assert not shard_service._claim('shard-1')
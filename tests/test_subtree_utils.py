@@ -0,0 +1,107 @@
+from services.contentful_service import ContentfulService
+from services.validation_service import ValidationService
+from tests.test_dialogflow_service import make_flows_service
+from utils.route_utils import RouteUtils
+from utils.subtree_utils import SubtreeUtils
+
+
+def menu():
+    return {'text': 'Que necesitas?',
+            'entityType': {'entityType': 'Accion', 'entityValue': [{'entityValue': 'Ingresar'},
+                                                                   {'entityValue': 'Seguimiento'}]},
+            'chips': [{'text': 'Ingresar', 'entityValue': {'entityValue': 'Ingresar'},
+                       'location': {'text': 'Ingresa aqui', 'chips': [{'text': 'web', 'url': 'https://x'}]}},
+                      {'text': 'Seguimiento', 'entityValue': {'entityValue': 'Seguimiento'},
+                       'location': {'text': 'Tu caso esta en curso'}}]}
+
+
+def make_flow(key):
+    return {'key': key, 'intent': f'flow.{key.lower()}', 'question': f'{key}?', 'locale': 'es', 'flowEntityTypes': [],
+            'startNode': {'text': 'hola', 'fallbacks': [{'text': 'no entendi'}],
+                          'entityType': {'entityType': 'Tipo', 'entityValue': [{'entityValue': 'A'}, {'entityValue': 'B'}]},
+                          'chips': [{'text': 'A', 'entityValue': {'entityValue': 'A'}, 'location': menu()},
+                                    {'text': 'B', 'entityValue': {'entityValue': 'B'}, 'location': menu()}]}}
+
+
+def test_identical_sub_trees_are_compiled_once():
+    cf_service = ContentfulService(None)
+
+    first, second = cf_service.compile_flows([make_flow('F'), make_flow('G')])
+
+    # the chips of the B menu, and both menus of G, reuse the pages compiled for F, under their own names
+    assert cf_service._subtree_hits == 4
+    assert [page['display_name'] for page in second['subpages']] == \
+        [page['display_name'].replace('F', 'G', 1) for page in first['subpages']]
+    assert [(page['parent'], page['depth'], page['page_group']) for page in first['subpages'] if page['depth'] == 2] == \
+        [('F > A', 2, 'A')] * 3 + [('F > B', 2, 'B')] * 3
+
+
+def test_repeated_sub_trees_are_deployed_once_in_shared_flows():
+    flows, _ = SubtreeUtils.share_subtrees(ContentfulService(None).compile_flows([make_flow('F'), make_flow('G')]))
+
+    shared_names = [flow['display_name'] for flow in flows if flow.get('entry_page')]
+    assert len(shared_names) == 2 and all(name.startswith('shared-subtree-') for name in shared_names)
+    main = flows[0]
+    assert [(page['display_name'], page.get('target_flow')) for page in main['subpages']] == \
+        [('F', None), ('F > A', shared_names[0]), ('F > B', shared_names[1])]
+    assert [page.get('target_flow') for page in flows[1]['subpages']] == [None, *shared_names]
+
+    # the flow routes to the shared flow with the condition of the page, which routes to its copy
+    shared = flows[2]
+    condition = '$session.params.Accion = "Ingresar" OR $session.params.Accion = "Seguimiento"'
+    assert RouteUtils.plan_page_routes(main['subpages'])['F'][0] == \
+        {'condition': condition, 'target_page': None, 'fulfillment': None, 'target_flow': shared_names[0]}
+    assert RouteUtils.plan_page_routes(shared['subpages'])[shared['entry_page']] == \
+        [{'condition': condition, 'target_page': f'{shared_names[0]} > A', 'fulfillment': None}]
+
+    entity_types = [{'entityType': name, 'entityValue': [{'entityValue': value} for value in values]}
+                    for name, values in (('Tipo', ['A', 'B']), ('Accion', ['Ingresar', 'Seguimiento']))]
+    intents = [{'intent': 'flow.f', 'default_training_phrase': 'F?'}, {'intent': 'flow.g', 'default_training_phrase': 'G?'}]
+    assert ValidationService(entity_types, intents, flows).validate().errors == []
+
+
+def test_sub_trees_with_other_translations_are_not_shared():
+    flows = ContentfulService(None).compile_flows([make_flow('F'), make_flow('G')])
+    translations = {'en': {'flows': {'G': {'pages': {'G > A > Seguimiento': {'entry_fulfillment': 'In progress'}}}}}}
+
+    shared_flows, shared_translations = SubtreeUtils.share_subtrees(flows, translations)
+
+    # only the B menus have the same texts in both locales
+    assert [flow['display_name'] for flow in shared_flows if flow.get('entry_page')] == \
+        [page['target_flow'] for page in shared_flows[0]['subpages'] if page.get('target_flow')]
+    assert [page['display_name'] for page in shared_flows[0]['subpages']] == ['F', 'F > A', 'F > A > Ingresar',
+                                                                               'F > A > Ingresar', 'F > A > Seguimiento',
+                                                                               'F > B']
+    assert shared_translations == translations
+
+
+def test_sub_trees_over_the_shared_flows_cap_stay_in_their_flows():
+    flows = ContentfulService(None).compile_flows([make_flow('F'), make_flow('G')])
+
+    shared_flows, _ = SubtreeUtils.share_subtrees(flows, max_flows=1)
+
+    [shared_name] = [flow['display_name'] for flow in shared_flows if flow.get('entry_page')]
+    assert [page.get('target_flow') for page in shared_flows[0]['subpages'] if page['parent'] == 'F'] == \
+        [shared_name, None]
+    # the B menu is as big as the A one, it stays in the flow
+    assert {page['display_name'] for page in shared_flows[0]['subpages']} == \
+        {'F', 'F > A', 'F > B', 'F > B > Ingresar', 'F > B > Seguimiento'}
+
+
+def test_edited_shared_sub_tree_replaces_its_shared_flow():
+    service, remote_flows = make_flows_service(['F', 'G'])
+    flows, _ = SubtreeUtils.share_subtrees(ContentfulService(None).compile_flows([make_flow('F'), make_flow('G')]))
+    service.create_flows(flows_list=flows, default_flow_routes=[])
+    assert service.delete_unused_shared_flows(flows) == []
+    old_names = sorted(name for name in remote_flows if name.startswith('shared-subtree-'))
+
+    edited = [make_flow('F'), make_flow('G')]
+    for flow in edited:
+        flow['startNode']['chips'][0]['location']['text'] = 'Que quieres hacer?'
+    flows, _ = SubtreeUtils.share_subtrees(ContentfulService(None).compile_flows(edited))
+    service.create_flows(flows_list=flows, default_flow_routes=[])
+    deleted = service.delete_unused_shared_flows(flows)
+
+    new_names = sorted(name for name in remote_flows if name.startswith('shared-subtree-'))
+    assert len(new_names) == len(old_names) == 2
+    assert len(deleted) == 1 and deleted[0] in old_names and deleted[0] not in new_names
@@ -0,0 +1,89 @@
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from services.state_service import StateStore
+from services.training_service import TrainingServiceCX, TrainingServiceCXError
+
+
+def make_compiled(answer='fin'):
+    def flow(name):
+        return {'display_name': name, 'intent': f'flow.{name}.info', 'start_page_entity_types': [],
+                'subpages': [{'display_name': f'{name} > A', 'parent': name, 'entityType': 'tipo',
+                              'entry_fulfillment': answer}]}
+    return {'entity_types': [{'entityType': 'tipo', 'entityValue': [{'entityValue': 'A'}]}],
+            'intents': [{'intent': 'flow.a.info', 'default_training_phrase': 'a?'}],
+            'flows': [flow('a'), flow('b')], 'faqs': []}
+
+
+class FakeFlows:
+    """train_flow operations that take some time, counting the ones running at the same time.
+
+    With concurrent=n, the first n operations wait for each other on a barrier, so they only
+    finish if they run at the same time.
+    """
+
+    def __init__(self, fail=(), concurrent=None):
+        self.fail = fail
+        self.running = 0
+        self.max_running = 0
+        self.trained = []
+        self._lock = threading.Lock()
+        self._barrier = threading.Barrier(concurrent) if concurrent else None
+        self._started = 0
+
+    def train_flow(self, name):
+        def result(timeout):
+            with self._lock:
+                self.running += 1
+                self.max_running = max(self.max_running, self.running)
+                self._started += 1
+                waits = self._barrier is not None and self._started <= self._barrier.parties
+            if waits:
+                self._barrier.wait(timeout=5)
+            time.sleep(0.05)
+            with self._lock:
+                self.running -= 1
+                self.trained.append(name)
+            if name in self.fail:
+                raise RuntimeError('training failed')
+        return SimpleNamespace(result=result)
+
+
+def make_service(tmp_path, fake_flows, max_concurrent=2):
+    flow_manager = MagicMock()
+    flow_manager.parent = 'flows/default'
+    flow_manager.get_flows_by_display_name.return_value = {'a': SimpleNamespace(name='flows/a'),
+                                                           'b': SimpleNamespace(name='flows/b')}
+    flow_manager.train_flow.side_effect = fake_flows.train_flow
+    return TrainingServiceCX(SimpleNamespace(flow_manager=flow_manager),
+                             state=StateStore(str(tmp_path / 'trained.json')), max_concurrent=max_concurrent)
+
+
+def test_changed_flows_are_trained_concurrently_and_unchanged_ones_skipped(tmp_path):
+    fake_flows = FakeFlows(concurrent=2)
+    report = make_service(tmp_path, fake_flows).train_changed(make_compiled())
+
+    assert sorted(fake_flows.trained) == ['flows/a', 'flows/b', 'flows/default']
+    assert fake_flows.max_running == 2
+    assert {result['status'] for result in report.values()} == {'trained'}
+    assert all(result['seconds'] >= 0.05 for result in report.values())
+
+    fake_flows = FakeFlows()
+    report = make_service(tmp_path, fake_flows).train_changed(make_compiled(answer='otro fin'))
+    assert sorted(fake_flows.trained) == ['flows/a', 'flows/b']
+    assert report['Default Start Flow'] == {'status': 'unchanged'}
+
+
+def test_failed_trainings_are_retried_on_the_next_run(tmp_path):
+    report = make_service(tmp_path, FakeFlows(fail=('flows/a',))).train_changed(make_compiled())
+    assert report['a']['status'] == 'failed' and report['b']['status'] == 'trained'
+    with pytest.raises(TrainingServiceCXError, match=r'1 flows could not be trained \(a\)'):
+        TrainingServiceCX.raise_for_failures(report)
+
+    fake_flows = FakeFlows()
+    make_service(tmp_path, fake_flows).train_changed(make_compiled())
+    assert fake_flows.trained == ['flows/a']
@@ -0,0 +1,109 @@
+import json
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from google.cloud import dialogflowcx_v3beta1 as dialogflowcx
+
+from clients.entry_store_client import EntryStoreClient
+from services.contentful_service import ContentfulService
+from services.translation_service import TranslationServiceCX
+
+
+def entry(entry_id, content_type, fields):
+    return {'sys': {'id': entry_id, 'contentType': {'sys': {'id': content_type}}}, 'fields': fields}
+
+
+def make_service(tmp_path):
+    """ContentfulService over an entry store fetched with the locales es and en."""
+    link = {'sys': {'id': 'et'}}
+    entries = [
+        entry('et', 'entityType', {'entityType': {'es': 'tipo'},
+                                   'entityValue': {'es': [{'sys': {'id': 'va'}}]}}),
+        entry('va', 'entityValue', {'entityValue': {'es': 'Cuenta', 'en': 'Account'},
+                                    'synonyms': {'es': ['cuenta'], 'en': ['account', 'acct']}}),
+        entry('f1', 'flow', {'key': {'es': 'Mi flujo'}, 'intent': {'es': 'flow.x.info'},
+                             'question': {'es': 'hola?', 'en': 'hello?'},
+                             'flowEntityTypes': {'es': [link]},
+                             'startNode': {'es': {'sys': {'id': 'n1'}}}}),
+        entry('n1', 'node', {'text': {'es': 'Que quieres?', 'en': 'What do you want?'},
+                             'fallbacks': {'es': [{'sys': {'id': 'fb'}}]},
+                             'entityType': {'es': link},
+                             'chips': {'es': [{'sys': {'id': 'c1'}}]}}),
+        entry('fb', 'fallback', {'text': {'es': 'no entendi', 'en': 'sorry?'}}),
+        entry('c1', 'chip', {'text': {'es': 'Cuenta', 'en': 'Account'}, 'location': {'es': {'sys': {'id': 'n2'}}},
+                             'entityValue': {'es': {'sys': {'id': 'va'}}}}),
+        entry('n2', 'node', {'text': {'es': 'fin cuenta', 'en': 'account end'}}),
+        entry('f2', 'flow', {'key': {'es': 'faq horario'}, 'intent': {'es': 'faq.horario.info'},
+                             'question': {'es': 'horario?', 'en': 'opening hours?'},
+                             'startNode': {'es': {'sys': {'id': 'n3'}}}}),
+        entry('n3', 'node', {'text': {'es': 'de 9 a 18', 'en': 'from 9 to 6'}}),
+    ]
+    with open(tmp_path / 'entries.json', 'w') as store_file:
+        json.dump({'content_types': [], 'entries': entries, 'locales': ['es', 'en']}, store_file)
+    return ContentfulService(EntryStoreClient(str(tmp_path / 'entries.json')))
+
+
+def test_compile_translations_keyed_by_the_default_locale(tmp_path):
+    cf_service = make_service(tmp_path)
+
+    assert cf_service.is_multi_locale
+    assert [flow['display_name'] for flow in cf_service.flows_with_subpages] == ['Mi flujo']
+    translations = cf_service.compile_translations('en')
+
+    assert translations['entity_types'] == {'tipo': [{'value': 'Cuenta', 'synonyms': ['account', 'acct']}]}
+    assert translations['intents'] == {'flow.x.info': 'hello?', 'faq.horario.info': 'opening hours?'}
+    assert translations['faqs']['faq.horario.info']['entry_fulfillment'] == 'from 9 to 6'
+    flow = translations['flows']['Mi flujo']
+    assert (flow['entry_fulfillment'], flow['fallback_message']) == ('What do you want?', 'sorry?')
+    assert flow['pages']['Mi flujo > Cuenta']['entry_fulfillment'] == 'account end'
+
+
+def test_translations_are_language_updates_of_the_default_resources(tmp_path):
+    cf_service = make_service(tmp_path)
+    compiled = {'flows': cf_service.flows_with_subpages, 'faqs': cf_service.faqs,
+                'translations': {'en-US': cf_service.compile_translations('en')}}
+
+    route = dialogflowcx.TransitionRoute(condition='$session.params.tipo = "Cuenta"', trigger_fulfillment=dialogflowcx.Fulfillment(
+        messages=[dialogflowcx.ResponseMessage(text=dialogflowcx.ResponseMessage.Text(text=['fin cuenta']))]))
+    entity_type = dialogflowcx.EntityType(name='et/tipo', display_name='tipo', kind=dialogflowcx.EntityType.Kind.KIND_MAP,
+                                          entities=[dialogflowcx.EntityType.Entity(value='Cuenta', synonyms=['cuenta'])])
+    # an entity type whose name starts like the parts of tipo, that this run didn't compile
+    partner = dialogflowcx.EntityType(name='et/tipo-partner', display_name='tipo-partner',
+                                      kind=dialogflowcx.EntityType.Kind.KIND_MAP)
+    entity_type_manager = MagicMock()
+    entity_type_manager.get_entity_types_by_display_name.return_value = {'tipo': entity_type, 'tipo-partner': partner}
+    entity_type_manager.get_entity_type_by_display_name.return_value = entity_type
+    intent_manager = MagicMock()
+    intent_manager.get_intents_by_display_name.return_value = {
+        name: dialogflowcx.Intent(name=f'intents/{name}', display_name=name) for name in ('flow.x.info', 'faq.horario.info')}
+    flow_manager = MagicMock()
+    flow_manager.parent = 'flows/default'
+    flow_manager.get_flows_by_display_name.return_value = {'Mi flujo': dialogflowcx.Flow(name='flows/f1')}
+    pages_manager = MagicMock()
+    pages_manager.get_pages_by_display_name.return_value = {
+        'Mi flujo': dialogflowcx.Page(name='pages/start', display_name='Mi flujo', transition_routes=[route]),
+        'Mi flujo > Cuenta': dialogflowcx.Page(name='pages/cuenta', display_name='Mi flujo > Cuenta')}
+    route_manager = MagicMock()
+    route_manager.get_route_groups_by_display_name.side_effect = lambda parent_flow: {
+        'faq-routes-1-0': dialogflowcx.TransitionRouteGroup(name=f'{parent_flow}/groups/faq')} \
+        if parent_flow == 'flows/default' else {}
+    df_service = SimpleNamespace(entity_type_manager=entity_type_manager, intent_manager=intent_manager,
+                                 flow_manager=flow_manager, pages_manager=pages_manager,
+                                 transition_route_manager=route_manager, journal=None)
+
+    stats = TranslationServiceCX(df_service, language_codes={'en-US': 'en'}).sync(compiled)
+
+    assert stats == {'written': 6, 'unchanged': 0, 'missing': 0, 'failed': 0}
+    assert entity_type_manager.update_entity_type.call_count == 1
+    (_, entities), kwargs = entity_type_manager.update_entity_type.call_args
+    assert [list(entity.synonyms) for entity in entities] == [['account', 'acct']] and kwargs['language_code'] == 'en'
+    intent_manager.update_intent_language.assert_any_call('intents/flow.x.info', 'hello?', 'en')
+    start_page = next(call.args[0] for call in pages_manager.update_page_language.call_args_list
+                      if call.args[0].name == 'pages/start')
+    # same routes as the default language, with the texts of the language
+    assert start_page.transition_routes[0].condition == route.condition
+    assert list(start_page.transition_routes[0].trigger_fulfillment.messages[0].text.text) == ['account end']
+    assert list(start_page.event_handlers[0].trigger_fulfillment.messages[0].text.text) == ['sorry?']
+    faq_group, language_code = route_manager.update_route_group_language.call_args.args
+    assert language_code == 'en'
+    assert list(faq_group.transition_routes[0].trigger_fulfillment.messages[0].text.text) == ['from 9 to 6']
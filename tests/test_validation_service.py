@@ -0,0 +1,89 @@
+import time
+
+from services.validation_service import ValidationService
+
+
+def page(display_name, parent, entity_type='', entity_values=(), is_end_flow=False):
+    return {'display_name': display_name, 'entry_fulfillment': display_name, 'parent': parent, 'payload_responses': [],
+            'depth': display_name.count('>'), 'is_end_flow': is_end_flow, 'entityType': entity_type,
+            'entityValues': list(entity_values), 'parent_entity_type': '',
+            'route_params_entity_types': f'$session.params.{entity_type}' if entity_type else '', 'page_group': None}
+
+
+def flow(display_name, intent, subpages, start_page_entity_types=()):
+    return {'display_name': display_name, 'intent': intent, 'locale': 'es', 'question': 'hola?',
+            'payload_responses': [], 'entry_fulfillment': 'Que quieres?',
+            'start_page_entity_types': [{'entityType': name} for name in start_page_entity_types],
+            'fallback_message': 'no entendi', 'subpages': [page(display_name, None)] + subpages}
+
+
+def validate(flows, entity_types=('Tipo-tarjeta',), **limits):
+    entity_types = [{'entityType': name, 'entityValue': [{'entityValue': 'A'}, {'entityValue': 'B'}]}
+                    for name in entity_types]
+    intents = [{'intent': item['intent'], 'default_training_phrase': item['question']} for item in flows]
+    return ValidationService(entity_types, intents, flows, limits=limits).validate()
+
+
+def checks(report):
+    return sorted((issue['check'], issue['page']) for issue in report.issues)
+
+
+def test_valid_flow_has_no_issues():
+    report = validate([flow('Tarjetas', 'flow.tarjetas', [
+        page('Tarjetas > A', 'Tarjetas', 'Tipo-tarjeta', ['A']),
+        page('Tarjetas > B', 'Tarjetas', 'Tipo-tarjeta', ['B'], is_end_flow=True),
+    ], start_page_entity_types=['Tipo tarjeta'])])
+
+    assert report.is_valid
+    assert report.issues == []
+
+
+def test_reference_errors():
+    report = validate([flow('Tarjetas', 'flow.tarjetas', [
+        # the compiler removes the spaces, but the entity type is written as Tipo-tarjeta
+        page('Tarjetas > A', 'Tarjetas', 'Tipotarjeta', ['A']),
+        page('Tarjetas > X > C', 'Tarjetas > X', 'Tipo-tarjeta', ['A']),
+    ])])
+
+    assert not report.is_valid
+    assert checks(report) == [('missing_entity_type', 'Tarjetas > A'), ('missing_parent_page', 'Tarjetas > X > C')]
+
+
+def test_name_collisions_and_duplicate_intents():
+    report = validate([flow('Tarjetas', 'flow.tarjetas', [], start_page_entity_types=['Tipo tarjeta', 'Tipo-tarjeta']),
+                       flow('Tarjetas', 'flow.tarjetas', [])],
+                      entity_types=('Tipo tarjeta', 'Tipo-tarjeta'))
+
+    assert [issue['check'] for issue in report.errors] == ['name_collision', 'name_collision', 'name_collision',
+                                                           'duplicate_intent_route']
+
+
+def test_route_problems_and_cycles():
+    report = validate([flow('F', 'flow.f', [
+        page('F > A', 'F > B', 'Tipo-tarjeta', ['A']),
+        page('F > B', 'F > A', 'Tipo-tarjeta', ['B']),
+        page('F > C', 'F', '', ['A']),
+        page('F > D', 'F', 'Tipo-tarjeta', []),
+    ])])
+
+    assert checks(report) == [('route_condition', 'F > C'), ('route_cycle', 'F > B'), ('unreachable_page', 'F > D')]
+    assert report.errors[-1]['message'] == 'F > B -> F > A -> F > B'
+
+
+def test_limits():
+    subpages = [page(f'F > {i}', 'F', 'Tipo-tarjeta', [str(i)]) for i in range(5)]
+
+    report = validate([flow('F', 'flow.f', subpages)], pages_per_flow=4, routes_per_page=4)
+
+    assert [issue['message'] for issue in report.errors] == ['5 routes, the limit is 4', '6 pages, the limit is 4']
+
+
+def test_validation_is_fast():
+    flows = [flow(f'F{i}', f'flow.f{i}', [page(f'F{i} > {j}', f'F{i}', 'Tipo-tarjeta', ['A', 'B']) for j in range(200)])
+             for i in range(50)]
+
+    start = time.perf_counter()
+    report = validate(flows, pages_per_flow=1000)
+
+    assert report.is_valid
+    assert time.perf_counter() - start < 1
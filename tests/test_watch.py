@@ -0,0 +1,94 @@
+import threading
+from unittest.mock import Mock
+
+from clients.compact_entry import CompactEntry
+from scripts.replay_webhooks import send_webhook
+from services.contentful_service import ContentfulService
+from services.watch_service import ChangeBuffer, WatchService
+from tests.test_dialogflow_service import make_flows_service
+
+
+def make_entry(entry_id, content_type, fields):
+    return CompactEntry(id=entry_id, type='Entry', content_type_id=content_type, locale='es', revision=1, fields=fields)
+
+
+class FakeContentfulClient:
+
+    def __init__(self, entries):
+        self.store = {entry.id: entry for entry in entries}
+
+    def compact_entries(self, limit=1000, query=None):
+        return list(self.store.values())
+
+    def entries_by_ids(self, ids, limit=1000):
+        return [self.store[entry_id] for entry_id in ids if entry_id in self.store]
+
+
+def build_service():
+    fallbacks = [{'text': 'no entendi'}]
+    message = make_entry('message', 'message', {'text': 'hola', 'fallbacks': fallbacks})
+    flow_a = make_entry('flow_a', 'flow', {'key': 'a', 'intent': 'flow.a', 'question': 'a?', 'flowEntityTypes': [],
+                                           'startNode': {'sys': {'id': 'message'}}})
+    flow_b = make_entry('flow_b', 'flow', {'key': 'b', 'intent': 'flow.b', 'question': 'b?', 'flowEntityTypes': [],
+                                           'startNode': {'text': 'chao', 'fallbacks': fallbacks}})
+    client = FakeContentfulClient([message, flow_a, flow_b])
+    return client, ContentfulService(client)
+
+
+def test_change_buffer_coalesces_changes_by_entry():
+    applied = []
+    done = threading.Event()
+    change_buffer = ChangeBuffer(lambda changes: (applied.append(changes), done.set()), debounce_seconds=0.05)
+    change_buffer.add('id1', 'publish')
+    change_buffer.add('id2', 'publish')
+    change_buffer.add('id1', 'delete')
+    assert done.wait(2)
+    assert applied == [{'id1': 'delete', 'id2': 'publish'}]
+
+
+def test_linked_entry_change_affects_only_its_flows():
+    client, cf_service = build_service()
+    cf_service.data_ready_to_use
+    client.store['message'].fields = {'text': 'buenos dias', 'fallbacks': [{'text': 'no entendi'}]}
+
+    affected_ids = cf_service.apply_entry_changes(['message'], [])
+
+    assert affected_ids == {'message', 'flow_a'}
+    flow_a = next(flow for flow in cf_service.flows if flow['id'] == 'flow_a')
+    assert flow_a['startNode']['text'] == 'buenos dias'
+
+
+def test_webhooks_redeploy_only_affected_flows():
+    client, cf_service = build_service()
+    cf_service.data_ready_to_use
+    cf_service.compile_flows = Mock(side_effect=lambda flows: [{**flow, 'display_name': flow['key'], 'subpages': []}
+                                                               for flow in flows])
+    df_service = Mock()
+    watch_service = WatchService(cf_service, df_service, port=0, debounce_seconds=60)
+    server_thread = threading.Thread(target=watch_service.serve_forever, daemon=True)
+    server_thread.start()
+    assert watch_service.ready.wait(5)
+    url = f'http://127.0.0.1:{watch_service._server.server_address[1]}'
+
+    status, _ = send_webhook(url, 'ContentManagement.Entry.publish', {'sys': {'id': 'message'}})
+    assert status == 202
+    status, _ = send_webhook(url, 'ContentManagement.Asset.publish', {'sys': {'id': 'asset'}})
+    assert status == 200
+    watch_service.shutdown()
+
+    deployed_flows = df_service.create_flows.call_args.kwargs['flows_list']
+    assert [flow['id'] for flow in deployed_flows] == ['flow_a']
+    # the intent comes from the flow entry, which didn't change
+    df_service.create_intents.assert_not_called()
+    df_service.create_entity_types.assert_not_called()
+
+
+def test_deleted_flow_entry_deletes_the_flow_and_its_sub_flows():
+    _, cf_service = build_service()
+    cf_service.data_ready_to_use
+    df_service, flows = make_flows_service(['a', 'b', 'b #2', 'b #3'])
+
+    stats = WatchService(cf_service, df_service, port=0).apply_changes({'flow_b': 'delete'})
+
+    assert stats['deleted_flows'] == 1
+    assert sorted(flows) == ['a']
@@ -1,5 +1,4 @@
 from loggers.logger import get_logger
-import pandas as pd
 
 
 info_logger = get_logger("info")
@@ -32,6 +31,8 @@ class ContentfulUtils:
        
     @staticmethod
     def build_pandas_dataframes_for_all_content_types_with_related_entry_values(data: list[dict]) -> dict:
+            import pandas as pd  # imported here, pandas is slow to import and only needed to build dataframes
+
             dataframes = {}
             info_logger.info("creating dataframes with all content")
             for key, dataset in data.items():
@@ -41,6 +42,8 @@ class ContentfulUtils:
 
     @staticmethod
     def export_dict_content_types_with_related_entry_dataframe_to_excel(dataframes: dict):
+            import pandas as pd
+
             info_logger.info("Exporting dataframes to excel")
             try:
                 with pd.ExcelWriter('output.xlsx') as writer:
@@ -0,0 +1,82 @@
+import hashlib
+import re
+
+
+# entities of one entity type and bytes of one create or update request, bigger types are split in sub types
+MAX_ENTITIES_PER_TYPE = 30000
+MAX_ENTITY_TYPE_BYTES = 4 * 1024 * 1024
+
+
+class EntityUtils:
+    """Normalize and split the entity values of an entity type, without dependencies on the dialogflow libraries.
+
+    An entity is a dict with value and synonyms, the shape written by EntityTypeManager.
+    """
+
+    @staticmethod
+    def normalize_text(text) -> str:
+        return re.sub(r'\s+', ' ', str(text)).strip()
+
+    @staticmethod
+    def normalize_entities(entities_with_synonyms: list[dict]) -> list[dict]:
+        """Trim the values and synonyms, drop the empty ones and merge the duplicates.
+
+        Values are compared as written, synonyms ignoring case. A value repeated in the list keeps
+        its first position and gets the synonyms of all its entries. Without synonyms, the value is
+        its own synonym.
+
+        Args:
+            entities_with_synonyms (list[dict]): contentful entity values, with entityValue and optional synonyms.
+
+        Returns:
+            list[dict]: entities with value and synonyms.
+        """
+        entities = {}
+        for entity in entities_with_synonyms:
+            value = EntityUtils.normalize_text(entity['entityValue'])
+            if not value:
+                continue
+            synonyms = entity.get('synonyms')
+            synonyms = synonyms if isinstance(synonyms, list) and synonyms else [value]
+            merged = entities.setdefault(value, {})
+            for synonym in map(EntityUtils.normalize_text, synonyms):
+                if synonym:
+                    merged.setdefault(synonym.casefold(), synonym)
+        return [{'value': value, 'synonyms': list(synonyms.values())} for value, synonyms in entities.items()]
+
+    @staticmethod
+    def entity_size(entity: dict) -> int:
+        """Approximate bytes of an entity in a request."""
+        return len(entity['value'].encode('utf-8')) + sum(len(synonym.encode('utf-8')) + 4 for synonym in entity['synonyms']) + 8
+
+    @staticmethod
+    def split_entities(entities: list[dict], max_entities: int = MAX_ENTITIES_PER_TYPE,
+                       max_bytes: int = MAX_ENTITY_TYPE_BYTES) -> list[list[dict]]:
+        """Split the entities in the fewest chunks, a power of two, that fit in the limits.
+
+        The chunk of an entity depends only on its value and the number of chunks, so a change of
+        the catalog only changes the chunks of the changed values.
+
+        Returns:
+            list[list[dict]]: one chunk when the entities fit in one entity type.
+        """
+        chunk_count = 1
+        while True:
+            chunks = [[] for _ in range(chunk_count)]
+            sizes = [0] * chunk_count
+            for entity in entities:
+                index = 0 if chunk_count == 1 else \
+                    int(hashlib.sha1(entity['value'].encode('utf-8')).hexdigest(), 16) % chunk_count
+                chunks[index].append(entity)
+                sizes[index] += EntityUtils.entity_size(entity)
+            if all(len(chunk) <= max_entities and size <= max_bytes for chunk, size in zip(chunks, sizes)) \
+                    or chunk_count >= len(entities):
+                return chunks
+            chunk_count *= 2
+
+    @staticmethod
+    def same_entities(entities: list[dict], other_entities: list[dict]) -> bool:
+        """True when both lists have the same values with the same synonyms, in any order."""
+        def as_set(items):
+            return {(entity['value'], frozenset(entity['synonyms'])) for entity in items}
+        return len(entities) == len(other_entities) and as_set(entities) == as_set(other_entities)
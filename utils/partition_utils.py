@@ -0,0 +1,128 @@
+import json
+
+from loggers.logger import get_logger
+from utils.route_utils import RouteUtils
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+# size of a compiled flow above which it is split in sub flows, it can be changed with the --max-flow-* options
+FLOW_BUDGET = {
+    'pages': 200,
+    'routes': 2000,
+    'bytes': 2 * 1024 * 1024,
+}
+
+
+class PartitionUtils:
+    """Split the compiled flows over a budget of pages, routes and bytes in linked sub flows.
+
+    A flow is split at its page groups: the branch of each chip of the start page (page_group) is
+    moved whole, so no route crosses two sub flows except the one from the start page. The start
+    page and the groups that fit in the budget stay in the flow, the other groups are packed in
+    order in sub flows named '<flow> #2', '<flow> #3'... Each sub flow has parent_flow and entry_page
+    (the parent of its first pages, the start page of the flow), and the flow keeps a copy of the first
+    page of each moved group with target_flow, so its route from the start page enters the sub flow,
+    where the same condition leads to the page (the session parameters are kept between flows). A
+    group bigger than the budget is moved alone, it is not split further.
+    """
+
+    @staticmethod
+    def measure(flow: dict) -> dict:
+        """Pages, routes and json bytes of a compiled flow."""
+        return PartitionUtils._measure_pages(flow['subpages'])
+
+    @staticmethod
+    def partition_flows(flows: list[dict], budget: dict = None) -> list[dict]:
+        """The compiled flows, with the ones over the budget replaced by the flow and its sub flows.
+
+        Args:
+            flows (list[dict]): compiled flows, like ContentfulService.flows_with_subpages.
+            budget (dict, optional): limits that replace the ones in FLOW_BUDGET.
+        """
+        budget = {**FLOW_BUDGET, **(budget or {})}
+        partitioned = []
+        for flow in flows:
+            partitioned.extend(PartitionUtils.partition_flow(flow, budget))
+        return partitioned
+
+    @staticmethod
+    def partition_flow(flow: dict, budget: dict = None) -> list[dict]:
+        budget = {**FLOW_BUDGET, **(budget or {})}
+        size = PartitionUtils.measure(flow)
+        if PartitionUtils._fits(size, budget):
+            return [flow]
+        groups = PartitionUtils._page_groups(flow)
+        if not groups:
+            error_logger.warning(f"Flow {flow['display_name']} is over the budget ({size}) but has no page group to move")
+            return [flow]
+
+        moved_names = {page['display_name'] for pages in groups.values() for page in pages}
+        kept_pages = [page for page in flow['subpages'] if page['display_name'] not in moved_names]
+        kept_size = PartitionUtils._measure_pages(kept_pages)
+        parts = []
+        for pages in groups.values():
+            group_size = PartitionUtils._measure_pages(pages)
+            if not parts and PartitionUtils._fits(PartitionUtils._add(kept_size, group_size), budget):
+                kept_pages.extend(pages)
+                kept_size = PartitionUtils._add(kept_size, group_size)
+            elif parts and PartitionUtils._fits(PartitionUtils._add(parts[-1][1], group_size), budget):
+                parts[-1][0].extend(pages)
+                parts[-1][1] = PartitionUtils._add(parts[-1][1], group_size)
+            else:
+                parts.append([list(pages), group_size])
+        if not parts:
+            return [flow]
+
+        sub_flows = []
+        link_pages = []
+        for number, (pages, _) in enumerate(parts, start=2):
+            display_name = f"{flow['display_name']} #{number}"
+            sub_flows.append({'display_name': display_name, 'parent_flow': flow['display_name'],
+                              'entry_page': flow['display_name'], 'intent': flow['intent'],
+                              'locale': flow.get('locale'), 'subpages': pages})
+            link_pages.extend({**page, 'target_flow': display_name} for page in pages
+                              if page['parent'] == flow['display_name'])
+        info_logger.info(f"Flow {flow['display_name']} ({size}) split in {len(sub_flows)} sub flows")
+        return [{**flow, 'subpages': kept_pages + link_pages}] + sub_flows
+
+    @staticmethod
+    def partition_translations(translations: dict, flows: list[dict]) -> dict:
+        """Copy the page translations of the split flows to the sub flows that have the pages now."""
+        flow_translations = dict(translations.get('flows', {}))
+        for flow in flows:
+            translation = flow_translations.get(flow.get('parent_flow'))
+            if translation is None or 'pages' not in translation:
+                continue
+            names = {page['display_name'] for page in flow['subpages']}
+            flow_translations[flow['display_name']] = {'pages': {name: page for name, page in translation['pages'].items()
+                                                                 if name in names}}
+        return {**translations, 'flows': flow_translations}
+
+    @staticmethod
+    def _page_groups(flow):
+        """page_group -> pages of the branches of the start page that can be moved, in the order of the pages."""
+        groups = {}
+        for page in flow['subpages']:
+            if page['parent'] is not None and page.get('page_group') and not page.get('target_flow'):
+                groups.setdefault(page['page_group'], []).append(page)
+        # an end page of the start page is answered by its route, it has no branch to move
+        return {name: pages for name, pages in groups.items()
+                if any(page['parent'] == flow['display_name'] and not page['is_end_flow'] for page in pages)}
+
+    @staticmethod
+    def _measure_pages(pages):
+        return {'pages': len({page['display_name'] for page in pages if not page.get('target_flow')}),
+                'routes': sum(len(routes) for routes in RouteUtils.plan_page_routes(pages).values()),
+                'bytes': len(json.dumps(pages, ensure_ascii=False, default=str).encode('utf-8'))}
+
+    @staticmethod
+    def _add(size, other):
+        return {key: size[key] + other[key] for key in size}
+
+    @staticmethod
+    def _fits(size, budget):
+        return all(size[key] <= budget[key] for key in size)
@@ -0,0 +1,108 @@
+import hashlib
+
+
+# values joined in one OR condition, longer conditions are split in several routes
+MAX_VALUES_PER_CONDITION = 20
+# display name prefix of the transition route groups written by plan_route_groups
+SHARED_ROUTES_PREFIX = 'shared-routes-'
+
+
+class RouteUtils:
+    """Plan the conditional routes of the compiled sub pages, without dependencies on the dialogflow libraries.
+
+    A route is a dict with condition, target_page (display name of the page, or None) and fulfillment
+    (text, or None), and target_flow (display name of a flow) when the target page was moved to a sub flow
+    by PartitionUtils or to a shared flow by SubtreeUtils. The entity values of a sub page that lead to the
+    same target are merged in one OR condition, and the routes repeated on several pages of a flow are
+    moved to a transition route group.
+    """
+
+    @staticmethod
+    def build_condition(parameter: str, values: list) -> str:
+        """$session.params.tipo = "A" OR $session.params.tipo = "B" """
+        return ' OR '.join(f'{parameter} = "{value}"' for value in values)
+
+    @staticmethod
+    def plan_page_routes(sub_pages: list[dict]) -> dict:
+        """Routes of each parent page, as written by DialogflowServiceCX.create_subpages_in_flow.
+
+        Args:
+            sub_pages (list[dict]): sub pages of a compiled flow.
+
+        Returns:
+            dict: parent page display name -> list of routes, in the order of the sub pages.
+        """
+        # parent -> (parameter, target, fulfillment, target flow) -> values
+        values_by_route = {}
+        for sub_page in sub_pages:
+            if sub_page['parent'] is None:
+                continue
+            if sub_page['is_end_flow']:
+                # the route writes the fulfillment of the end page and stays in the parent page
+                key = (sub_page['route_params_entity_types'], None, sub_page['entry_fulfillment'], None)
+            elif sub_page.get('target_flow'):
+                # the page is in a sub flow, the route enters that flow
+                key = (sub_page['route_params_entity_types'], None, None, sub_page['target_flow'])
+            else:
+                key = (sub_page['route_params_entity_types'], sub_page['display_name'], None, None)
+            values = values_by_route.setdefault(sub_page['parent'], {}).setdefault(key, [])
+            values.extend(value for value in sub_page['entityValues'] if value not in values)
+
+        page_routes = {}
+        for parent, routes in values_by_route.items():
+            for (parameter, target_page, fulfillment, target_flow), values in routes.items():
+                for start in range(0, len(values), MAX_VALUES_PER_CONDITION):
+                    route = {'condition': RouteUtils.build_condition(parameter, values[start:start + MAX_VALUES_PER_CONDITION]),
+                             'target_page': target_page,
+                             'fulfillment': fulfillment}
+                    if target_flow:
+                        route['target_flow'] = target_flow
+                    page_routes.setdefault(parent, []).append(route)
+        return page_routes
+
+    @staticmethod
+    def plan_route_groups(page_routes: dict, flow_name: str, min_pages: int = 2) -> tuple:
+        """Move the routes repeated on min_pages or more pages to flow level transition route groups.
+
+        Routes shared by the same set of pages go to the same group, so each page references
+        its groups instead of a copy of their routes.
+
+        Args:
+            page_routes (dict): output of plan_page_routes.
+            flow_name (str): name of the flow, used to name the groups.
+            min_pages (int, optional): pages that must repeat a route to move it to a group. Defaults to 2.
+
+        Returns:
+            tuple: (page_routes without the grouped routes, group display name -> routes,
+                    page display name -> group display names)
+        """
+        pages_by_route = {}
+        for parent, routes in page_routes.items():
+            for route in routes:
+                pages_by_route.setdefault(RouteUtils._route_key(route), []).append(parent)
+
+        routes_by_pages = {}
+        for key, pages in pages_by_route.items():
+            if len(pages) >= min_pages:
+                routes_by_pages.setdefault(tuple(pages), []).append(key)
+
+        groups = {}
+        page_groups = {}
+        grouped_keys = set()
+        for pages, keys in routes_by_pages.items():
+            digest = hashlib.sha1(repr((flow_name, keys)).encode('utf-8')).hexdigest()[:10]
+            display_name = f'{SHARED_ROUTES_PREFIX}{digest}'
+            groups[display_name] = [dict(zip(('condition', 'target_page', 'fulfillment', 'target_flow'), key))
+                                    for key in keys]
+            grouped_keys.update(keys)
+            for page in pages:
+                page_groups.setdefault(page, []).append(display_name)
+
+        remaining = {parent: [route for route in routes if RouteUtils._route_key(route) not in grouped_keys]
+                     for parent, routes in page_routes.items()}
+        return remaining, groups, page_groups
+
+    @staticmethod
+    def _route_key(route):
+        key = route['condition'], route['target_page'], route['fulfillment']
+        return key + (route['target_flow'],) if route.get('target_flow') else key
@@ -0,0 +1,254 @@
+import math
+
+from loggers.logger import get_logger
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+# Shapes of the flow records read by ContentfulService.compile_flows and compile_faqs, once their links are
+# resolved (see the samples in schema_flow_contentful.py). Only the fields the compiler reads are described,
+# the entries can have other fields.
+FLOW_DEFINITIONS = {
+    # a link to an entry that is not in the store, or inside a field that is not resolved, is left as it is
+    'link': {
+        'type': 'object',
+        'required': ['sys'],
+        'properties': {'sys': {'type': 'object', 'required': ['id']}},
+    },
+    'entityValue': {
+        'type': 'object',
+        'required': ['entityValue'],
+        'properties': {
+            'entityValue': {'type': 'string', 'minLength': 1},
+            'synonyms': {'type': 'array', 'items': {'type': 'string'}},
+        },
+    },
+    'entityType': {
+        'type': 'object',
+        'required': ['entityType', 'entityValue'],
+        'properties': {
+            'entityType': {'type': 'string', 'minLength': 1},
+            'entityValue': {'type': 'array', 'items': {'$ref': '#/definitions/entityValue'}},
+        },
+    },
+    'option': {
+        'type': 'object',
+        'required': ['text'],
+        'properties': {'text': {'type': 'string'}, 'url': {'type': 'string'}},
+    },
+    'fallback': {
+        'type': 'object',
+        'required': ['text'],
+        'properties': {'text': {'type': 'string'}},
+    },
+    'chip': {
+        'type': 'object',
+        'required': ['text'],
+        'properties': {
+            'text': {'type': 'string', 'minLength': 1},
+            'location': {'$ref': '#/definitions/node'},
+            'url': {'type': 'string'},
+            'entityValue': {'$ref': '#/definitions/entityValue'},
+            'forgetParameter': {'type': 'boolean'},
+        },
+    },
+    'node': {
+        'type': 'object',
+        'required': ['text'],
+        'properties': {
+            'text': {'type': 'string'},
+            'entityType': {'anyOf': [{'$ref': '#/definitions/entityType'}, {'$ref': '#/definitions/link'}]},
+            'chips': {'type': 'array',
+                      'items': {'anyOf': [{'$ref': '#/definitions/chip'}, {'$ref': '#/definitions/link'}]}},
+            'buttons': {'type': 'array', 'items': {'$ref': '#/definitions/option'}},
+            'list': {'type': 'array', 'items': {'$ref': '#/definitions/option'}},
+            'fallbacks': {'type': 'array', 'items': {'$ref': '#/definitions/fallback'}},
+        },
+    },
+}
+
+# flows with pages: the start page takes its fallback message from the first fallback of the start node
+FLOW_SCHEMA = {
+    'definitions': FLOW_DEFINITIONS,
+    'type': 'object',
+    'required': ['key', 'intent', 'question', 'locale', 'startNode', 'flowEntityTypes'],
+    'properties': {
+        'key': {'type': 'string', 'minLength': 1},
+        'intent': {'type': 'string', 'minLength': 1},
+        'question': {'type': 'string', 'minLength': 1},
+        'locale': {'type': 'string'},
+        'startNode': {'allOf': [{'$ref': '#/definitions/node'},
+                                {'required': ['fallbacks'],
+                                 'properties': {'fallbacks': {'type': 'array', 'minItems': 1}}}]},
+        'flowEntityTypes': {'type': ['array', 'null'], 'items': {'$ref': '#/definitions/entityType'}},
+    },
+}
+
+# faq flows are compiled as a single answer, the text of the start node and its chips
+FAQ_SCHEMA = {
+    'definitions': FLOW_DEFINITIONS,
+    'type': 'object',
+    'required': ['key', 'intent', 'question', 'locale', 'startNode'],
+    'properties': {
+        'key': {'type': 'string', 'minLength': 1},
+        'intent': {'type': 'string', 'minLength': 1},
+        'question': {'type': 'string', 'minLength': 1},
+        'locale': {'type': 'string'},
+        'startNode': {'$ref': '#/definitions/node'},
+    },
+}
+
+
+class SchemaUtilsError(Exception):
+    """Custom exception for SchemaUtils class."""
+    pass
+
+
+class SchemaUtils:
+    """Validators compiled from json schemas, which report every error with its path in the record.
+
+    Only the keywords used by the schemas of this module are supported: type, required, properties,
+    items, minItems, minLength, allOf, anyOf, $ref and definitions. compile walks the schema once and returns a
+    tree of closures, so checking a record doesn't read the schema again. A NaN, the value of a missing
+    field in a dataframe record, is checked as null.
+    """
+
+    TYPES = {
+        'object': lambda value: isinstance(value, dict),
+        'array': lambda value: isinstance(value, list),
+        'string': lambda value: isinstance(value, str),
+        'boolean': lambda value: isinstance(value, bool),
+        'integer': lambda value: isinstance(value, int) and not isinstance(value, bool),
+        'number': lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+        'null': lambda value: value is None or (isinstance(value, float) and math.isnan(value)),
+    }
+
+    @staticmethod
+    def compile(schema: dict):
+        """Compile a json schema into a validator.
+
+        Returns:
+            callable: validator(value) -> list of errors such as 'startNode.chips[2].location.text: is required',
+                empty when the value is valid.
+        """
+        validators = {}
+        for name, definition in schema.get('definitions', {}).items():
+            validators[f'#/definitions/{name}'] = SchemaUtils._compile(definition, validators)
+        check = SchemaUtils._compile(schema, validators)
+
+        def validate(value) -> list[str]:
+            errors = []
+            check(value, '', errors)
+            return errors
+        return validate
+
+    @staticmethod
+    def flow_errors(flow: dict) -> list[str]:
+        """Errors of a flow record against FAQ_SCHEMA or FLOW_SCHEMA, depending on its intent."""
+        intent = flow.get('intent') if isinstance(flow, dict) else None
+        if isinstance(intent, str) and intent.startswith('faq'):
+            return validate_faq(flow)
+        return validate_flow(flow)
+
+    @staticmethod
+    def _compile(schema, validators):
+        checks = []
+        if '$ref' in schema:
+            reference = schema['$ref']
+            if not reference.startswith('#/definitions/'):
+                raise SchemaUtilsError(f'Unsupported reference {reference}')
+            # looked up when the record is checked, so a definition can reference itself
+            checks.append(lambda value, path, errors: validators[reference](value, path, errors))
+        for sub_schema in schema.get('allOf', []):
+            checks.append(SchemaUtils._compile(sub_schema, validators))
+        if 'anyOf' in schema:
+            alternatives = [SchemaUtils._compile(sub_schema, validators) for sub_schema in schema['anyOf']]
+
+            def check_any_of(value, path, errors):
+                alternative_errors = []
+                for alternative in alternatives:
+                    alternative_errors.append([])
+                    alternative(value, path, alternative_errors[-1])
+                    if not alternative_errors[-1]:
+                        return
+                # the errors of the closest alternative
+                errors.extend(min(alternative_errors, key=len))
+            checks.append(check_any_of)
+
+        keyword_checks = []
+        if 'required' in schema:
+            required = list(schema['required'])
+
+            def check_required(value, path, errors):
+                for key in required:
+                    if key not in value:
+                        errors.append(f'{SchemaUtils._join(path, key)}: is required')
+            keyword_checks.append(('object', check_required))
+        if 'properties' in schema:
+            properties = [(key, SchemaUtils._compile(sub_schema, validators))
+                          for key, sub_schema in schema['properties'].items()]
+
+            def check_properties(value, path, errors):
+                for key, check in properties:
+                    if key in value:
+                        check(value[key], SchemaUtils._join(path, key), errors)
+            keyword_checks.append(('object', check_properties))
+        if 'minItems' in schema:
+            min_items = schema['minItems']
+
+            def check_min_items(value, path, errors):
+                if len(value) < min_items:
+                    errors.append(f'{path or "(root)"}: expected at least {min_items} items, got {len(value)}')
+            keyword_checks.append(('array', check_min_items))
+        if 'items' in schema:
+            check_item = SchemaUtils._compile(schema['items'], validators)
+
+            def check_items(value, path, errors):
+                for i, item in enumerate(value):
+                    check_item(item, f'{path}[{i}]', errors)
+            keyword_checks.append(('array', check_items))
+        if 'minLength' in schema:
+            min_length = schema['minLength']
+
+            def check_min_length(value, path, errors):
+                if len(value) < min_length:
+                    errors.append(f'{path or "(root)"}: expected at least {min_length} characters')
+            keyword_checks.append(('string', check_min_length))
+
+        types = schema.get('type')
+        types = [types] if isinstance(types, str) else types
+        for type_name in types or []:
+            if type_name not in SchemaUtils.TYPES:
+                raise SchemaUtilsError(f'Unsupported type {type_name}')
+        is_types = [SchemaUtils.TYPES[type_name] for type_name in types or []]
+
+        def check(value, path, errors):
+            for sub_check in checks:
+                sub_check(value, path, errors)
+            if is_types and not any(is_type(value) for is_type in is_types):
+                errors.append(f"{path or '(root)'}: expected {' or '.join(types)}, got {SchemaUtils._type_name(value)}")
+                return
+            for type_name, keyword_check in keyword_checks:
+                # the keywords only apply to values of their type, like in json schema
+                if SchemaUtils.TYPES[type_name](value):
+                    keyword_check(value, path, errors)
+        return check
+
+    @staticmethod
+    def _join(path, key):
+        return f'{path}.{key}' if path else key
+
+    @staticmethod
+    def _type_name(value):
+        for type_name in ('null', 'boolean', 'integer', 'number', 'string', 'array', 'object'):
+            if SchemaUtils.TYPES[type_name](value):
+                return type_name
+        return type(value).__name__
+
+
+# compiled once, when the module is imported
+validate_flow = SchemaUtils.compile(FLOW_SCHEMA)
+validate_faq = SchemaUtils.compile(FAQ_SCHEMA)
@@ -0,0 +1,158 @@
+import hashlib
+import json
+
+from loggers.logger import get_logger
+
+
+info_logger = get_logger("info")
+error_logger = get_logger("error")
+debug_logger = get_logger("debug")
+
+
+# display name prefix of the flows written by SubtreeUtils.share_subtrees
+SHARED_FLOW_PREFIX = 'shared-subtree-'
+# pages a sub tree must have to be deployed once in a shared flow, a smaller one is cheaper to repeat
+MIN_SHARED_PAGES = 3
+# shared flows written at most, dialogflow limits the flows of an agent: the smaller sub trees stay in their flows
+MAX_SHARED_FLOWS = 20
+
+
+class SubtreeUtils:
+    """Deploy the identical sub trees of the compiled flows once, in shared flows.
+
+    A sub tree is a page under a chip and all the pages under it. Two sub trees are identical when
+    their pages are the same once named relative to the parent of their first page, in the default
+    locale and in the translations. Each sub tree found twice or more, in the same flow or in
+    several, is moved to a flow named shared-subtree-<hash> without start page (entry_page), and
+    the flows keep a copy of its first page with target_flow, like PartitionUtils does with the
+    sub flows: the route from the parent page enters the shared flow, where the same condition
+    leads to the page. The biggest sub trees are shared first, the repeated sub trees inside a shared
+    one are not shared again, and once max_flows shared flows are planned the others stay in their flows.
+    The shared flows that no flow routes to anymore are deleted after the deploy, see
+    DialogflowServiceCX.delete_unused_shared_flows.
+    """
+
+    @staticmethod
+    def share_subtrees(flows: list[dict], translations: dict = None,
+                       min_pages: int = MIN_SHARED_PAGES,
+                       max_flows: int = MAX_SHARED_FLOWS) -> tuple[list[dict], dict]:
+        """Replace the repeated sub trees of the flows by routes to shared flows.
+
+        Args:
+            flows (list[dict]): compiled flows, before they are split by PartitionUtils.
+            translations (dict, optional): locale -> compiled translations, like compiled['translations'].
+            min_pages (int, optional): pages of the smallest sub tree to share. Defaults to MIN_SHARED_PAGES.
+            max_flows (int, optional): shared flows written at most. Defaults to MAX_SHARED_FLOWS.
+
+        Returns:
+            tuple: the flows followed by the shared flows, and the translations with the pages of the
+                shared flows.
+        """
+        translations = translations or {}
+        # hash -> (flow index, page) of the first page of each sub tree, and the relative pages of the sub tree
+        occurrences = {}
+        relative_subtrees = {}
+        for index, flow in enumerate(flows):
+            if flow.get('entry_page'):
+                continue
+            for root, pages in SubtreeUtils._subtrees(flow):
+                if len({page['display_name'] for page in pages}) < min_pages:
+                    continue
+                relative = [SubtreeUtils._relative_page(page, root) for page in pages]
+                localized = {locale: [translation.get('flows', {}).get(flow['display_name'], {})
+                                      .get('pages', {}).get(page['display_name']) for page in pages]
+                             for locale, translation in sorted(translations.items())}
+                key = hashlib.sha1(json.dumps([relative, localized], sort_keys=True, default=str)
+                                   .encode('utf-8')).hexdigest()
+                occurrences.setdefault(key, []).append((index, root))
+                relative_subtrees[key] = relative, localized
+
+        # flow index -> display name of the first page of each shared sub tree -> shared flow
+        shared_roots = {}
+        shared_flows = []
+        skipped = 0
+        shared_translations = {locale: dict(translation.get('flows', {})) for locale, translation in translations.items()}
+        for key, roots in sorted(occurrences.items(), key=lambda item: -len(relative_subtrees[item[0]][0])):
+            roots = [(index, root) for index, root in roots
+                     if not SubtreeUtils._inside(root['display_name'], shared_roots.get(index, {}))]
+            if len(roots) < 2:
+                continue
+            if len(shared_flows) >= max_flows:
+                skipped += 1
+                continue
+            display_name = f'{SHARED_FLOW_PREFIX}{key[:10]}'
+            for index, root in roots:
+                shared_roots.setdefault(index, {})[root['display_name']] = display_name
+            relative, localized = relative_subtrees[key]
+            pages = [SubtreeUtils._absolute_page(page, display_name) for page in relative]
+            shared_flows.append({'display_name': display_name, 'entry_page': display_name, 'intent': None,
+                                 'locale': flows[roots[0][0]].get('locale'), 'subpages': pages})
+            for locale, localized_pages in localized.items():
+                page_translations = {page['display_name']: translation for page, translation in zip(pages, localized_pages)
+                                     if translation is not None}
+                if page_translations:
+                    shared_translations[locale][display_name] = {'pages': page_translations}
+        if skipped:
+            error_logger.warning(f'{skipped} repeated sub trees are kept in their flows, over {max_flows} shared flows')
+        if not shared_flows:
+            return flows, translations
+
+        deployed = []
+        for index, flow in enumerate(flows):
+            roots = shared_roots.get(index)
+            if not roots:
+                deployed.append(flow)
+                continue
+            subpages = []
+            for page in flow['subpages']:
+                if page['display_name'] in roots:
+                    subpages.append({**page, 'target_flow': roots[page['display_name']]})
+                elif not SubtreeUtils._inside(page['display_name'], roots):
+                    subpages.append(page)
+            deployed.append({**flow, 'subpages': subpages})
+        moved = sum(len(roots) for roots in shared_roots.values())
+        info_logger.info(f"{moved} sub trees of the flows deployed once in {len(shared_flows)} shared flows")
+        return deployed + shared_flows, {locale: {**translation, 'flows': shared_translations[locale]}
+                                                  for locale, translation in translations.items()}
+
+    @staticmethod
+    def _subtrees(flow):
+        """(first page, pages) of the sub tree under each page of the flow that is not an end page.
+
+        The pages are named by their path from the start page, so the pages of a sub tree are the ones
+        whose name starts with the name of its first page, in their order in the flow.
+        """
+        roots = {}
+        subtrees = {}
+        for page in flow['subpages']:
+            if page['parent'] is None:
+                continue
+            if not page['is_end_flow'] and not page.get('target_flow'):
+                roots.setdefault(page['display_name'], page)
+            parts = page['display_name'].split(' > ')
+            for end in range(2, len(parts) + 1):
+                subtrees.setdefault(' > '.join(parts[:end]), []).append(page)
+        for display_name, root in roots.items():
+            yield root, subtrees[display_name]
+
+    @staticmethod
+    def _relative_page(page, root):
+        """The page named from the parent of the first page of its sub tree, whose depth is 1."""
+        relative = {key: value for key, value in page.items() if key != 'page_group'}
+        relative['display_name'] = page['display_name'][len(root['parent']):]
+        relative['parent'] = None if page['parent'] == root['parent'] else page['parent'][len(root['parent']):]
+        relative['depth'] = page['depth'] - root['depth'] + 1
+        return relative
+
+    @staticmethod
+    def _absolute_page(relative, flow_name):
+        display_name = flow_name + relative['display_name']
+        group = display_name.split(">")
+        return {**relative,
+                'display_name': display_name,
+                'parent': flow_name if relative['parent'] is None else flow_name + relative['parent'],
+                'page_group': group[1].strip() if len(group) >= 2 else None}
+
+    @staticmethod
+    def _inside(display_name, roots):
+        return any(display_name == root or display_name.startswith(f'{root} > ') for root in roots)
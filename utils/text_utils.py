@@ -0,0 +1,21 @@
+import unidecode
+
+
+class TextUtils:
+    """Text helpers without dependencies on the contentful or dialogflow libraries,
+    so the modules that compile contentful data can import them without loading the api clients.
+    """
+
+    @staticmethod
+    def clean_display_name(name: str):
+        """Convert special chars to valid chars or -
+
+        Returns:
+            Información converted to Informacion
+        """
+        # Convert chars no ASCII to the equivalent ASCII
+        cleaned_name = unidecode.unidecode(name)
+        # only valid chars or -
+        cleaned_name = ''.join(
+            ch for ch in cleaned_name if ch.isalnum() or ch == '-')
+        return cleaned_name
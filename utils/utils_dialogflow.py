@@ -1,10 +1,10 @@
-import unidecode
 from google.cloud.dialogflowcx_v3beta1.types.response_message import ResponseMessage
 from google.cloud.dialogflowcx_v3beta1.types.page import Page
 from google.cloud import dialogflowcx_v3beta1 as dialogflowcx
 from google.protobuf import struct_pb2
 
 from loggers.logger import get_logger
+from utils.text_utils import TextUtils
 
 
 info_logger = get_logger("info")
@@ -197,48 +197,27 @@ class DialogFlowUtils:
         Returns:
             Información converted to Informacion
         """
-        # Convert chars no ASCII to the equivalent ASCII
-        cleaned_name = unidecode.unidecode(name)
-        # only valid chars or -
-        cleaned_name = ''.join(
-            ch for ch in cleaned_name if ch.isalnum() or ch == '-')
-        return cleaned_name
-
-    # @staticmethod
-    # def add_condition_route_to_page(father_page, condition, children_page_parent, pages_manager):
-    #     try:
-    #         # Verificar si la condición ya existe en las rutas de transición de la página padre
-    #         if not any(route.condition == condition for route in father_page.transition_routes):
-    #             route = dialogflowcx.TransitionRoute(condition=condition, target_page=children_page_parent)
-    #             father_page.transition_routes.append(route)
-    #         else:
-    #             warning_logger.warning(f"La condición '{condition}' ya existe en la página {father_page.display_name}.")
-    #     except Exception as e:
-    #         error_logger.error("error adding transition route to page:" + str(e))
-    #         # raise Exception("error adding transition route to page:" + str(e))
-    #     return pages_manager.update_page(father_page)
+        return TextUtils.clean_display_name(name)
 
     # para agregar los entry fulfillment a los parametros de rutas
     @staticmethod
     def add_condition_route_to_page(father_page, condition,  pages_manager, children_page_parent=None, entry_fulfillment=None):
+        """Add a conditional route to a page, replacing the route with the same condition and target if it exists."""
         try:
-            # Verificar si alguna condición en las rutas de transición ya utiliza el mismo nombre de parámetro
-            #if not any(route.condition.startswith(param_name) for route in father_page.transition_routes):
-                # Si children_page_parent es None, no asignamos target_page
-                if children_page_parent:
-                    route = dialogflowcx.TransitionRoute(condition=condition, target_page=children_page_parent)
-                else:
-                    route = dialogflowcx.TransitionRoute(condition=condition)
-
-                # Si se proporciona un entry_fulfillment, lo agregamos a la ruta de transición
-                if entry_fulfillment:
-                    route.trigger_fulfillment = dialogflowcx.Fulfillment(
-                        messages=[dialogflowcx.ResponseMessage(text=dialogflowcx.ResponseMessage.Text(text=[entry_fulfillment]))]
-                    )
+            # Si children_page_parent es None, no asignamos target_page
+            if children_page_parent:
+                route = dialogflowcx.TransitionRoute(condition=condition, target_page=children_page_parent)
+            else:
+                route = dialogflowcx.TransitionRoute(condition=condition)
 
-                father_page.transition_routes.append(route)
-           # else:
-            #   warning_logger.warning(f"La condición con el parámetro '{param_name}' ya existe en la página {father_page.display_name}.")
+            # Si se proporciona un entry_fulfillment, lo agregamos a la ruta de transición
+            if entry_fulfillment:
+                route.trigger_fulfillment = dialogflowcx.Fulfillment(
+                    messages=[dialogflowcx.ResponseMessage(text=dialogflowcx.ResponseMessage.Text(text=[entry_fulfillment]))]
+                )
+
+            father_page.transition_routes = DialogFlowUtils.reconcile_transition_routes(
+                father_page.transition_routes, [route], keep_existing=True)
         except Exception as e:
             error_logger.error("error adding transition route to page:" + str(e))
         return pages_manager.update_page(father_page)
@@ -269,6 +248,115 @@ class DialogFlowUtils:
             error_logger.error("Error al agregar fulfillment a la ruta: " + str(e))
 
 
+    @staticmethod
+    def build_transition_route(route: dict, page_names: dict, flow_names: dict = None):
+        """Build a TransitionRoute from a route of RouteUtils.plan_page_routes.
+
+        Args:
+            route (dict): condition, target_page (display name or None), fulfillment (text or None) and
+                target_flow (display name of a sub flow, optional).
+            page_names (dict): page display name -> page resource name.
+            flow_names (dict, optional): flow display name -> flow resource name, for the routes with target_flow.
+        """
+        transition_route = dialogflowcx.TransitionRoute(condition=route['condition'])
+        if route.get('target_flow'):
+            transition_route.target_flow = flow_names[route['target_flow']]
+        elif route['target_page']:
+            transition_route.target_page = page_names[route['target_page']]
+        if route['fulfillment']:
+            transition_route.trigger_fulfillment = dialogflowcx.Fulfillment(
+                messages=[dialogflowcx.ResponseMessage(text=dialogflowcx.ResponseMessage.Text(text=[route['fulfillment']]))]
+            )
+        return transition_route
+
+    @staticmethod
+    def build_faq_route(intent_name: str, faq: dict):
+        """Intent route that answers a faq with its text and chips, without changing the page."""
+        return dialogflowcx.TransitionRoute(
+            intent=intent_name,
+            trigger_fulfillment=dialogflowcx.Fulfillment(messages=DialogFlowUtils.build_entry_fulfillment_from_page(faq)))
+
+    @staticmethod
+    def localize_transition_routes(transition_routes, texts: dict) -> list:
+        """Copy of the routes with the texts of their trigger fulfillments in another language.
+
+        Args:
+            transition_routes: routes of a page or group in the default language.
+            texts (dict): default text -> text in the language, the other texts are kept.
+        """
+        routes = []
+        for route in transition_routes:
+            route = dialogflowcx.TransitionRoute(route)
+            for message in route.trigger_fulfillment.messages:
+                if 'text' in message:
+                    message.text.text = [texts.get(text, text) for text in message.text.text]
+            routes.append(route)
+        return routes
+
+    @staticmethod
+    def route_key(route) -> tuple:
+        """Identity of a route: its condition, intent and target. Routes with the same key are duplicates."""
+        return route.condition, route.intent, route.target_page, route.target_flow
+
+    @staticmethod
+    def reconcile_transition_routes(existing_routes, desired_routes, key=None, keep_existing=False) -> list:
+        """Routes to write so a resource ends with the desired routes, each one once.
+
+        Args:
+            existing_routes: routes of the page, flow or group in dialogflow.
+            desired_routes: routes it must have, a desired route replaces the existing one with its key.
+            key (callable, optional): identity of a route. Defaults to route_key.
+            keep_existing (bool, optional): keep the existing routes that are not desired, in their position,
+                for resources shared with routes not written by the migration. Defaults to False, the desired
+                routes replace all the existing ones.
+
+        Returns:
+            list: routes without duplicates, the existing ones first when they are kept.
+        """
+        key = key or DialogFlowUtils.route_key
+        routes = {}
+        if keep_existing:
+            for route in existing_routes:
+                routes.setdefault(key(route), route)
+        desired_keys = set()
+        for route in desired_routes:
+            route_key = key(route)
+            if route_key not in desired_keys:
+                desired_keys.add(route_key)
+                routes[route_key] = route
+        return list(routes.values())
+
+    @staticmethod
+    def same_routes(routes, other_routes) -> bool:
+        """True when both lists have the same routes in the same order, ignoring the ids given by dialogflow."""
+        def without_name(route):
+            route = dialogflowcx.TransitionRoute(route)
+            route.name = ''
+            return route
+        return len(routes) == len(other_routes) and \
+            all(without_name(route) == without_name(other) for route, other in zip(routes, other_routes))
+
+    @staticmethod
+    def set_routes_on_page(father_page, transition_routes, route_group_names, pages_manager, managed_group_names=()):
+        """Write the routes and route groups of a page in one update.
+
+        The routes of the page are replaced by the desired ones, so the routes left by previous runs
+        (duplicates, conditions that changed) are removed. The route groups written by the migration
+        (managed_group_names) are replaced too, the other groups of the page are kept. The page is
+        not updated when it already has those routes and groups.
+        """
+        routes = DialogFlowUtils.reconcile_transition_routes(father_page.transition_routes, transition_routes)
+        route_group_names = list(dict.fromkeys(route_group_names))
+        groups = [name for name in dict.fromkeys(father_page.transition_route_groups)
+                  if name not in managed_group_names and name not in route_group_names] + route_group_names
+        if DialogFlowUtils.same_routes(father_page.transition_routes, routes) and \
+                list(father_page.transition_route_groups) == groups:
+            debug_logger.debug(f"Routes of page {father_page.display_name} are up to date")
+            return father_page
+        father_page.transition_routes = routes
+        father_page.transition_route_groups = groups
+        return pages_manager.update_page_routes(father_page)
+
     @staticmethod
     def find_subpage_in_subpages_by_display_name(subpages: list[dict], display_name: str):
         for subpage in subpages: